@@ -0,0 +1,74 @@
+"""
+Compares reading a clokta.cfg with many profiles using configparser (the old way) against ConfigFile, when it has
+to parse the file, when a previous run cached it on disk and when this run has already read it.
+
+    python benchmarks/bench_config_parse.py [--profiles 500] [--repeat 20]
+"""
+import argparse
+import configparser
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from clokta.config_file import ConfigFile  # noqa: E402
+
+
+def write_config(path, profiles):
+    lines = ['[DEFAULT]', 'okta_username = doej', 'save_password_in_keychain = True',
+             'multifactor_preference = Okta Verify with Push', '']
+    for i in range(profiles):
+        lines += ['[profile{}]'.format(i),
+                  'okta_aws_app_url = https://example.okta.com/home/amazon_aws/0oa{:016d}/272'.format(i),
+                  'okta_aws_role_to_assume = arn:aws:iam::{:012d}:role/Admin'.format(i),
+                  'aws_account_number = {:012d}'.format(i),
+                  '']
+    with open(path, 'w') as file:
+        file.write('\n'.join(lines))
+
+
+def with_configparser(path):
+    parser = configparser.ConfigParser()
+    parser.read(path)
+    return parser.get('profile0', 'okta_aws_app_url')
+
+
+def forget_parsed():
+    ConfigFile._ConfigFile__parsed.clear()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--profiles', type=int, default=500, help='profiles in clokta.cfg')
+    arg_parser.add_argument('--repeat', type=int, default=20, help='how many times to read the file')
+    args = arg_parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(work_dir, 'clokta.cfg')
+        write_config(path, args.profiles)
+        assert ConfigFile.load(path).get('profile0', 'okta_aws_app_url') == with_configparser(path)
+
+        def time_it(function, setup=lambda: None):
+            return min(timeit.repeat(function, setup=setup, number=1, repeat=args.repeat))
+
+        def parse():
+            os.remove(path + ConfigFile.CACHE_SUFFIX)
+            forget_parsed()
+            ConfigFile.load(path)
+
+        print('{} profiles, {:.0f} KB'.format(args.profiles, os.path.getsize(path) / 1024.0))
+        print('configparser:             {:8.3f} ms'.format(time_it(lambda: with_configparser(path)) * 1000))
+        print('ConfigFile, parsing:      {:8.3f} ms'.format(time_it(parse) * 1000))
+        print('ConfigFile, disk cache:   {:8.3f} ms'.format(
+            time_it(lambda: ConfigFile.load(path), setup=forget_parsed) * 1000))
+        print('ConfigFile, already read: {:8.3f} ms'.format(time_it(lambda: ConfigFile.load(path)) * 1000))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Stress test of concurrent writers to an AWS credentials file.  Starts N processes that each save keys for their
+own profile over and over into a credentials file already holding many profiles, then checks every writer's
+last keys made it into the file.  Compares parsing and rewriting the whole file with no lock (the old way)
+against CredentialsFile.
+
+    python benchmarks/bench_credentials_writers.py [--writers 8] [--writes 25] [--profiles 300]
+"""
+import argparse
+import configparser
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from clokta.credentials_file import CredentialsFile  # noqa: E402
+
+
+def keys(writer, write):
+    return {
+        'aws_access_key_id': 'ASIA{:04d}{:08d}'.format(writer, write),
+        'aws_secret_access_key': 'secret-{}-{}'.format(writer, write),
+        'aws_session_token': 'token-{}-{}'.format(writer, write) * 20,
+        'x_security_token_expires': '2030-01-01T00:00:00Z'
+    }
+
+
+def write_with_configparser(path, profile, options):
+    parser = configparser.ConfigParser()
+    parser.read(path)
+    if not parser.has_section(profile):
+        parser.add_section(profile)
+    for option, value in options.items():
+        parser[profile][option] = value
+    with open(path, 'w') as file:
+        parser.write(file)
+
+
+def write_with_credentials_file(path, profile, options):
+    CredentialsFile(path).update({profile: options})
+
+
+WRITERS = {
+    'configparser': write_with_configparser,
+    'CredentialsFile': write_with_credentials_file,
+}
+
+
+def writer_process(name, path, writer, writes, start_at):
+    while time.time() < start_at:
+        time.sleep(0.001)
+    failures = 0
+    for write in range(writes):
+        try:
+            WRITERS[name](path, 'writer{}'.format(writer), keys(writer, write))
+        except configparser.Error:
+            # Read a half written file
+            failures += 1
+    sys.exit(min(failures, 100))
+
+
+def seed(path, profiles):
+    with open(path, 'w') as file:
+        for i in range(profiles):
+            file.write('[existing{}]\n'.format(i))
+            for option, value in keys(9999, i).items():
+                file.write('{} = {}\n'.format(option, value))
+            file.write('\n')
+
+
+def check(path, writers, writes, profiles):
+    """
+    :return: how many writers' last keys are missing, how many existing profiles were lost, and whether the
+        file could be parsed
+    """
+    parser = configparser.ConfigParser()
+    try:
+        parser.read(path)
+    except configparser.Error:
+        return writers, profiles, False
+    lost_writes = sum(1 for writer in range(writers)
+                      if not parser.has_section('writer{}'.format(writer)) or
+                      parser.get('writer{}'.format(writer), 'aws_access_key_id') !=
+                      keys(writer, writes - 1)['aws_access_key_id'])
+    lost_profiles = sum(1 for i in range(profiles) if not parser.has_section('existing{}'.format(i)))
+    return lost_writes, lost_profiles, True
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--writers', type=int, default=8, help='concurrent processes')
+    arg_parser.add_argument('--writes', type=int, default=25, help='times each process saves its keys')
+    arg_parser.add_argument('--profiles', type=int, default=300, help='profiles already in the file')
+    args = arg_parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        print('{:<16} {:>9} {:>12} {:>15} {:>15} {:>14} {:>10}'.format(
+            'writer', 'time s', 'ms / write', 'failed writes', 'lost last keys', 'lost profiles', 'parseable'))
+        for name in WRITERS:
+            path = os.path.join(work_dir, name, 'credentials')
+            os.makedirs(os.path.dirname(path))
+            seed(path, args.profiles)
+            start_at = time.time() + 0.5
+            processes = [multiprocessing.Process(target=writer_process,
+                                                 args=(name, path, writer, args.writes, start_at))
+                         for writer in range(args.writers)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+            failed_writes = sum(process.exitcode for process in processes)
+            elapsed = time.time() - start_at
+            lost_writes, lost_profiles, parseable = check(path, args.writers, args.writes, args.profiles)
+            print('{:<16} {:>9.2f} {:>12.2f} {:>15} {:>15} {:>14} {:>10}'.format(
+                name, elapsed, elapsed * 1000 / (args.writers * args.writes),
+                '{}/{}'.format(failed_writes, args.writers * args.writes),
+                '{}/{}'.format(lost_writes, args.writers),
+                '{}/{}'.format(lost_profiles, args.profiles),
+                'yes' if parseable else 'no'))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
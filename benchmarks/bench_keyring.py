@@ -0,0 +1,181 @@
+"""
+Counts calls to the keychain, and the time they take, when every call to the keychain is slow (as on macOS
+when the keychain must be unlocked or on a busy Secret Service).  Uses a fake keyring backend, so your real
+keychain is never touched.
+
+    python benchmarks/bench_keyring.py [--delay 0.2]
+
+Before secrets were read lazily every run read both secrets from the keychain and saved the password back.
+The login scenarios run the whole login against the local fake Okta in benchmarks/fake_okta.py with a
+throwaway HOME, once the locally recorded Okta session expiry has passed, so clokta can't tell whether the
+session cookie still works.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import keyring
+from keyring.backend import KeyringBackend
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from clokta.clokta_configuration import CloktaConfiguration  # noqa: E402
+from clokta.cookie_store import CookieStore  # noqa: E402
+from fake_okta import FakeOkta  # noqa: E402
+
+
+class SlowKeyring(KeyringBackend):
+    """ An in-memory keyring where every call takes a while """
+    priority = 1
+
+    def __init__(self, delay):
+        super(SlowKeyring, self).__init__()
+        self.delay = delay
+        self.passwords = {}
+        self.reads = 0
+        self.writes = 0
+
+    def get_password(self, service, username):
+        time.sleep(self.delay)
+        self.reads += 1
+        return self.passwords.get((service, username))
+
+    def set_password(self, service, username, password):
+        time.sleep(self.delay)
+        self.writes += 1
+        self.passwords[(service, username)] = password
+
+    def delete_password(self, service, username):
+        self.passwords.pop((service, username), None)
+
+
+def write_clokta_cfg(path, profiles):
+    with open(path, 'w') as cfg:
+        cfg.write('[DEFAULT]\nokta_username = doej\nsave_password_in_keychain = True\n')
+        for profile in profiles:
+            cfg.write('\n[{}]\nokta_aws_app_url = https://example.okta.com/home/amazon_aws/{}/272\n'.format(
+                profile, profile))
+
+
+def run(backend, clokta_cfg, profiles, needs_password):
+    """
+    One clokta process logging into the profiles
+    :param needs_password: whether the Okta session has expired, so the password is needed
+    """
+    CloktaConfiguration._CloktaConfiguration__keyring_values.clear()
+    backend.reads = backend.writes = 0
+    start = time.perf_counter()
+    for profile in profiles:
+        clokta_config = CloktaConfiguration(profile_name=profile, clokta_config_file=clokta_cfg)
+        if needs_password:
+            assert clokta_config.get('okta_password') == 'secret'
+        clokta_config.update_configuration()
+    return backend.reads, backend.writes, time.perf_counter() - start
+
+
+def run_login(backend, fake, home, okta_session_alive):
+    """
+    One clokta process logging in after the recorded Okta session expiry has passed
+    :param okta_session_alive: whether Okta still honours the session cookie
+    """
+    from clokta.common import Common
+    from clokta.role_assumer import RoleAssumer
+
+    cookie_dir = os.path.join(home, '.clokta', CookieStore.COOKIE_DIR)
+    cookie_files = [name for name in os.listdir(cookie_dir) if name.endswith('.json')] \
+        if os.path.isdir(cookie_dir) else []
+    for name in cookie_files:
+        with open(os.path.join(cookie_dir, name)) as file:
+            stored = json.load(file)
+        stored['session_expires_at'] = time.time() - 3600
+        with open(os.path.join(cookie_dir, name), 'w') as file:
+            json.dump(stored, file)
+    if not okta_session_alive:
+        fake.expire_sessions()
+    saml_cache = os.path.join(home, '.clokta', 'saml_assertions.json')
+    if os.path.exists(saml_cache):
+        os.remove(saml_cache)
+    CookieStore._CookieStore__stores.clear()
+    CloktaConfiguration._CloktaConfiguration__keyring_values.clear()
+
+    backend.reads = backend.writes = 0
+    Common.set_output_format(Common.quiet_out)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        RoleAssumer(profile='team0').assume_role(reset_default_role=False, force=True)
+    return backend.reads, backend.writes, time.perf_counter() - start
+
+
+def login_scenarios(backend):
+    """ Time logging in with and without a working Okta session cookie """
+    fake = FakeOkta(mfa='none', password='secret').start()
+    home = tempfile.mkdtemp(prefix='clokta-bench-')
+    saved_env = dict(os.environ)
+    try:
+        os.environ['HOME'] = home
+        os.environ['AWS_ENDPOINT_URL_STS'] = fake.sts_url
+        os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+        os.makedirs(os.path.join(home, '.clokta'))
+        clokta_cfg = os.path.join(home, '.clokta', 'clokta.cfg')
+        with open(clokta_cfg, 'w') as cfg:
+            cfg.write('[DEFAULT]\nokta_username = doej\nsave_password_in_keychain = True\n')
+            cfg.write('\n[team0]\nokta_aws_app_url = {}\n'.format(fake.app_url))
+        clokta_config = CloktaConfiguration(profile_name='team0', clokta_config_file=clokta_cfg)
+        clokta_config.parameters['okta_password'].value = 'secret'
+        clokta_config.update_configuration()
+
+        # The first login starts the Okta session
+        run_login(backend, fake, home, okta_session_alive=False)
+        return [
+            ('login, session expiry passed, cookie ok', run_login(backend, fake, home, okta_session_alive=True)),
+            ('login, session expiry passed, expired', run_login(backend, fake, home, okta_session_alive=False)),
+        ]
+    finally:
+        os.environ.clear()
+        os.environ.update(saved_env)
+        fake.stop()
+        shutil.rmtree(home, ignore_errors=True)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--delay', type=float, default=0.2, help='seconds each keychain call takes')
+    args = arg_parser.parse_args()
+    os.environ.pop('okta_password', None)
+    os.environ.pop('okta_onetimepassword_secret', None)
+
+    backend = SlowKeyring(args.delay)
+    keyring.set_keyring(backend)
+    work_dir = tempfile.mkdtemp()
+    try:
+        clokta_cfg = os.path.join(work_dir, 'clokta.cfg')
+        write_clokta_cfg(clokta_cfg, ['team{}'.format(i) for i in range(5)])
+
+        # Save the password the way the first login would
+        clokta_config = CloktaConfiguration(profile_name='team0', clokta_config_file=clokta_cfg)
+        clokta_config.parameters['okta_password'].value = 'secret'
+        clokta_config.update_configuration()
+
+        print('{:<40} {:>6} {:>7} {:>9} {:>12}'.format('scenario', 'reads', 'writes', 'time s', 'before s'))
+        for name, profiles, needs_password in [
+            ('live Okta session', ['team0'], False),
+            ('expired Okta session', ['team0'], True),
+            ('5 profiles in one process, expired', ['team{}'.format(i) for i in range(5)], True),
+        ]:
+            reads, writes, elapsed = run(backend, clokta_cfg, profiles, needs_password)
+            before = len(profiles) * 3 * args.delay
+            print('{:<40} {:>6} {:>7} {:>9.2f} {:>12.2f}'.format(name, reads, writes, elapsed, before))
+    finally:
+        shutil.rmtree(work_dir)
+    for name, (reads, writes, elapsed) in login_scenarios(backend):
+        print('{:<40} {:>6} {:>7} {:>9.2f} {:>12}'.format(name, reads, writes, elapsed, ''))
+
+
+if __name__ == '__main__':
+    main()
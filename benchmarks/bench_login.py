@@ -0,0 +1,152 @@
+"""
+End-to-end login latency benchmarks.  Runs RoleAssumer.assume_role against the local fake Okta and STS in
+benchmarks/fake_okta.py and reports wall time and request counts for each scenario.
+
+    python benchmarks/bench_login.py [--latency 0.05] [--push-delay 1.0] [--repeat 3] [--scenario NAME ...]
+
+Everything runs against a throwaway HOME, so your real ~/.clokta and ~/.aws are never touched.
+"""
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fake_okta import FakeOkta  # noqa: E402
+
+
+def write_clokta_cfg(home, profile, app_url, mfa):
+    os.makedirs(os.path.join(home, '.clokta'), exist_ok=True)
+    with open(os.path.join(home, '.clokta', 'clokta.cfg'), 'w') as cfg:
+        cfg.write('[DEFAULT]\n')
+        cfg.write('okta_username = doej\n')
+        cfg.write('save_password_in_keychain = False\n')
+        cfg.write('multifactor_preference = {}\n'.format('Okta Verify with Push' if mfa == 'push' else 'Okta Verify'))
+        cfg.write('\n[{}]\n'.format(profile))
+        cfg.write('okta_aws_app_url = {}\n'.format(app_url))
+
+
+class Scenario(object):
+    """ One way a login can go, e.g. a cold login needing MFA or a re-run with a live Okta session """
+
+    def __init__(self, name, description, mfa='push', warm_runs=0, expire_okta_session=False,
+                 expire_saml_cache=True, force=True):
+        """
+        :param warm_runs: logins to do before the timed one, e.g. to establish an Okta session
+        :param expire_okta_session: end the Okta session after the warm runs
+        :param expire_saml_cache: forget cached SAML assertions after the warm runs
+        :param force: log in even if the keys from the warm runs are still good
+        """
+        self.name = name
+        self.description = description
+        self.mfa = mfa
+        self.warm_runs = warm_runs
+        self.expire_okta_session = expire_okta_session
+        self.expire_saml_cache = expire_saml_cache
+        self.force = force
+
+
+SCENARIOS = [
+    Scenario('cold-push', 'first login, password + Okta Verify push', mfa='push'),
+    Scenario('cold-totp', 'first login, password + one time password', mfa='totp'),
+    Scenario('cold-no-mfa', 'first login, password only', mfa='none'),
+    Scenario('okta-session', 're-run with a live Okta session cookie', warm_runs=1),
+    Scenario('expired-session', 're-run after the Okta session expired', warm_runs=1, expire_okta_session=True),
+    Scenario('cached-saml', 're-run within the SAML assertion lifetime', warm_runs=1, expire_saml_cache=False),
+    Scenario('fresh-keys', 're-run while the keys are still good', warm_runs=1, force=False),
+]
+
+
+def run_login(profile, force=True):
+    from clokta.common import Common
+    from clokta.role_assumer import RoleAssumer
+
+    Common.set_output_format(Common.quiet_out)
+    sink = io.StringIO()
+    with contextlib.redirect_stdout(sink), contextlib.redirect_stderr(sink):
+        RoleAssumer(profile=profile).assume_role(reset_default_role=False, force=force)
+
+
+def run_scenario(scenario, args):
+    fake = FakeOkta(mfa=scenario.mfa, push_delay=args.push_delay, latency=args.latency,
+                    fault_rate=args.fault_rate, page_padding_kb=args.page_kb).start()
+    home = tempfile.mkdtemp(prefix='clokta-bench-')
+    saved_env = dict(os.environ)
+    timings = []
+    counts = None
+    try:
+        os.environ['HOME'] = home
+        os.environ['okta_password'] = fake.password
+        os.environ['AWS_ENDPOINT_URL_STS'] = fake.sts_url
+        os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', 'unused')
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'unused')
+        write_clokta_cfg(home, 'bench', fake.app_url, scenario.mfa)
+
+        # OTP answers come from a prompt; feed the fake's code on stdin
+        for _ in range(args.repeat):
+            for _ in range(scenario.warm_runs):
+                with_stdin(fake.totp, run_login, 'bench')
+            if scenario.expire_okta_session:
+                fake.expire_sessions()
+            if scenario.expire_saml_cache:
+                saml_cache = os.path.join(home, '.clokta', 'saml_assertions.json')
+                if os.path.exists(saml_cache):
+                    os.remove(saml_cache)
+            if not scenario.warm_runs:
+                shutil.rmtree(os.path.join(home, '.clokta', 'cookies'), ignore_errors=True)
+
+            fake.reset_counts()
+            start = time.time()
+            with_stdin(fake.totp, run_login, 'bench', scenario.force)
+            timings.append(time.time() - start)
+            counts = dict(fake.requests)
+    finally:
+        os.environ.clear()
+        os.environ.update(saved_env)
+        fake.stop()
+        shutil.rmtree(home, ignore_errors=True)
+    return timings, counts
+
+
+def with_stdin(text, func, *args):
+    saved = sys.stdin
+    sys.stdin = io.StringIO(text + '\n')
+    try:
+        return func(*args)
+    finally:
+        sys.stdin = saved
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every request')
+    arg_parser.add_argument('--push-delay', type=float, default=1.0, help='seconds before a push is approved')
+    arg_parser.add_argument('--fault-rate', type=float, default=0.0, help='fraction of requests failing with a 500')
+    arg_parser.add_argument('--page-kb', type=int, default=100, help='size of the Okta HTML pages')
+    arg_parser.add_argument('--repeat', type=int, default=3, help='timed logins per scenario')
+    arg_parser.add_argument('--scenario', action='append', choices=[s.name for s in SCENARIOS],
+                            help='only run these scenarios')
+    args = arg_parser.parse_args()
+
+    print('{:<16} {:>9} {:>9} {:>9} {:>6} {:>6}  {}'.format(
+        'scenario', 'min ms', 'median ms', 'max ms', 'reqs', 'conns', 'requests by endpoint'))
+    for scenario in SCENARIOS:
+        if args.scenario and scenario.name not in args.scenario:
+            continue
+        timings, counts = run_scenario(scenario, args)
+        timings.sort()
+        by_endpoint = ', '.join('{}={}'.format(k, v) for k, v in sorted(counts.items())
+                                if k not in ('total', 'connections'))
+        print('{:<16} {:>9.1f} {:>9.1f} {:>9.1f} {:>6} {:>6}  {}'.format(
+            scenario.name, timings[0] * 1000, timings[len(timings) // 2] * 1000, timings[-1] * 1000,
+            counts.get('total', 0), counts.get('connections', 0), by_endpoint))
+
+
+if __name__ == '__main__':
+    main()
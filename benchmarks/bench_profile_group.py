@@ -0,0 +1,93 @@
+"""
+Logging into many profiles, each with its own Okta app, one "clokta -p" at a time against logging into them
+all with one "clokta -p a,b,c".  Runs against the local fake Okta and STS in benchmarks/fake_okta.py and reports
+wall time and how many times clokta authenticated with Okta.
+
+    python benchmarks/bench_profile_group.py [--profiles 10] [--latency 0.05] [--push-delay 1.0]
+
+Everything runs against a throwaway HOME, so your real ~/.clokta and ~/.aws are never touched.
+"""
+import argparse
+import configparser
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fake_okta import FakeOkta  # noqa: E402
+
+
+def write_clokta_cfg(home, fake, profiles):
+    os.makedirs(os.path.join(home, '.clokta'), exist_ok=True)
+    with open(os.path.join(home, '.clokta', 'clokta.cfg'), 'w') as cfg:
+        cfg.write('[DEFAULT]\nokta_username = doej\nsave_password_in_keychain = False\n')
+        cfg.write('multifactor_preference = Okta Verify with Push\n')
+        for i, profile in enumerate(profiles):
+            cfg.write('\n[{}]\nokta_aws_app_url = {}/home/amazon_aws/0oa{:013d}/272\n'.format(
+                profile, fake.base_url, i))
+
+
+def login(profile):
+    from clokta.common import Common
+    from clokta.role_assumer import RoleAssumer
+
+    Common.set_output_format(Common.quiet_out)
+    sink = io.StringIO()
+    with contextlib.redirect_stdout(sink), contextlib.redirect_stderr(sink):
+        return RoleAssumer(profile=profile).assume_role(reset_default_role=False, force=True)
+
+
+def run(name, args, logins):
+    """
+    Time a fresh login (no Okta session, no cached SAML assertions) into every profile
+    :param logins: the arguments to give "clokta -p", one login after the other
+    """
+    from clokta.cookie_store import CookieStore
+
+    fake = FakeOkta(mfa='push', push_delay=args.push_delay, latency=args.latency).start()
+    home = tempfile.mkdtemp(prefix='clokta-bench-')
+    saved_env = dict(os.environ)
+    try:
+        os.environ.update(HOME=home, okta_password=fake.password, AWS_ENDPOINT_URL_STS=fake.sts_url,
+                          AWS_DEFAULT_REGION='us-east-1')
+        # Forget the cookies of the previous run, as a new process would
+        CookieStore._CookieStore__stores.clear()
+        profiles = ['team{}'.format(i) for i in range(args.profiles)]
+        write_clokta_cfg(home, fake, profiles)
+        start = time.time()
+        for profile in logins(profiles):
+            login(profile)
+        elapsed = time.time() - start
+
+        parser = configparser.ConfigParser()
+        parser.read(os.path.join(home, '.aws', 'credentials'))
+        assert all(parser.has_section(profile) for profile in profiles)
+        print('{:<24} {:>9.1f} {:>8} {:>8} {:>6}'.format(
+            name, elapsed * 1000, fake.requests.get('/api/v1/authn', 0),
+            fake.requests.get('/home/amazon_aws/{app}', 0), fake.requests.get('total', 0)))
+    finally:
+        os.environ.clear()
+        os.environ.update(saved_env)
+        fake.stop()
+        shutil.rmtree(home, ignore_errors=True)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--profiles', type=int, default=10, help='profiles to log into')
+    arg_parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every request')
+    arg_parser.add_argument('--push-delay', type=float, default=1.0, help='seconds before a push is approved')
+    args = arg_parser.parse_args()
+
+    print('{:<24} {:>9} {:>8} {:>8} {:>6}'.format('login', 'ms', 'authns', 'app gets', 'reqs'))
+    run('one profile at a time', args, lambda profiles: profiles)
+    run('all with -p a,b,c', args, lambda profiles: [','.join(profiles)])
+
+
+if __name__ == '__main__':
+    main()
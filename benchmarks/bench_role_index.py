@@ -0,0 +1,72 @@
+"""
+Compares reading the roles out of a SAML assertion into a list (the old way) against RoleIndex, which parses
+the assertion the same way and also indexes the roles and drops repeats, and finding the configured role by
+searching the list against looking it up in the index.
+
+    python benchmarks/bench_role_index.py [--roles 500] [--repeat 50]
+"""
+import argparse
+import base64
+import os
+import sys
+import timeit
+import tracemalloc
+import xml.etree.ElementTree as ElementTree
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from clokta.awsrole import AwsRole  # noqa: E402
+from clokta.role_index import RoleIndex  # noqa: E402
+from fake_okta import FakeOkta  # noqa: E402
+
+
+def with_element_tree(saml_assertion):
+    roles = []
+    root = ElementTree.fromstring(base64.b64decode(saml_assertion))
+    for attribute in root.iter(RoleIndex.SAML_NS + 'Attribute'):
+        if attribute.get('Name') == RoleIndex.ROLE_ATTRIBUTE:
+            for value in attribute.iter(RoleIndex.SAML_NS + 'AttributeValue'):
+                roles.append(AwsRole(value.text))
+    return roles
+
+
+def peak_memory(function):
+    tracemalloc.start()
+    result = function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, peak
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--roles', type=int, default=500, help='how many roles the assertion grants')
+    arg_parser.add_argument('--repeat', type=int, default=50, help='how many times to parse the assertion')
+    args = arg_parser.parse_args()
+
+    # Okta lists some roles more than once when they come from several groups
+    arns = ['arn:aws:iam::{:012d}:role/Role{}'.format(i // 5, i % 5) for i in range(args.roles)]
+    saml_assertion = FakeOkta(roles=arns + arns[:args.roles // 10]).saml_assertion()
+    preferred = arns[-1]
+
+    tree_roles, tree_peak = peak_memory(lambda: with_element_tree(saml_assertion))
+    index, index_peak = peak_memory(lambda: RoleIndex.from_saml(saml_assertion))
+    assert len(index) == args.roles and len(tree_roles) > args.roles
+
+    print('Assertion: {:.0f} KB, {} role values, {} distinct'.format(
+        len(saml_assertion) / 1024.0, len(tree_roles), len(index)))
+    tree_time = min(timeit.repeat(lambda: with_element_tree(saml_assertion),
+                                  number=args.repeat, repeat=3)) / args.repeat
+    index_time = min(timeit.repeat(lambda: RoleIndex.from_saml(saml_assertion),
+                                   number=args.repeat, repeat=3)) / args.repeat
+    search_time = min(timeit.repeat(lambda: [r for r in tree_roles if r.role_arn == preferred][0],
+                                    number=1000, repeat=3)) / 1000
+    lookup_time = min(timeit.repeat(lambda: index.get(preferred), number=1000, repeat=3)) / 1000
+    print('Parse into list:    {:8.3f} ms  peak {:7.0f} KB'.format(tree_time * 1000, tree_peak / 1024.0))
+    print('Parse into index:   {:8.3f} ms  peak {:7.0f} KB'.format(index_time * 1000, index_peak / 1024.0))
+    print('Search list:        {:8.3f} us'.format(search_time * 1000000))
+    print('Index lookup:       {:8.3f} us'.format(lookup_time * 1000000))
+
+
+if __name__ == '__main__':
+    main()
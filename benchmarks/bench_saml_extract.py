@@ -0,0 +1,67 @@
+"""
+Compares pulling the SAMLResponse out of an Okta app page with BeautifulSoup (the old way) against
+SamlExtractor.
+
+    python benchmarks/bench_saml_extract.py [--size-kb 150] [--repeat 50]
+"""
+import argparse
+import base64
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from clokta.saml_extractor import SamlExtractor  # noqa: E402
+
+
+def build_page(size_kb):
+    """
+    Build a page shaped like the one Okta returns for an AWS app: a big head full of scripts and
+    styles, some navigation markup, and the auto-submitting SAML form at the end.
+    """
+    assertion = base64.b64encode(os.urandom(9000)).decode()
+    script = '<script type="text/javascript">var okta = {{"config": "{}"}};</script>\n'.format('x' * 900)
+    style = '<style>.okta-{0} {{ color: #{0:06x}; margin: 0 auto; }}</style>\n'
+    nav = '<div class="nav"><a href="/app/{0}">App {0}</a><input type="hidden" name="field{0}" value="{0}"></div>\n'
+    parts = ['<!DOCTYPE html><html><head><title>Signing in...</title>\n']
+    index = 0
+    while sum(len(p) for p in parts) < size_kb * 1024:
+        parts.append(script)
+        parts.append(style.format(index))
+        parts.append(nav.format(index))
+        index += 1
+    parts.append('</head><body>\n<form id="appForm" action="https://signin.aws.amazon.com/saml" method="POST">\n')
+    parts.append('<input name="SAMLResponse" type="hidden" value="{}"/>\n'.format(assertion))
+    parts.append('<input name="RelayState" type="hidden" value=""/>\n</form></body></html>\n')
+    return ''.join(parts).encode('utf-8'), assertion
+
+
+def with_soup(content):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, "html.parser")
+    for inputtag in soup.find_all('input'):
+        if inputtag.get('name') == 'SAMLResponse':
+            return inputtag.get('value')
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--size-kb', type=int, default=150, help='approximate size of the Okta page')
+    arg_parser.add_argument('--repeat', type=int, default=50, help='how many times to extract from the page')
+    args = arg_parser.parse_args()
+
+    content, assertion = build_page(args.size_kb)
+    assert SamlExtractor.extract(content) == assertion
+    assert with_soup(content) == assertion
+
+    print('Page size: {:.0f} KB'.format(len(content) / 1024.0))
+    soup_time = min(timeit.repeat(lambda: with_soup(content), number=args.repeat, repeat=3)) / args.repeat
+    fast_time = min(timeit.repeat(lambda: SamlExtractor.extract(content), number=args.repeat, repeat=3)) / args.repeat
+    print('BeautifulSoup:  {:8.3f} ms'.format(soup_time * 1000))
+    print('SamlExtractor:  {:8.3f} ms'.format(fast_time * 1000))
+    print('Speedup:        {:8.1f}x'.format(soup_time / fast_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+Startup cost of the clokta command.  Each run is a fresh "python -m clokta" process, timed from the outside and
+with "python -X importtime" to find how long it spent importing clokta and everything clokta imported.  The
+login runs against the fake Okta and STS in benchmarks/fake_okta.py, in a throwaway HOME.
+
+    python benchmarks/bench_startup.py [--repeat 5] [--budget-scale 1.0]
+
+Exits with 1 if a command took longer to import than its budget in BUDGETS_MS (on its fastest run, multiplied
+by --budget-scale for slow machines) or if a command that doesn't log in loaded a module it has no need of,
+so a change that makes startup slow fails the benchmark.
+"""
+import argparse
+import compileall
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fake_okta import FakeOkta  # noqa: E402
+
+# The commands timed, in the order they run.  A login comes before the commands that reuse its keys.
+COMMANDS = [
+    ('--version', ['--version']),
+    ('--list-accounts', ['--list-accounts']),
+    ('full login', ['-p', 'bench', '--force', '-q']),
+    ('fresh keys', ['-p', 'bench', '-q']),
+    ('credential-process', ['credential-process', '-p', 'bench']),
+]
+
+# Longest each command may spend importing, in milliseconds
+BUDGETS_MS = {
+    '--version': 50,
+    '--list-accounts': 50,
+    'full login': 300,
+    'fresh keys': 50,
+    'credential-process': 50,
+}
+
+# Modules only needed to log in.  Commands that don't log in must not load them.
+LOGIN_ONLY_MODULES = ['asyncio', 'bs4', 'click', 'keyring', 'requests']
+NEVER_MODULES = ['pkg_resources']
+
+CHILD = '''
+import atexit, json, os, sys
+atexit.register(lambda: open(os.environ['CLOKTA_BENCH_MODULES'], 'w').write(json.dumps(sorted(sys.modules))))
+import runpy
+sys.argv[0] = 'clokta'
+runpy.run_module('clokta', run_name='__main__')
+'''
+
+
+def import_ms(importtime_output):
+    """
+    :return: milliseconds spent importing clokta and whatever it imported, leaving out interpreter startup
+    """
+    total = 0
+    counting = False
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        # Only modules imported at the top level, since their cumulative time includes what they imported
+        if module.startswith('  '):
+            continue
+        counting = counting or module.strip().startswith('clokta')
+        if counting:
+            total += int(cumulative)
+    return total / 1000.0
+
+
+def run_command(args, env, root, modules_file):
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD] + args, env=env, cwd=root,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    wall = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError('clokta {} failed:\n{}'.format(' '.join(args), process.stderr))
+    with open(modules_file) as file:
+        modules = set(json.load(file))
+    return wall * 1000, import_ms(process.stderr), modules
+
+
+def interpreter_ms(root, repeat):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, '-c', 'pass'], cwd=root)
+        runs.append((time.perf_counter() - start) * 1000)
+    return min(runs)
+
+
+def write_clokta_cfg(home, app_url):
+    os.makedirs(os.path.join(home, '.clokta'))
+    with open(os.path.join(home, '.clokta', 'clokta.cfg'), 'w') as cfg:
+        cfg.write('[DEFAULT]\nokta_username = doej\nsave_password_in_keychain = False\n')
+        cfg.write('multifactor_preference = Okta Verify\n')
+        for i in range(50):
+            cfg.write('\n[team{}]\nokta_aws_app_url = {}\naws_account_number = {:012d}\n'.format(i, app_url, i))
+        cfg.write('\n[bench]\nokta_aws_app_url = {}\n'.format(app_url))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--repeat', type=int, default=5, help='processes to start per command')
+    arg_parser.add_argument('--budget-scale', type=float, default=1.0, help='multiply every budget by this')
+    args = arg_parser.parse_args()
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+    # Installing clokta compiles it, so don't time compiling it
+    compileall.compile_dir(os.path.join(root, 'clokta'), quiet=1)
+
+    fake = FakeOkta(mfa='none').start()
+    home = tempfile.mkdtemp(prefix='clokta-bench-')
+    modules_file = os.path.join(home, 'modules.json')
+    env = dict(os.environ, HOME=home, PYTHONPATH=root, CLOKTA_BENCH_MODULES=modules_file,
+               okta_password=fake.password, AWS_ENDPOINT_URL_STS=fake.sts_url, AWS_DEFAULT_REGION='us-east-1')
+    env.pop('AWS_PROFILE', None)
+    failures = []
+    try:
+        write_clokta_cfg(home, fake.app_url)
+        print('python -c pass: {:.1f} ms\n'.format(interpreter_ms(root, args.repeat)))
+        print('{:<20} {:>12} {:>14} {:>14} {:>11}'.format(
+            'command', 'wall ms', 'import ms', 'fastest ms', 'budget ms'))
+        for name, command_args in COMMANDS:
+            runs = [run_command(command_args, env, root, modules_file) for _ in range(args.repeat)]
+            walls = sorted(run[0] for run in runs)
+            imports = sorted(run[1] for run in runs)
+            budget = BUDGETS_MS[name] * args.budget_scale
+            print('{:<20} {:>12.1f} {:>14.1f} {:>14.1f} {:>11.0f}'.format(
+                name, walls[len(walls) // 2], imports[len(imports) // 2], imports[0], budget))
+
+            if imports[0] > budget:
+                failures.append('{} spent {:.1f} ms importing, over its budget of {:.0f} ms'.format(
+                    name, imports[0], budget))
+            unwanted = NEVER_MODULES if name == 'full login' else NEVER_MODULES + LOGIN_ONLY_MODULES
+            loaded = sorted(module for module in unwanted if module in runs[-1][2])
+            if loaded:
+                failures.append('{} imported {}'.format(name, ', '.join(loaded)))
+    finally:
+        fake.stop()
+        shutil.rmtree(home, ignore_errors=True)
+
+    if failures:
+        print('\nFAILED:\n    ' + '\n    '.join(failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
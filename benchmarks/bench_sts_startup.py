@@ -0,0 +1,87 @@
+"""
+Cold start cost of calling STS.  Each run is a fresh Python process that imports an STS client, creates it and
+makes one AssumeRoleWithSAML call to the fake STS in benchmarks/fake_okta.py.  Reports wall time (including
+interpreter startup), time spent importing and peak RSS for clokta's own client and for boto3.
+
+    python benchmarks/bench_sts_startup.py [--repeat 5]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fake_okta import FakeOkta  # noqa: E402
+
+CLIENTS = {
+    'clokta': '''
+from clokta.sts_client import StsClient
+imported = time.perf_counter()
+client = StsClient()
+''',
+    'boto3': '''
+import boto3
+imported = time.perf_counter()
+client = boto3.client('sts')
+''',
+}
+
+CHILD_TEMPLATE = '''
+import json, resource, sys, time
+start = time.perf_counter()
+{create_client}
+response = client.assume_role_with_saml(RoleArn=sys.argv[1], PrincipalArn=sys.argv[2], SAMLAssertion=sys.argv[3],
+                                        DurationSeconds=3600)
+assert response['Credentials']['AccessKeyId']
+done = time.perf_counter()
+maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform == 'darwin':
+    maxrss //= 1024
+print(json.dumps({{'import': imported - start, 'total': done - start, 'maxrss_kb': maxrss}}))
+'''
+
+
+def run_child(name, fake, root):
+    role = fake.roles[0]
+    env = dict(os.environ, AWS_ENDPOINT_URL_STS=fake.sts_url, AWS_DEFAULT_REGION='us-east-1',
+               AWS_ACCESS_KEY_ID='unused', AWS_SECRET_ACCESS_KEY='unused', PYTHONPATH=root)
+    start = time.perf_counter()
+    output = subprocess.check_output(
+        [sys.executable, '-c', CHILD_TEMPLATE.format(create_client=CLIENTS[name]),
+         role, role.split(':role/')[0] + ':saml-provider/Okta', fake.saml_assertion()],
+        env=env, cwd=root)
+    result = json.loads(output.decode())
+    result['wall'] = time.perf_counter() - start
+    return result
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--repeat', type=int, default=5, help='processes to start per client')
+    args = arg_parser.parse_args()
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+    fake = FakeOkta().start()
+    try:
+        print('{:<8} {:>9} {:>10} {:>14} {:>12}'.format('client', 'wall ms', 'import ms', 'create+call ms', 'peak RSS MB'))
+        for name in CLIENTS:
+            try:
+                runs = [run_child(name, fake, root) for _ in range(args.repeat)]
+            except subprocess.CalledProcessError:
+                print('{:<8} could not run (is it installed?)'.format(name))
+                continue
+
+            def median(key):
+                return sorted(run[key] for run in runs)[len(runs) // 2]
+            print('{:<8} {:>9.1f} {:>10.1f} {:>14.1f} {:>12.1f}'.format(
+                name, median('wall') * 1000, median('import') * 1000,
+                (median('total') - median('import')) * 1000, median('maxrss_kb') / 1024.0))
+    finally:
+        fake.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,374 @@
+"""
+A local stand-in for Okta and AWS STS that implements just the endpoints clokta uses:
+
+- POST /api/v1/authn                          password authentication
+- POST /api/v1/authn/factors/<id>/verify      MFA verification and push polling
+- GET  /api/v1/sessions/me                    Okta session check
+- GET  /home/amazon_aws/<app>/<id>            the AWS app page holding the SAMLResponse
+- POST /sts/                                  STS AssumeRoleWithSAML (and AssumeRole)
+
+Latency and faults can be injected.  Every request is counted so benchmarks can report how many round trips
+a login took.
+
+Run on its own with
+
+    python benchmarks/fake_okta.py --port 8900 --mfa push --push-delay 2
+
+or start it from a benchmark with FakeOkta(...).start()
+"""
+import argparse
+import base64
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+SAML_TEMPLATE = '''<?xml version="1.0" encoding="UTF-8"?>
+<saml2p:Response xmlns:saml2p="urn:oasis:names:tc:SAML:2.0:protocol" ID="{id}" IssueInstant="{now}" Version="2.0">
+<saml2:Assertion xmlns:saml2="urn:oasis:names:tc:SAML:2.0:assertion" ID="{id}a" IssueInstant="{now}" Version="2.0">
+<saml2:Subject><saml2:NameID>{username}</saml2:NameID>
+<saml2:SubjectConfirmation Method="urn:oasis:names:tc:SAML:2.0:cm:bearer">
+<saml2:SubjectConfirmationData NotOnOrAfter="{expires}" Recipient="https://signin.aws.amazon.com/saml"/>
+</saml2:SubjectConfirmation></saml2:Subject>
+<saml2:Conditions NotBefore="{now}" NotOnOrAfter="{expires}"/>
+<saml2:AttributeStatement>
+<saml2:Attribute Name="https://aws.amazon.com/SAML/Attributes/Role">
+{roles}
+</saml2:Attribute>
+<saml2:Attribute Name="https://aws.amazon.com/SAML/Attributes/RoleSessionName">
+<saml2:AttributeValue>{username}</saml2:AttributeValue>
+</saml2:Attribute>
+</saml2:AttributeStatement>
+</saml2:Assertion>
+</saml2p:Response>'''
+
+APP_PAGE_TEMPLATE = '''<!DOCTYPE html><html><head><title>Signing in...</title>{padding}</head><body>
+<form id="appForm" action="https://signin.aws.amazon.com/saml" method="POST">
+<input name="SAMLResponse" type="hidden" value="{assertion}"/>
+<input name="RelayState" type="hidden" value=""/>
+</form></body></html>'''
+
+LOGIN_PAGE_TEMPLATE = '''<!DOCTYPE html><html><head><title>Sign In</title>{padding}</head><body>
+<div id="okta-sign-in"></div></body></html>'''
+
+STS_RESPONSE_TEMPLATE = '''<{action}Response xmlns="https://sts.amazonaws.com/doc/2011-06-15/">
+  <{action}Result>
+    <Credentials>
+      <AccessKeyId>ASIA{key}</AccessKeyId>
+      <SecretAccessKey>{secret}</SecretAccessKey>
+      <SessionToken>{token}</SessionToken>
+      <Expiration>{expires}</Expiration>
+    </Credentials>
+    <AssumedRoleUser>
+      <Arn>{role_arn}/clokta</Arn>
+      <AssumedRoleId>AROA{key}:clokta</AssumedRoleId>
+    </AssumedRoleUser>
+  </{action}Result>
+  <ResponseMetadata><RequestId>{request_id}</RequestId></ResponseMetadata>
+</{action}Response>'''
+
+STS_ERROR_TEMPLATE = '''<ErrorResponse xmlns="https://sts.amazonaws.com/doc/2011-06-15/">
+  <Error><Type>Sender</Type><Code>{code}</Code><Message>{message}</Message></Error>
+  <RequestId>{request_id}</RequestId>
+</ErrorResponse>'''
+
+
+def iso_time(seconds):
+    return time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(seconds))
+
+
+class FakeOkta(object):
+    """
+    The state of the fake Okta org and AWS account
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, username='doej', password='secret', mfa='push',
+                 push_delay=1.0, totp='123456', latency=0.0, fault_rate=0.0, fault_paths=None,
+                 session_lifetime=7200, roles=None, max_session_duration=43200, page_padding_kb=100):
+        """
+        :param mfa: which MFA Okta requires: 'none', 'push' or 'totp'
+        :param push_delay: seconds after the push is sent that the user approves it
+        :param latency: seconds to wait before answering each request
+        :param fault_rate: fraction of requests to fail with a 500
+        :param fault_paths: only inject faults on request paths containing one of these strings
+        :param session_lifetime: seconds an Okta session lasts
+        :param roles: role ARNs the SAML assertion grants.  Defaults to one role.
+        :param max_session_duration: the longest STS session any role allows
+        :param page_padding_kb: how much script and style to pad the HTML pages with
+        """
+        self.username = username
+        self.password = password
+        self.mfa = mfa
+        self.push_delay = push_delay
+        self.totp = totp
+        self.latency = latency
+        self.fault_rate = fault_rate
+        self.fault_paths = fault_paths or []
+        self.session_lifetime = session_lifetime
+        self.roles = roles or ['arn:aws:iam::123456789012:role/Developer']
+        self.max_session_duration = max_session_duration
+        self.padding = '<script>var okta = "{}";</script>'.format('x' * 1000) * page_padding_kb
+        self.requests = Counter()
+        self.transactions = {}  # state token -> time push was sent (or None before)
+        self.session_tokens = set()
+        self.sessions = {}  # sid -> expiration
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self.__handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    @property
+    def app_url(self):
+        return self.base_url + '/home/amazon_aws/0oa1bcdefgHIJKLMN/272'
+
+    @property
+    def sts_url(self):
+        return self.base_url + '/sts/'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_counts(self):
+        with self.lock:
+            self.requests.clear()
+
+    def expire_sessions(self):
+        """ Make every Okta session invalid, as if they had all timed out """
+        with self.lock:
+            self.sessions.clear()
+
+    def saml_assertion(self):
+        now = time.time()
+        role_values = '\n'.join(
+            '<saml2:AttributeValue>{},{}</saml2:AttributeValue>'.format(
+                role.split(':role/')[0] + ':saml-provider/Okta', role)
+            for role in self.roles
+        )
+        xml = SAML_TEMPLATE.format(id=uuid.uuid4().hex, now=iso_time(now), expires=iso_time(now + 300),
+                                   username=self.username, roles=role_values)
+        return base64.b64encode(xml.encode()).decode()
+
+    def __handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                with fake.lock:
+                    fake.requests['connections'] += 1
+
+            def do_GET(self):
+                self.__dispatch('GET')
+
+            def do_POST(self):
+                self.__dispatch('POST')
+
+            def __dispatch(self, method):
+                parsed = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                endpoint = re.sub(r'/factors/[^/]+/', '/factors/{id}/', parsed.path)
+                endpoint = re.sub(r'^/home/amazon_aws/.*', '/home/amazon_aws/{app}', endpoint)
+                with fake.lock:
+                    fake.requests[endpoint] += 1
+                    fake.requests['total'] += 1
+
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if fake.fault_rate and random.random() < fake.fault_rate and \
+                        (not fake.fault_paths or any(p in parsed.path for p in fake.fault_paths)):
+                    return self.__send(500, 'application/json', json.dumps({'errorCode': 'E0000009'}))
+
+                if method == 'POST' and parsed.path == '/api/v1/authn':
+                    return self.__authn(json.loads(body.decode()))
+                if method == 'POST' and parsed.path.startswith('/api/v1/authn/factors/'):
+                    return self.__verify(parsed.path.split('/')[5], json.loads(body.decode()))
+                if method == 'GET' and parsed.path == '/api/v1/sessions/me':
+                    return self.__session_me()
+                if method == 'GET' and parsed.path.startswith('/home/amazon_aws/'):
+                    return self.__app_page(parse_qs(parsed.query))
+                if method == 'POST' and parsed.path == '/sts/':
+                    return self.__sts({k: v[0] for k, v in parse_qs(body.decode()).items()},
+                                      self.headers.get('Authorization'))
+                self.__send(404, 'application/json', json.dumps({'errorCode': 'E0000007'}))
+
+            def __send(self, status, content_type, body, headers=None):
+                data = body.encode()
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def __session_token(self):
+                token = uuid.uuid4().hex
+                with fake.lock:
+                    fake.session_tokens.add(token)
+                return token
+
+            def __authn(self, payload):
+                if payload.get('username') != fake.username or payload.get('password') != fake.password:
+                    return self.__send(401, 'application/json', json.dumps({'errorCode': 'E0000004'}))
+                if fake.mfa == 'none':
+                    return self.__send(200, 'application/json', json.dumps(
+                        {'status': 'SUCCESS', 'sessionToken': self.__session_token()}))
+                state_token = uuid.uuid4().hex
+                with fake.lock:
+                    fake.transactions[state_token] = None
+                factor_type, factor_id = ('push', 'opf1') if fake.mfa == 'push' else ('token:software:totp', 'ost1')
+                factor = {
+                    'id': factor_id,
+                    'factorType': factor_type,
+                    'provider': 'OKTA',
+                    '_links': {'verify': {'href': '{}/api/v1/authn/factors/{}/verify'.format(fake.base_url, factor_id)}}
+                }
+                self.__send(200, 'application/json', json.dumps({
+                    'status': 'MFA_REQUIRED',
+                    'stateToken': state_token,
+                    '_embedded': {'factors': [factor]}
+                }))
+
+            def __verify(self, factor_id, payload):
+                state_token = payload.get('stateToken')
+                with fake.lock:
+                    known = state_token in fake.transactions
+                    sent_at = fake.transactions.get(state_token)
+                    if known and sent_at is None:
+                        sent_at = fake.transactions[state_token] = time.time()
+                if not known:
+                    return self.__send(403, 'application/json', json.dumps({'errorCode': 'E0000011'}))
+                if factor_id == 'ost1':
+                    if payload.get('answer') != fake.totp:
+                        return self.__send(403, 'application/json', json.dumps({'errorCode': 'E0000068'}))
+                    return self.__send(200, 'application/json', json.dumps(
+                        {'status': 'SUCCESS', 'sessionToken': self.__session_token()}))
+                if time.time() - sent_at >= fake.push_delay:
+                    return self.__send(200, 'application/json', json.dumps(
+                        {'status': 'SUCCESS', 'sessionToken': self.__session_token()}))
+                self.__send(200, 'application/json', json.dumps({
+                    'status': 'MFA_CHALLENGE',
+                    'factorResult': 'WAITING',
+                    'stateToken': state_token,
+                    '_links': {'next': {
+                        'name': 'poll',
+                        'href': '{}/api/v1/authn/factors/{}/verify'.format(fake.base_url, factor_id)
+                    }}
+                }))
+
+            def __current_session(self):
+                cookies = self.headers.get('Cookie') or ''
+                match = re.search(r'\bsid=([0-9a-f]+)', cookies)
+                if not match:
+                    return None
+                with fake.lock:
+                    expires = fake.sessions.get(match.group(1))
+                if expires and expires > time.time():
+                    return match.group(1)
+                return None
+
+            def __session_me(self):
+                sid = self.__current_session()
+                if not sid:
+                    return self.__send(404, 'application/json', json.dumps({'errorCode': 'E0000007'}))
+                self.__send(200, 'application/json', json.dumps(
+                    {'id': sid, 'status': 'ACTIVE', 'expiresAt': iso_time(fake.sessions[sid])}))
+
+            def __app_page(self, query):
+                headers = {}
+                token = query.get('onetimetoken', [None])[0]
+                sid = self.__current_session()
+                if token:
+                    with fake.lock:
+                        valid = token in fake.session_tokens
+                        fake.session_tokens.discard(token)
+                    if valid:
+                        sid = uuid.uuid4().hex
+                        headers['Set-Cookie'] = 'sid={}; Path=/; HttpOnly'.format(sid)
+                if not sid:
+                    return self.__send(200, 'text/html', LOGIN_PAGE_TEMPLATE.format(padding=fake.padding))
+                with fake.lock:
+                    fake.sessions[sid] = time.time() + fake.session_lifetime
+                self.__send(200, 'text/html',
+                            APP_PAGE_TEMPLATE.format(padding=fake.padding, assertion=fake.saml_assertion()), headers)
+
+            def __sts(self, params, authorization):
+                action = params.get('Action')
+                request_id = uuid.uuid4().hex
+                duration = int(params.get('DurationSeconds') or 3600)
+                if action not in ('AssumeRoleWithSAML', 'AssumeRole'):
+                    return self.__send(400, 'text/xml', STS_ERROR_TEMPLATE.format(
+                        code='InvalidAction', message='Unsupported action', request_id=request_id))
+                if action == 'AssumeRole' and not (authorization or '').startswith('AWS4-HMAC-SHA256 Credential=ASIA'):
+                    return self.__send(403, 'text/xml', STS_ERROR_TEMPLATE.format(
+                        code='MissingAuthenticationToken', message='Request must be signed with role credentials',
+                        request_id=request_id))
+                if action == 'AssumeRoleWithSAML':
+                    try:
+                        saml = base64.b64decode(params.get('SAMLAssertion', '')).decode()
+                    except ValueError:
+                        saml = ''
+                    expires = re.search(r'NotOnOrAfter="([^"]+)"', saml)
+                    if not expires or time.strptime(expires.group(1)[:19], '%Y-%m-%dT%H:%M:%S') < \
+                            time.gmtime():
+                        return self.__send(400, 'text/xml', STS_ERROR_TEMPLATE.format(
+                            code='ExpiredTokenException', message='Token must be redeemed within 5 minutes',
+                            request_id=request_id))
+                if duration > (3600 if action == 'AssumeRole' else fake.max_session_duration):
+                    return self.__send(400, 'text/xml', STS_ERROR_TEMPLATE.format(
+                        code='ValidationError',
+                        message='The requested DurationSeconds exceeds the MaxSessionDuration set for this role.',
+                        request_id=request_id))
+                key = uuid.uuid4().hex[:16].upper()
+                self.__send(200, 'text/xml', STS_RESPONSE_TEMPLATE.format(
+                    action=action, key=key, secret=uuid.uuid4().hex, token=base64.b64encode(uuid.uuid4().bytes).decode(),
+                    expires=iso_time(time.time() + duration)[:-5] + 'Z', role_arn=params.get('RoleArn'),
+                    request_id=request_id))
+
+        return Handler
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--port', type=int, default=8900)
+    arg_parser.add_argument('--mfa', choices=['none', 'push', 'totp'], default='push')
+    arg_parser.add_argument('--push-delay', type=float, default=1.0, help='seconds before a push is approved')
+    arg_parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    arg_parser.add_argument('--fault-rate', type=float, default=0.0, help='fraction of requests that fail with a 500')
+    args = arg_parser.parse_args()
+
+    fake = FakeOkta(port=args.port, mfa=args.mfa, push_delay=args.push_delay, latency=args.latency,
+                    fault_rate=args.fault_rate)
+    print('Okta app URL:  {}'.format(fake.app_url))
+    print('STS endpoint:  {}  (export AWS_ENDPOINT_URL_STS={})'.format(fake.sts_url, fake.sts_url))
+    print('Username/password: {}/{}'.format(fake.username, fake.password))
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1 +1,5 @@
-__import__('pkg_resources').declare_namespace(__name__)
+'''
+Okta to AWS keys for the command line.  Kept free of imports so "clokta --version" and the other commands
+that don't log in start quickly.
+'''
+__version__ = '4.1.3'
@@ -0,0 +1,7 @@
+'''
+Lets clokta be run as "python -m clokta"
+'''
+from clokta.launcher import main
+
+if __name__ == '__main__':
+    main()
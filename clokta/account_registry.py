@@ -0,0 +1,245 @@
+'''
+Looks up profiles by account, alias, app and role, and the other way round
+'''
+import bisect
+import json
+import os
+import time
+
+from clokta.common import Common
+from clokta.config_file import ConfigFile
+from clokta.file_utils import FileUtils
+
+
+class AccountRegistry(object):
+    """
+    An index of the profiles in clokta.cfg by AWS account number, account alias, Okta app URL and the roles
+    last used with them, so tools can find "which profile is account 123456789012?" without reading every
+    profile.  Stored in ~/.clokta/account_registry.json, with every key already sorted for prefix searches,
+    and only rebuilt when clokta.cfg changes.  The role each profile last logged in with is recorded in place
+    at each login and kept across rebuilds.
+    """
+
+    REGISTRY_FILE = 'account_registry.json'
+    # What each profile is indexed by: the name in the registry and the parameter in clokta.cfg
+    INDEXED = [('account', 'aws_account_number'), ('alias', 'aws_account_alias'), ('app_url', 'okta_aws_app_url'),
+               ('default_role', 'okta_aws_role_to_assume')]
+
+    def __init__(self, data_dir, clokta_config_file=None):
+        """
+        :param data_dir: the clokta data directory (e.g. ~/.clokta/)
+        :type data_dir: str
+        :param clokta_config_file: the clokta.cfg file.  Defaults to the one in data_dir.
+        :type clokta_config_file: str
+        """
+        data_dir = os.path.expanduser(data_dir)
+        self.registry_file = os.path.join(data_dir, AccountRegistry.REGISTRY_FILE)
+        self.clokta_config_file = os.path.expanduser(clokta_config_file or os.path.join(data_dir, 'clokta.cfg'))
+        self.profiles = {}  # type: dict[str, dict]
+        self.indexes = {}  # type: dict[str, dict[str, [str]]]
+        self.sorted_keys = []  # type: [[str, str]]
+        self.loaded = False
+
+    def load(self):
+        """
+        Read the registry, rebuilding it first if clokta.cfg has changed since it was built
+        :rtype: AccountRegistry
+        """
+        registry = self.__read()
+        signature = ConfigFile.signature(self.clokta_config_file)
+        if registry.get('signature') != signature or 'sorted_keys' not in registry:
+            registry = self.__build(signature, registry.get('last_used', {}))
+            self.__write(registry)
+        self.__use(registry)
+        return self
+
+    def profile(self, profile_name):
+        """
+        :param profile_name: the name of a clokta profile
+        :type profile_name: str
+        :return: the profile's account, alias, app_url, default_role, last_role and last_used_at, or None if
+            there is no such profile
+        :rtype: dict
+        """
+        self.__ensure_loaded()
+        return self.profiles.get(profile_name)
+
+    def lookup(self, term):
+        """
+        Find the profiles an exact profile name, account number, account alias, app URL or role ARN refers to
+        :param term: what to look up
+        :type term: str
+        :return: the names of the matching profiles
+        :rtype: [str]
+        """
+        self.__ensure_loaded()
+        found = {term} if term in self.profiles else set()
+        for index in self.indexes.values():
+            found.update(index.get(term, []))
+        return sorted(found)
+
+    def find_prefix(self, prefix):
+        """
+        Find the profiles whose name, account number, account alias, app URL or role ARN starts with a prefix
+        :param prefix: the start of what to look up
+        :type prefix: str
+        :return: the names of the matching profiles
+        :rtype: [str]
+        """
+        self.__ensure_loaded()
+        found = set()
+        position = bisect.bisect_left(self.sorted_keys, [prefix, ''])
+        while position < len(self.sorted_keys) and self.sorted_keys[position][0].startswith(prefix):
+            found.add(self.sorted_keys[position][1])
+            position += 1
+        return sorted(found)
+
+    def record_use(self, profile_name, role):
+        """
+        Remember the role a profile logged in with
+        :param profile_name: the name of the clokta profile
+        :type profile_name: str
+        :param role: the role assumed
+        :type role: AwsRole
+        """
+        try:
+            with FileUtils.lock(self.registry_file):
+                registry = self.__read()
+                self.__apply_use(registry, profile_name, {
+                    'role_arn': role.role_arn,
+                    'account': role.account,
+                    'used_at': Common.to_iso_timestamp(time.time())
+                })
+                FileUtils.atomic_write(self.registry_file, json.dumps(registry, indent=1, sort_keys=True))
+        except (IOError, OSError) as e:
+            Common.dump_err('WARNING: Could not save account registry: {}'.format(e))
+
+    def dump(self):
+        """
+        :return: every profile with its account, alias, app_url, default_role, last_role and last_used_at
+        :rtype: dict[str, dict]
+        """
+        self.__ensure_loaded()
+        return self.profiles
+
+    def __ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    def __build(self, signature, last_used):
+        """
+        Index the profiles in clokta.cfg
+        :param signature: the stat signature of clokta.cfg
+        :type signature: list
+        :param last_used: the role last used by each profile
+        :type last_used: dict[str, dict]
+        :return: the registry
+        :rtype: dict
+        """
+        clokta_cfg_file = ConfigFile.load(self.clokta_config_file)
+        profiles = {}
+        for profile_name in clokta_cfg_file.section_names():
+            entry = {name: clokta_cfg_file.get(profile_name, param) or None for name, param in AccountRegistry.INDEXED}
+            used = last_used.get(profile_name, {})
+            entry['last_role'] = used.get('role_arn')
+            entry['last_used_at'] = used.get('used_at')
+            if not entry['account']:
+                entry['account'] = used.get('account')
+            profiles[profile_name] = entry
+
+        indexes = {}
+        for name in [name for name, _ in AccountRegistry.INDEXED] + ['last_role']:
+            index = indexes.setdefault(name, {})
+            for profile_name, entry in profiles.items():
+                if entry[name]:
+                    index.setdefault(entry[name], []).append(profile_name)
+        keys = {(profile_name, profile_name) for profile_name in profiles}
+        for index in indexes.values():
+            keys.update((key, profile_name) for key, profile_names in index.items() for profile_name in profile_names)
+        return {
+            'signature': signature,
+            'last_used': {name: used for name, used in last_used.items() if name in profiles},
+            'profiles': profiles,
+            'indexes': indexes,
+            # Every (key, profile) pair, so a prefix is found with a binary search.  Lists, as JSON stores them.
+            'sorted_keys': [list(key) for key in sorted(keys)]
+        }
+
+    @classmethod
+    def __apply_use(cls, registry, profile_name, used):
+        """
+        Record the role a profile logged in with, updating its entry, the indexes and the sorted keys in place
+        so the registry needn't be rebuilt
+        :param registry: the registry, built or not
+        :type registry: dict
+        :param profile_name: the name of the clokta profile
+        :type profile_name: str
+        :param used: the role_arn and account used and when (used_at)
+        :type used: dict
+        """
+        registry.setdefault('last_used', {})[profile_name] = used
+        entry = registry.get('profiles', {}).get(profile_name)
+        if entry is None or 'sorted_keys' not in registry:
+            # Not in the registry yet.  The next build picks the role up from last_used.
+            return
+        if entry['last_role'] != used['role_arn']:
+            cls.__unindex(registry, 'last_role', entry['last_role'], profile_name)
+            entry['last_role'] = used['role_arn']
+            cls.__index(registry, 'last_role', entry['last_role'], profile_name)
+        if not entry['account'] and used.get('account'):
+            entry['account'] = used['account']
+            cls.__index(registry, 'account', entry['account'], profile_name)
+        entry['last_used_at'] = used.get('used_at')
+
+    @classmethod
+    def __index(cls, registry, name, key, profile_name):
+        if not key:
+            return
+        profile_names = registry['indexes'].setdefault(name, {}).setdefault(key, [])
+        if profile_name not in profile_names:
+            profile_names.append(profile_name)
+        sorted_keys = registry['sorted_keys']
+        position = bisect.bisect_left(sorted_keys, [key, profile_name])
+        if position == len(sorted_keys) or sorted_keys[position] != [key, profile_name]:
+            sorted_keys.insert(position, [key, profile_name])
+
+    @classmethod
+    def __unindex(cls, registry, name, key, profile_name):
+        if not key:
+            return
+        index = registry['indexes'].get(name, {})
+        if profile_name in index.get(key, []):
+            index[key].remove(profile_name)
+            if not index[key]:
+                del index[key]
+        # The key may still lead to the profile through another index
+        if key == profile_name or any(profile_name in other.get(key, []) for other in registry['indexes'].values()):
+            return
+        sorted_keys = registry['sorted_keys']
+        position = bisect.bisect_left(sorted_keys, [key, profile_name])
+        if position < len(sorted_keys) and sorted_keys[position] == [key, profile_name]:
+            del sorted_keys[position]
+
+    def __use(self, registry):
+        self.profiles = registry['profiles']
+        self.indexes = registry['indexes']
+        self.sorted_keys = registry['sorted_keys']
+        self.loaded = True
+
+    def __read(self):
+        try:
+            with open(self.registry_file, 'r') as file:
+                return json.load(file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def __write(self, registry):
+        try:
+            with FileUtils.lock(self.registry_file):
+                # Keep any role recorded since we read the registry
+                for name, used in self.__read().get('last_used', {}).items():
+                    if name in registry['profiles'] and registry['last_used'].get(name) != used:
+                        self.__apply_use(registry, name, used)
+                FileUtils.atomic_write(self.registry_file, json.dumps(registry, indent=1, sort_keys=True))
+        except (IOError, OSError) as e:
+            Common.dump_err('WARNING: Could not save account registry: {}'.format(e))
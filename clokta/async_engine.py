@@ -0,0 +1,143 @@
+'''
+asyncio versions of the objects that talk to Okta and AWS
+'''
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from clokta.aws_cred_generator import AwsCredentialsGenerator
+from clokta.okta_initiator import OktaInitiator
+
+
+class AsyncEngine(object):
+    """
+    Runs clokta's blocking steps (HTTP calls, keyring reads and file writes) on a bounded thread pool
+    so that a coroutine can overlap them and one process can drive many logins at once.
+    """
+
+    def __init__(self, max_workers=8):
+        """
+        :param max_workers: the most blocking steps to run at once
+        :type max_workers: int
+        """
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Run a blocking function on the thread pool
+        :param func: the function
+        :return: what the function returns
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def prompt(self, func, *args, **kwargs):
+        """
+        Run a blocking function that may prompt the user.  These run on the event loop's own thread, so
+        Ctrl-C interrupts them and concurrent logins never prompt over each other.
+        :param func: the function
+        :return: what the function returns
+        """
+        return func(*args, **kwargs)
+
+    def close(self):
+        """ Shut down the thread pool """
+        self.executor.shutdown(wait=True)
+
+
+class AsyncOktaInitiator(object):
+    """
+    The same state machine as OktaInitiator (INPUT_ERROR, NEED_MFA, SUCCESS) with each step a coroutine
+    """
+
+    def __init__(self, engine, data_dir, session=None):
+        """
+        :param engine: the engine to run blocking steps on
+        :type engine: AsyncEngine
+        :param data_dir: the directory to store cookies in
+        :type data_dir: str
+        :param session: an HTTP session to use for all calls to Okta.  If not specified one will be created.
+        :type session: requests.Session
+        """
+        self.engine = engine
+        self.initiator = OktaInitiator(data_dir=data_dir, session=session)
+
+    @property
+    def saml_assertion(self):
+        return self.initiator.saml_assertion
+
+    @property
+    def session(self):
+        return self.initiator.session
+
+    async def okta_session_state(self, clokta_config):
+        return await self.engine.run(self.initiator.okta_session_state, clokta_config)
+
+    async def probe_session(self, clokta_config):
+        return await self.engine.run(self.initiator.probe_session, clokta_config)
+
+    async def initiate_with_cookie(self, clokta_config):
+        return await self.engine.run(self.initiator.initiate_with_cookie, clokta_config)
+
+    async def initiate_with_auth(self, clokta_config, mfas_to_fill):
+        return await self.engine.run(self.initiator.initiate_with_auth, clokta_config, mfas_to_fill)
+
+    async def initiate_mfa(self, factor):
+        return await self.engine.run(self.initiator.initiate_mfa, factor)
+
+    async def finalize_mfa(self, clokta_config, factor, otp):
+        return await self.engine.run(self.initiator.finalize_mfa, clokta_config, factor, otp)
+
+
+class AsyncCredentialsGenerator(object):
+    """
+    AwsCredentialsGenerator with the calls to AWS as coroutines
+    """
+
+    def __init__(self, engine, data_dir, clokta_config, saml_assertion):
+        """
+        :param engine: the engine to run blocking steps on
+        :type engine: AsyncEngine
+        :param data_dir: the clokta data directory
+        :type data_dir: str
+        :param clokta_config: the clokta configuration with which role has been designated default
+        :type clokta_config: CloktaConfiguration
+        :param saml_assertion: the saml token generated by Okta
+        :type saml_assertion: str
+        """
+        self.engine = engine
+        self.generator = AwsCredentialsGenerator(data_dir=data_dir,
+                                                 clokta_config=clokta_config,
+                                                 saml_assertion=saml_assertion)
+
+    @property
+    def bash_file(self):
+        return self.generator.bash_file
+
+    @property
+    def docker_file(self):
+        return self.generator.docker_file
+
+    @property
+    def credentials(self):
+        return self.generator.credentials
+
+    @property
+    def chained_credentials(self):
+        return self.generator.chained_credentials
+
+    @property
+    def clokta_config(self):
+        return self.generator.clokta_config
+
+    def get_roles(self):
+        return self.generator.get_roles()
+
+    async def generate_creds(self, role, write_files=True, chain_roles=True):
+        return await self.engine.run(self.generator.generate_creds, role, write_files, chain_roles)
+
+    async def write_env_files(self):
+        return await self.engine.run(self.generator.write_env_files)
+
+    async def generate_creds_for_roles(self, roles_by_profile):
+        return await self.engine.run(self.generator.generate_creds_for_roles, roles_by_profile)
@@ -0,0 +1,312 @@
+"""
+asyncio implementation of the clokta login flow
+"""
+import asyncio
+import collections
+import os
+import time
+from urllib.parse import urlparse
+
+import click
+
+from clokta.account_registry import AccountRegistry
+from clokta.async_engine import AsyncCredentialsGenerator, AsyncOktaInitiator
+from clokta.aws_cred_generator import SamlAssertionRejectedError
+from clokta.clokta_configuration import CloktaConfiguration
+from clokta.common import Common
+from clokta.metrics import Metrics
+from clokta.okta_initiator import OktaInitiator
+from clokta.role_catalog import RoleCatalog
+from clokta.saml_cache import SamlAssertionCache
+
+
+class LoginRequiredError(Exception):
+    """ Getting credentials needs the user to log in to Okta, which was not allowed """
+
+
+class AsyncRoleAssumer(object):
+    """
+    Logs into Okta and assumes an AWS role as a coroutine.  Independent steps (checking the Okta session and
+    reading the keychain, calling AWS and caching the SAML assertion) run concurrently, and several
+    AsyncRoleAssumers can run at once on the same AsyncEngine.
+    """
+
+    def __init__(self, profile, engine, data_dir, session=None, login_locks=None):
+        """
+        :param profile: the name of the AWS profile the user wants to clokta into (e.g. pagebuilder)
+        :type profile: str
+        :param engine: the engine to run blocking steps on
+        :type engine: AsyncEngine
+        :param data_dir: folder to store files in
+        :type data_dir: str
+        :param session: an HTTP session to share with other logins.  If not specified a new one is created.
+        :type session: requests.Session
+        :param login_locks: locks shared with the other logins using the session, keyed by Okta org, so only
+            one login at a time authenticates with each org and the others reuse the Okta session it starts
+        :type login_locks: dict[str, asyncio.Lock]
+        """
+        self.profile = profile
+        self.engine = engine
+        self.data_dir = data_dir
+        self.session = session
+        self.login_locks = login_locks
+        if not os.path.exists(os.path.expanduser(self.data_dir)):
+            os.makedirs(os.path.expanduser(self.data_dir), exist_ok=True)
+
+    async def assume_role(self, reset_default_role, role_patterns=None, write_files=True, interactive=True,
+                          chain_roles=True):
+        """
+        Generate credentials for the profile, logging into Okta if needed
+        :param reset_default_role: whether to reset whatever the default role is for this profile
+        :type reset_default_role: bool
+        :param role_patterns: if specified, assume every role matching these patterns instead of a single role.
+            Each role's credentials are saved to their own profile.
+        :type role_patterns: List[str]
+        :param write_files: whether to save the credentials to the AWS credentials file and the .sh and .env
+            files.  If not, they are only available from the credentials generator.
+        :type write_files: bool
+        :param interactive: whether the user may be prompted.  If not, only a cached SAML assertion or a live
+            Okta session is used and a saved default role is needed when the profile has several roles.
+        :type interactive: bool
+        :param chain_roles: whether to also assume the profile's chained_roles
+        :type chain_roles: bool
+        :return: the credentials generator that wrote the credentials, the profiles written and, in batch mode,
+            the error for each profile whose role could not be assumed
+        :rtype: (AsyncCredentialsGenerator, [str], dict[str, Exception])
+        :raises LoginRequiredError: if not interactive and the user needs to log in or choose a role
+        """
+        start = time.perf_counter()
+        outcome = 'failure'
+        try:
+            result = await self.__assume_role(reset_default_role=reset_default_role, role_patterns=role_patterns,
+                                              write_files=write_files, interactive=interactive,
+                                              chain_roles=chain_roles)
+            outcome = 'success'
+            return result
+        finally:
+            Metrics.observe('clokta_login_seconds', time.perf_counter() - start, outcome=outcome)
+
+    async def __assume_role(self, reset_default_role, role_patterns, write_files, interactive, chain_roles):
+        clokta_config_file = self.data_dir + "clokta.cfg"
+
+        clokta_config = await self.engine.prompt(CloktaConfiguration,
+                                                 profile_name=self.profile,
+                                                 clokta_config_file=clokta_config_file)
+        Metrics.configure(sink=clokta_config.get('metrics_sink'),
+                          textfile=clokta_config.get('metrics_textfile'),
+                          statsd_port=clokta_config.get('metrics_statsd_port'))
+        if reset_default_role:
+            await self.engine.run(clokta_config.reset_default_role)
+
+        app_url = clokta_config.get('okta_aws_app_url')
+        saml_cache = SamlAssertionCache(data_dir=self.data_dir)
+        saml_assertion = await self.engine.run(saml_cache.get, app_url)
+        from_cache = saml_assertion is not None
+        if not from_cache:
+            saml_assertion = await self.__login(clokta_config, interactive)
+
+        # We now have a SAML assertion and can generate a AWS Credentials
+        aws_svc = AsyncCredentialsGenerator(engine=self.engine,
+                                            clokta_config=clokta_config,
+                                            saml_assertion=saml_assertion,
+                                            data_dir=self.data_dir)
+        roles = aws_svc.get_roles()
+        if role_patterns:
+            roles_by_profile = clokta_config.determine_roles(roles, role_patterns)
+        else:
+            if not interactive and len(roles) > 1 and not roles.get(clokta_config.get('okta_aws_role_to_assume')):
+                raise LoginRequiredError('No default role chosen for {}'.format(self.profile))
+            roles_by_profile = {self.profile: await self.engine.prompt(clokta_config.determine_role, roles)}
+        # Record the roles for "clokta --list-roles" while AWS generates credentials
+        role_catalog = RoleCatalog(data_dir=self.data_dir)
+        catalog_saved = self.engine.run(role_catalog.put, app_url, roles, self.profile)
+        try:
+            if from_cache:
+                (profiles, failures), _ = await asyncio.gather(
+                    self.__generate_creds(aws_svc, roles_by_profile, write_files, chain_roles),
+                    catalog_saved
+                )
+            else:
+                # Remember the assertion while AWS generates credentials
+                (profiles, failures), _, _ = await asyncio.gather(
+                    self.__generate_creds(aws_svc, roles_by_profile, write_files, chain_roles),
+                    self.engine.run(saml_cache.put, app_url, saml_assertion),
+                    catalog_saved
+                )
+        except SamlAssertionRejectedError:
+            if not from_cache:
+                raise
+            # The cached assertion is no longer good.  Forget it and log in again.
+            if Common.is_debug():
+                Common.dump_out(message='AWS rejected cached SAML assertion.  Logging in to Okta again.')
+            await self.engine.run(saml_cache.invalidate, app_url)
+            saml_assertion = await self.__login(clokta_config, interactive)
+            aws_svc = AsyncCredentialsGenerator(engine=self.engine,
+                                                clokta_config=clokta_config,
+                                                saml_assertion=saml_assertion,
+                                                data_dir=self.data_dir)
+            (profiles, failures), _, _ = await asyncio.gather(
+                self.__generate_creds(aws_svc, roles_by_profile, write_files, chain_roles),
+                self.engine.run(saml_cache.put, app_url, saml_assertion),
+                self.engine.run(role_catalog.put, app_url, aws_svc.get_roles(), self.profile)
+            )
+        if list(roles_by_profile) == [self.profile]:
+            registry = AccountRegistry(data_dir=self.data_dir, clokta_config_file=clokta_config_file)
+            await asyncio.gather(
+                self.engine.run(clokta_config.update_configuration),
+                self.engine.run(registry.record_use, self.profile, roles_by_profile[self.profile])
+            )
+        else:
+            await self.engine.run(clokta_config.update_configuration)
+        return aws_svc, profiles, failures
+
+    @classmethod
+    async def assume_profiles(cls, profiles, engine, data_dir, session, reset_default_role=False, interactive=True):
+        """
+        Generate credentials for several profiles at once and save them all in one update of the credentials
+        file.  The logins share the HTTP session and the logins to each Okta org take turns to authenticate, so
+        the user logs in to each org once and every other profile gets its SAML assertion through that org's
+        Okta session.  Different orgs are logged into concurrently.
+        :param profiles: the names of the profiles
+        :type profiles: [str]
+        :param engine: the engine to run blocking steps on
+        :type engine: AsyncEngine
+        :param data_dir: folder to store files in
+        :type data_dir: str
+        :param session: the HTTP session to share
+        :type session: requests.Session
+        :param reset_default_role: whether to reset the default role of every profile
+        :type reset_default_role: bool
+        :param interactive: whether the user may be prompted
+        :type interactive: bool
+        :return: by profile, the credentials generator that generated its credentials or the error raised
+        :rtype: dict[str, AsyncCredentialsGenerator or Exception]
+        """
+        login_locks = collections.defaultdict(asyncio.Lock)
+        assumers = [AsyncRoleAssumer(profile=profile, engine=engine, data_dir=data_dir, session=session,
+                                     login_locks=login_locks)
+                    for profile in profiles]
+
+        async def assume(assumer):
+            try:
+                return await assumer.assume_role(reset_default_role=reset_default_role, write_files=False,
+                                                 interactive=interactive)
+            except click.exceptions.Abort:
+                # The user cancelled a prompt.  Don't go on to prompt them for the other profiles.
+                raise
+            except Exception as e:
+                return e
+        outcomes = await asyncio.gather(*[assume(assumer) for assumer in assumers])
+        generators = {p: o[0] for p, o in zip(profiles, outcomes) if not isinstance(o, BaseException)}
+        if generators:
+            clokta_config = next(iter(generators.values())).clokta_config
+            credentials_by_profile = {}
+            for profile, generator in generators.items():
+                credentials_by_profile.update(generator.chained_credentials)
+                credentials_by_profile[profile] = generator.credentials
+            await engine.run(clokta_config.apply_credentials_batch, credentials_by_profile)
+            await asyncio.gather(*[generator.write_env_files() for generator in generators.values()])
+        return {p: generators.get(p, o) for p, o in zip(profiles, outcomes)}
+
+    async def __generate_creds(self, aws_svc, roles_by_profile, write_files, chain_roles):
+        """
+        Generate credentials for either the profile's one role or, in batch mode, many roles
+        :param aws_svc: the credentials generator
+        :type aws_svc: AsyncCredentialsGenerator
+        :param roles_by_profile: the roles to assume keyed by the profile to save their credentials in
+        :type roles_by_profile: dict[str, AwsRole]
+        :param write_files: whether to write the profile's credentials to files.  Batch mode always does.
+        :type write_files: bool
+        :param chain_roles: whether to also assume the profile's chained_roles.  Batch mode never does.
+        :type chain_roles: bool
+        :return: the profiles credentials were written to and the error for each profile whose role could
+            not be assumed
+        :rtype: ([str], dict[str, Exception])
+        """
+        if list(roles_by_profile) == [self.profile]:
+            await aws_svc.generate_creds(roles_by_profile[self.profile], write_files, chain_roles)
+            return [self.profile] + sorted(aws_svc.chained_credentials), {}
+        return await aws_svc.generate_creds_for_roles(roles_by_profile)
+
+    async def __login(self, clokta_config, interactive=True):
+        """
+        Log in to Okta, prompting for password and MFA as needed, and get a SAML assertion
+        :param clokta_config: the configuration of the profile being logged into
+        :type clokta_config: CloktaConfiguration
+        :param interactive: whether the user may be prompted.  If not, only the Okta session cookie is tried.
+        :type interactive: bool
+        :return: the base64 encoded SAML assertion
+        :rtype: str
+        :raises LoginRequiredError: if not interactive and there is no live Okta session
+        """
+        okta_initiator = AsyncOktaInitiator(engine=self.engine, data_dir=self.data_dir, session=self.session)
+        if not interactive:
+            if await okta_initiator.okta_session_state(clokta_config) == OktaInitiator.SessionState.DEAD or \
+                    await okta_initiator.initiate_with_cookie(clokta_config) != OktaInitiator.Result.SUCCESS:
+                raise LoginRequiredError('The Okta session for {} has expired'.format(self.profile))
+            return okta_initiator.saml_assertion
+
+        # Attempt to initiate a connection using just cookies.  If the Okta session is known to be dead we'll
+        # need the password, so read it from the keychain at the same time.  Otherwise don't touch the keychain,
+        # which may prompt to be unlocked, until the cookie has failed.
+        session_state = await okta_initiator.okta_session_state(clokta_config)
+        if session_state == OktaInitiator.SessionState.DEAD:
+            result, _ = await asyncio.gather(
+                okta_initiator.initiate_with_cookie(clokta_config),
+                self.engine.run(clokta_config.get, 'okta_password')
+            )
+        else:
+            result = await okta_initiator.initiate_with_cookie(clokta_config)
+            if result == OktaInitiator.Result.INPUT_ERROR:
+                await self.engine.run(clokta_config.get, 'okta_password')
+
+        # If the cookie is expired or non-existent, INPUT_ERROR will be returned
+        org = urlparse(clokta_config.get('okta_aws_app_url')).hostname
+        login_lock = self.login_locks[org] if self.login_locks is not None else asyncio.Lock()
+        while result == OktaInitiator.Result.INPUT_ERROR:
+            async with login_lock:
+                if await okta_initiator.okta_session_state(clokta_config) == OktaInitiator.SessionState.DEAD:
+                    await self.__authenticate(okta_initiator, clokta_config)
+                    break
+            # Another login authenticated with the same Okta org while this one waited its turn
+            if Common.is_debug():
+                Common.dump_out(message='Using the Okta session just started to log in to {}'.format(self.profile))
+            result = await okta_initiator.initiate_with_cookie(clokta_config)
+
+        return okta_initiator.saml_assertion
+
+    async def __authenticate(self, okta_initiator, clokta_config):
+        """
+        Authenticate with Okta, prompting for password and MFA as needed, and get a SAML assertion
+        :param okta_initiator: the initiator whose cookie didn't work
+        :type okta_initiator: AsyncOktaInitiator
+        :param clokta_config: the configuration of the profile being logged into
+        :type clokta_config: CloktaConfiguration
+        """
+        result = OktaInitiator.Result.INPUT_ERROR
+        prompt_for_password = clokta_config.get('okta_password') is None
+        mfas = []
+        while result == OktaInitiator.Result.INPUT_ERROR:
+            if prompt_for_password:
+                await self.engine.prompt(clokta_config.prompt_for, param_name='okta_password')
+            result = await okta_initiator.initiate_with_auth(clokta_config, mfas)
+            if result == OktaInitiator.Result.INPUT_ERROR:
+                if prompt_for_password:
+                    Common.dump_err("Failure.  Wrong password or misconfigured session.")
+                else:
+                    Common.dump_err("Saved password may be out of date.")
+            prompt_for_password = True
+
+        if result == OktaInitiator.Result.NEED_MFA:
+            done = False
+            first_time = True
+            while not done:
+                chosen_factor = await self.engine.prompt(clokta_config.determine_mfa_mechanism,
+                                                         mfas, force_prompt=not first_time)
+                need_otp = await okta_initiator.initiate_mfa(factor=chosen_factor)
+                otp = await self.engine.prompt(clokta_config.determine_okta_onetimepassword,
+                                               chosen_factor, first_time) if need_otp else None
+                result = await okta_initiator.finalize_mfa(clokta_config=clokta_config,
+                                                           factor=chosen_factor, otp=otp)
+                done = result == OktaInitiator.Result.SUCCESS
+                first_time = False
@@ -1,13 +1,21 @@
-import base64
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 
-import boto3
-from botocore.exceptions import ClientError
-import xml.etree.ElementTree as ElementTree
 
 from clokta.clokta_configuration import CloktaConfiguration
 from clokta.common import Common
 from clokta.awsrole import AwsRole
+from clokta.metrics import Metrics
+from clokta.role_index import RoleIndex
+from clokta.session_durations import SessionDurationCache
+from clokta.sts_client import StsClient
+from clokta.sts_endpoints import StsEndpointSelector
+from clokta.timings import Timings
+
+
+class SamlAssertionRejectedError(Exception):
+    """ AWS would not accept the SAML assertion because it has expired or is otherwise invalid """
 
 
 class AwsCredentialsGenerator:
@@ -16,6 +24,12 @@ class AwsCredentialsGenerator:
     generate AWS credentials for a given role
     """
 
+    # Errors AWS returns when the SAML assertion itself is no good
+    REJECTED_ASSERTION_CODES = ['ExpiredTokenException', 'InvalidIdentityToken']
+    BATCH_WORKERS = 8  # How many roles to assume at once in batch mode
+    DURATIONS = [43200, 14400, 3600]  # Session lengths to try, longest first, when a role's limit isn't known
+    CHAINED_DURATION = 3600  # AWS limits sessions of roles assumed from another role to an hour
+
     def __init__(self, data_dir, clokta_config, saml_assertion):
         """
         Creates a credential generator capable of creating credentials in AWS
@@ -29,7 +43,12 @@ class AwsCredentialsGenerator:
         self.data_dir = data_dir
         self.bash_file = None  # type: str
         self.docker_file = None  # type: str
-        self.roles = self.__deduce_roles_from_saml()  # type: [AwsRole]
+        self.credentials = None  # type: dict
+        self.chained_credentials = {}  # type: dict[str, dict]
+        with Timings.span('saml roles parse'):
+            self.roles = RoleIndex.from_saml(saml_assertion)
+        self.session_durations = SessionDurationCache(data_dir=data_dir)
+        self.sts_endpoints = StsEndpointSelector(data_dir=data_dir)
 
         # We need to make sure, when interacting with AWS, we don't try to use
         # default creds as we are creating our own.
@@ -47,65 +66,258 @@ class AwsCredentialsGenerator:
     def get_roles(self):
         """
         Returns the possible roles that can be assumed with the SAML token
-        :return: list of roles
-        :rtype: [AwsRole]
+        :return: the roles
+        :rtype: RoleIndex
         """
         return self.roles
 
-    def generate_creds(self, role):
+    def generate_creds(self, role, write_files=True, chain_roles=True):
         """
         :param role: the AWS role the user wants to assume
         :type role: AwsRole
+        :param write_files: whether to save the credentials to the AWS credentials file and the .sh and .env files.
+            If not, they are only kept in self.credentials and self.chained_credentials.
+        :type write_files: bool
+        :param chain_roles: whether to also assume the profile's chained_roles from the role
+        :type chain_roles: bool
+        :raises SamlAssertionRejectedError: if AWS reports the SAML assertion has expired or is invalid
+        """
+        client = self.__create_client()
+        assumed_role_credentials = self.__assume_role(client=client, role=role)
+        self.credentials = assumed_role_credentials
+        chains = self.clokta_config.get_chained_roles() if chain_roles else {}
+        if chains:
+            self.chained_credentials = self.__assume_chains(client=client, credentials=assumed_role_credentials,
+                                                            chains=chains)
+        if not write_files:
+            return
+
+        credentials_by_profile = dict(self.chained_credentials)
+        credentials_by_profile[self.clokta_config.profile_name] = assumed_role_credentials
+        self.clokta_config.apply_credentials_batch(credentials_by_profile=credentials_by_profile)
+        self.write_env_files()
+
+    @Timings.timed('env files write')
+    def write_env_files(self):
+        """
+        Write the last generated credentials, and those of any chained roles, to each profile's shell script
+        and Docker .env file
+        """
+        self.bash_file = self.__write_sourceable_file(credentials=self.credentials)
+        self.docker_file = self.__write_dockerenv_file(credentials=self.credentials)
+        for profile, credentials in self.chained_credentials.items():
+            self.__write_sourceable_file(credentials=credentials, profile_name=profile)
+            self.__write_dockerenv_file(credentials=credentials, profile_name=profile)
+
+    def generate_creds_for_roles(self, roles_by_profile):
         """
+        Assume many roles with the one SAML assertion, calling AWS for several roles at once, and write
+        all the credentials in one update of the credentials file
+        :param roles_by_profile: the roles to assume keyed by the name of the profile to store their credentials in
+        :type roles_by_profile: dict[str, AwsRole]
+        :return: the profiles that credentials were generated for and, by profile, the error for each role
+            that could not be assumed
+        :rtype: ([str], dict[str, Exception])
+        :raises SamlAssertionRejectedError: if AWS reports the SAML assertion has expired or is invalid
+        """
+        client = self.__create_client()  # shared by all the threads
+        credentials_by_profile = {}
+        failures = {}
+        with ThreadPoolExecutor(max_workers=AwsCredentialsGenerator.BATCH_WORKERS) as executor:
+            futures = {
+                profile: executor.submit(self.__assume_role, client=client, role=role)
+                for profile, role in roles_by_profile.items()
+            }
+            for profile, future in futures.items():
+                try:
+                    credentials_by_profile[profile] = future.result()
+                except SamlAssertionRejectedError:
+                    raise
+                except Exception as e:
+                    failures[profile] = e
+
+        for profile in sorted(failures):
+            Common.dump_err('Could not generate credentials for {} ({}): {}'.format(
+                profile, roles_by_profile[profile].role_arn, failures[profile]))
+
+        self.clokta_config.apply_credentials_batch(credentials_by_profile=credentials_by_profile)
+        with Timings.span('env files write'):
+            for profile, credentials in credentials_by_profile.items():
+                self.__write_sourceable_file(credentials=credentials, profile_name=profile)
+                self.__write_dockerenv_file(credentials=credentials, profile_name=profile)
+        return sorted(credentials_by_profile), failures
+
+    def __assume_chains(self, client, credentials, chains):
+        """
+        Assume chains of roles starting from the credentials of the profile's role.  Each hop of every chain
+        is assumed once, and all the hops at the same depth are assumed at once.
+        :param client: the STS client used to assume the profile's role
+        :param credentials: the response from AWS holding the credentials of the profile's role
+        :type credentials: dict
+        :param chains: the role ARNs of each chain keyed by the profile to store the last role's credentials in
+        :type chains: dict[str, [str]]
+        :return: the credentials of the last role in each chain that could be assumed, keyed by profile
+        :rtype: dict[str, dict]
+        """
+        session_name = re.sub(r'[^\w+=,.@-]', '-', self.clokta_config.get('okta_username') or 'clokta')[:64]
+        assumed = {(): credentials}  # credentials keyed by the chain of role ARNs assumed to get them
+        failures = {}
+        with ThreadPoolExecutor(max_workers=AwsCredentialsGenerator.BATCH_WORKERS) as executor:
+            for depth in range(1, max(len(chain) for chain in chains.values()) + 1):
+                hops = sorted({tuple(chain[:depth]) for chain in chains.values() if len(chain) >= depth})
+                futures = {
+                    hop: executor.submit(self.__chain_hop, client=client, credentials=assumed[hop[:-1]],
+                                         role_arn=hop[-1], session_name=session_name)
+                    for hop in hops if hop[:-1] in assumed
+                }
+                for hop, future in futures.items():
+                    try:
+                        assumed[hop] = future.result()
+                    except Exception as e:
+                        failures[hop] = e
+
+        chained_credentials = {}
+        for profile, chain in sorted(chains.items()):
+            if tuple(chain) in assumed:
+                chained_credentials[profile] = assumed[tuple(chain)]
+                continue
+            failed = next(tuple(chain[:depth]) for depth in range(1, len(chain) + 1) if tuple(chain[:depth]) in failures)
+            Common.dump_err('Could not generate credentials for {} ({}): {}'.format(
+                profile, failed[-1], failures[failed]))
+        return chained_credentials
+
+    @Timings.timed('sts assume chained role')
+    def __chain_hop(self, client, credentials, role_arn, session_name):
+        """
+        Assume a role using the credentials of another role
+        :param client: the STS client used to assume the profile's role
+        :param credentials: the response from AWS holding the credentials to assume the role with
+        :type credentials: dict
+        :param role_arn: the ARN of the role to assume
+        :type role_arn: str
+        :param session_name: the name to give the role session
+        :type session_name: str
+        :return: the response from AWS holding the role's credentials
+        :rtype: dict
+        """
+        if isinstance(client, StsClient):
+            signing_client = client.with_credentials(credentials['Credentials'])
+        else:
+            signing_client = self.__create_client(credentials=credentials['Credentials'])
+        return signing_client.assume_role(RoleArn=role_arn, RoleSessionName=session_name,
+                                          DurationSeconds=AwsCredentialsGenerator.CHAINED_DURATION)
+
+    @Timings.timed('sts client')
+    def __create_client(self, credentials=None):
+        """
+        Create the client to call STS with.  That is clokta's own client unless the user has asked for boto3.
+        :param credentials: the AccessKeyId, SecretAccessKey and SessionToken to make signed calls with
+        :type credentials: dict
+        :return: an STS client with assume_role_with_saml and assume_role methods
+        """
+        endpoints = self.sts_endpoints.endpoints(self.clokta_config)
+        if self.clokta_config.get('use_boto3') == 'True':
+            import boto3  # Slow to import, so only imported when asked for
+            if credentials:
+                return boto3.client('sts', endpoint_url=endpoints[0],
+                                    aws_access_key_id=credentials['AccessKeyId'],
+                                    aws_secret_access_key=credentials['SecretAccessKey'],
+                                    aws_session_token=credentials.get('SessionToken'))
+            return boto3.client('sts', endpoint_url=endpoints[0])
+        return StsClient(endpoints=endpoints, pool_size=AwsCredentialsGenerator.BATCH_WORKERS,
+                         on_failover=self.sts_endpoints.demote, credentials=credentials)
+
+    def __assume_role(self, client, role):
+        """
+        Call AWS to assume a role for the longest session the role allows.  Start with the longest duration
+        that worked for the role last time, or work down from 12 hours if we don't know.
+        :param client: the STS client to make the call with
+        :param role: the AWS role the user wants to assume
+        :type role: AwsRole
+        :return: the response from AWS holding the credentials
+        :rtype: dict
+        """
+        known_duration = self.session_durations.get(role.role_arn)
+        durations = AwsCredentialsGenerator.DURATIONS
+        if known_duration:
+            durations = [known_duration] + [d for d in durations if d < known_duration]
 
-        client = boto3.client('sts')
-        # Try for a 12 hour session.  If it fails, try for shorter periods
         assumed_role_credentials = None
-        durations = [43200, 14400, 3600]
+        granted = None
+        refused = None
         for duration in durations:
-            try:
-                assumed_role_credentials = client.assume_role_with_saml(
-                    RoleArn=role.role_arn,
-                    PrincipalArn=role.idp_arn,
-                    SAMLAssertion=self.saml_assertion,
-                    DurationSeconds=duration
-                )
-                if duration == 3600:
-                    Common.echo(message='YOUR SESSION WILL ONLY LAST ONE HOUR')
+            assumed_role_credentials = self.__try_duration(client=client, role=role, duration=duration)
+            if assumed_role_credentials:
+                granted = duration
                 break
-            except ClientError as e:
-                # If we get a validation error and we have shorter durations to try, try a shorter duration
-                if e.response['Error']['Code'] != 'ValidationError' or duration == durations[-1]:
-                    raise
+            refused = duration
+        if not assumed_role_credentials:
+            # Even the shortest session was refused.  Ask once more to raise AWS's error.
+            granted = durations[-1]
+            assumed_role_credentials = self.__try_duration(client=client, role=role, duration=granted,
+                                                           raise_validation_error=True)
+
+        # Only some durations were tried.  The role may allow something in between.
+        if refused and self.clokta_config.get('discover_session_duration') == 'True':
+            while refused - granted > 3600:
+                duration = granted + (refused - granted) // 7200 * 3600
+                credentials = self.__try_duration(client=client, role=role, duration=duration)
+                if credentials:
+                    granted, assumed_role_credentials = duration, credentials
+                else:
+                    refused = duration
 
-        self.clokta_config.apply_credentials(credentials=assumed_role_credentials)
-        self.bash_file = self.__write_sourceable_file(credentials=assumed_role_credentials)
-        self.docker_file = self.__write_dockerenv_file(credentials=assumed_role_credentials)
+        if granted != known_duration:
+            if Common.is_debug():
+                Common.dump_out(message='Role {} allows sessions of {} seconds'.format(role.role_arn, granted))
+            self.session_durations.put(role.role_arn, granted)
+        if granted <= 3600:
+            Common.echo(message='YOUR SESSION WILL ONLY LAST ONE HOUR')
+        return assumed_role_credentials
 
-    def __deduce_roles_from_saml(self):
+    @Timings.timed('sts assume role with saml')
+    def __try_duration(self, client, role, duration, raise_validation_error=False):
         """
-        Parse the SAML Token which contains the roles that can be assumed
-        :return: roles contained in SAML token
-        :rtype: [Role]
+        Ask AWS for credentials for a session of a given length
+        :param client: the STS client to make the call with
+        :param role: the AWS role the user wants to assume
+        :type role: AwsRole
+        :param duration: the session length in seconds
+        :type duration: int
+        :param raise_validation_error: whether to raise or swallow AWS's error if the duration is too long
+        :type raise_validation_error: bool
+        :return: the response from AWS holding the credentials or None if the duration is too long for the role
+        :rtype: dict
         """
-        roles = []
-        decoded_assertion = base64.b64decode(self.saml_assertion)
-        root = ElementTree.fromstring(decoded_assertion)
-        for saml2_attribute in root.iter('{urn:oasis:names:tc:SAML:2.0:assertion}Attribute'):
-            if saml2_attribute.get('Name') == 'https://aws.amazon.com/SAML/Attributes/Role':
-                for saml2_attr_value in saml2_attribute.iter('{urn:oasis:names:tc:SAML:2.0:assertion}AttributeValue'):
-                    next_role = AwsRole(saml2_attr_value.text)
-                    roles.append(next_role)
-        return roles
+        try:
+            credentials = client.assume_role_with_saml(
+                RoleArn=role.role_arn,
+                PrincipalArn=role.idp_arn,
+                SAMLAssertion=self.saml_assertion,
+                DurationSeconds=duration
+            )
+            Metrics.increment('clokta_sts_duration_attempts_total', duration=duration, result='granted')
+            return credentials
+        except Exception as e:
+            # StsError and boto3's ClientError both hold AWS's error in e.response
+            if not isinstance(getattr(e, 'response', None), dict) or 'Error' not in e.response:
+                raise
+            if e.response['Error']['Code'] in AwsCredentialsGenerator.REJECTED_ASSERTION_CODES:
+                raise SamlAssertionRejectedError(e.response['Error'].get('Message'))
+            if e.response['Error']['Code'] != 'ValidationError' or raise_validation_error:
+                raise
+            Metrics.increment('clokta_sts_duration_attempts_total', duration=duration, result='too_long')
+            return None
 
-    def __write_sourceable_file(self, credentials):
+    def __write_sourceable_file(self, credentials, profile_name=None):
         """
         Generates a shell script to source in order to apply credentials to the shell environment.
         """
+        profile_name = profile_name or self.clokta_config.profile_name
         creds = credentials['Credentials']
         output_file_name = '{dir}{profile}.sh'.format(
             dir=os.path.expanduser(self.data_dir),
-            profile=self.clokta_config.profile_name
+            profile=profile_name
         )
         lines = [
             'export AWS_ACCESS_KEY_ID={}\n'.format(creds['AccessKeyId']),
@@ -121,18 +333,19 @@ class AwsCredentialsGenerator:
 
         short_output_file_name = '{dir}{profile}.sh'.format(
             dir=self.data_dir,
-            profile=self.clokta_config.profile_name
+            profile=profile_name
         )
         return short_output_file_name
 
-    def __write_dockerenv_file(self, credentials):
+    def __write_dockerenv_file(self, credentials, profile_name=None):
         """
         Generates a Docker .env file that can be used with docker compose to inject into the environment.
         """
+        profile_name = profile_name or self.clokta_config.profile_name
         creds = credentials['Credentials']
         output_file_name = '{dir}{profile}.env'.format(
             dir=os.path.expanduser(self.data_dir),
-            profile=self.clokta_config.profile_name
+            profile=profile_name
         )
         lines = [
             'AWS_ACCESS_KEY_ID={}\n'.format(creds['AccessKeyId']),
@@ -146,6 +359,6 @@ class AwsCredentialsGenerator:
 
         short_output_file_name = '{dir}{profile}.env'.format(
             dir=self.data_dir,
-            profile=self.clokta_config.profile_name
+            profile=profile_name
         )
         return short_output_file_name
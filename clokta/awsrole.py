@@ -1,12 +1,23 @@
 class AwsRole:
     """Represents an AWS role to generate credentials for"""
+
+    # SAML assertions can carry hundreds of roles, so keep each one small
+    __slots__ = ('idp_arn', 'role_arn', 'account', 'role_name')
+
     def __init__(self, idp_role_str):
         """
         :param idp_role_str: a single comma-separated string with the ARN of the Okta IdP and the ARN of the role
         :type idp_role_str: str
         """
-        split_str = idp_role_str.split(',')
-        self.idp_arn = split_str[0]
-        self.role_arn = split_str[1]
-        self.account = self.role_arn.split(':')[4]  # type: str
-        self.role_name = self.role_arn.split(':')[5][5:]  # type: str
+        self.idp_arn, _, self.role_arn = idp_role_str.partition(',')
+        arn_parts = self.role_arn.split(':', 5)
+        self.account = arn_parts[4]  # type: str
+        self.role_name = arn_parts[5][5:]  # type: str
+
+    @property
+    def key(self):
+        """
+        :return: what identifies the role: its account and name
+        :rtype: (str, str)
+        """
+        return self.account, self.role_name
@@ -2,18 +2,21 @@ import base64
 import getpass
 import sys
 
-import click
-import configparser
 import enum
 import json
-import keyring
 import os
 import re
+import threading
+import time
 
+from clokta.account_registry import AccountRegistry
 from clokta.common import Common
+from clokta.config_file import ConfigFile
 from clokta.config_parameter import ConfigParameter
+from clokta.credentials_file import CredentialsFile
 from clokta.factor_chooser import FactorChooser
 from clokta.role_chooser import RoleChooser
+from clokta.timings import Timings
 
 
 class OutputFormat(enum.Enum):
@@ -31,7 +34,14 @@ class CloktaConfiguration(object):
     """
 
     KEYCHAIN_PATTERN = "clokta.{param_name}"  # The key in the keychain to use when storing a param
+    EXPIRATION_KEY = 'x_security_token_expires'  # Where in a credentials profile we note when the keys expire
+    DEFAULT_REFRESH_THRESHOLD = 900  # Reuse keys with more than this many seconds left
 
+    # Reading the keychain can block or make the user unlock it, so each secret is only read once per process
+    __keyring_values = {}  # by (system, user): the secret in the keychain
+    __keyring_lock = threading.Lock()
+
+    @Timings.timed('configuration')
     def __init__(
         self,
         profile_name,
@@ -45,53 +55,69 @@ class CloktaConfiguration(object):
         self.param_list = self.__define_parameters()  # type: [ConfigParameter]
         self.parameters = {p.name: p for p in self.param_list}
         self.displayed_python2_warning = False
+        self.config_file = None  # type: ConfigFile
+        self.unread_secrets = set()  # secrets that are to be looked up in the keychain when first asked for
         self.__initialize_configuration()
 
     def get(self, parameter_name):
         """
-        Get the current value of a configuration parameter
+        Get the current value of a configuration parameter.  Secrets are read from the keychain the first
+        time they are asked for.
         :param parameter_name: the name of the parameter
         :type parameter_name: str
         :return: the value of the parameter or None if not present
         """
-        return self.parameters[parameter_name].value if parameter_name in self.parameters else None
+        if parameter_name not in self.parameters:
+            return None
+        param = self.parameters[parameter_name]
+        if parameter_name in self.unread_secrets:
+            self.unread_secrets.discard(parameter_name)
+            if param.value is None:
+                param.value = self.__read_from_keyring(parameter_name)
+        return param.value
+
+    def get_int(self, parameter_name):
+        """
+        Get the current value of a numeric configuration parameter, falling back to the parameter's
+        default if it is not set or is not a number
+        :param parameter_name: the name of the parameter
+        :type parameter_name: str
+        :return: the value of the parameter
+        :rtype: int
+        """
+        param = self.parameters[parameter_name]
+        try:
+            return int(param.value)
+        except (TypeError, ValueError):
+            if param.value:
+                Common.dump_err('{} configured with value "{}" when only a number is valid.'.format(
+                    param.name, param.value))
+            return param.default_value
 
+    @Timings.timed('clokta.cfg write')
     def update_configuration(self):
         """
-        Write the current version of the configuration to the clokta.cfg file
+        Save the current version of the configuration to the clokta.cfg file.  The file is only rewritten
+        if something in it changed.
         """
-        clokta_cfg_file = configparser.ConfigParser()
-        clokta_cfg_file.read(self.clokta_config_file)
-        if not clokta_cfg_file.has_section(self.profile_name):
-            clokta_cfg_file.add_section(self.profile_name)
-
         for param in self.param_list:
             if param.value:
                 if param.save_to == ConfigParameter.SaveTo.DEFAULT:
-                    clokta_cfg_file.set('DEFAULT', param.name, param.value)
+                    self.config_file.set(ConfigFile.DEFAULT_SECTION, param.name, param.value)
                 elif param.save_to == ConfigParameter.SaveTo.PROFILE:
-                    clokta_cfg_file.set(self.profile_name, param.name, param.value)
+                    self.config_file.set(self.profile_name, param.name, param.value)
                 elif param.save_to == ConfigParameter.SaveTo.KEYRING:
                     self.__save_to_keyring(param.name, param.value)
 
-        if Common.is_debug():
+        if self.config_file.save() and Common.is_debug():
             Common.dump_out(
-                message='Re-writing configuration file {}'.format(self.clokta_config_file)
+                message='Re-wrote configuration file {}'.format(self.clokta_config_file)
             )
-        self.__write_config(
-            path_to_file=self.clokta_config_file,
-            parser=clokta_cfg_file
-        )
 
     def reset_default_role(self):
         # Clear it from the clokta.cfg file
-        clokta_cfg_file = configparser.ConfigParser()
-        clokta_cfg_file.read(self.clokta_config_file)
-        clokta_cfg_file.remove_option(self.profile_name, 'okta_aws_role_to_assume')
-        self.__write_config(
-            path_to_file=self.clokta_config_file,
-            parser=clokta_cfg_file
-        )
+        self.config_file.remove_option(self.profile_name, 'okta_aws_role_to_assume')
+        self.config_file.save()
 
         # And reset it
         self.parameters['okta_aws_role_to_assume'].value = None
@@ -138,6 +164,72 @@ class CloktaConfiguration(object):
                 name='okta_onetimepassword_secret',
                 secret=True
             ),
+            ConfigParameter(
+                # How many seconds to wait for the user to respond to an Okta Verify push
+                name='okta_push_timeout',
+                default_value=60,
+                param_type=int
+            ),
+            ConfigParameter(
+                # Keys with more than this many seconds left are reused rather than logging in again
+                name='credential_refresh_threshold',
+                default_value=CloktaConfiguration.DEFAULT_REFRESH_THRESHOLD,
+                param_type=int
+            ),
+            ConfigParameter(
+                # Whether to pin down the exact longest session a role allows rather than only trying 12, 4 and 1 hours
+                name='discover_session_duration',
+                default_value=False,
+                param_type=bool
+            ),
+            ConfigParameter(
+                # The region whose STS endpoint to call, or "auto" to use the fastest of sts_candidate_regions.
+                # If not set the global endpoint is used.
+                name='sts_region'
+            ),
+            ConfigParameter(
+                # The regions to measure when sts_region is "auto", separated by commas
+                name='sts_candidate_regions'
+            ),
+            ConfigParameter(
+                # Whether to call AWS through boto3 rather than clokta's own STS client
+                name='use_boto3',
+                default_value=False,
+                param_type=bool
+            ),
+            ConfigParameter(
+                # Roles to chain to from the profile's role, one per line as "profile = role ARN > role ARN ..."
+                name='chained_roles'
+            ),
+            ConfigParameter(
+                # The name of the profile each role's credentials are saved to when assuming many roles at once
+                name='batch_profile_format',
+                default_value='{profile}-{account}-{role_name}'
+            ),
+            ConfigParameter(
+                # A friendly name for the profile's AWS account, to look the profile up by
+                name='aws_account_alias'
+            ),
+            ConfigParameter(
+                # Makes the profile a name for a group of profiles, separated by commas, that are logged into together
+                name='profile_group'
+            ),
+            ConfigParameter(
+                # Where to send metrics about logins: "prometheus" to write a textfile, "statsd" to send to StatsD on
+                # localhost, or not set to record none
+                name='metrics_sink'
+            ),
+            ConfigParameter(
+                # The Prometheus textfile metrics are added to, e.g. in a node_exporter textfile collector directory
+                name='metrics_textfile',
+                default_value='~/.clokta/clokta.prom'
+            ),
+            ConfigParameter(
+                # The localhost UDP port StatsD listens on
+                name='metrics_statsd_port',
+                default_value=8125,
+                param_type=int
+            ),
             ConfigParameter(
                 # aws_account_number is not really an input parameter, but
                 # something we deduce during login and wanted to save in the clokta.cfg
@@ -176,26 +268,20 @@ class CloktaConfiguration(object):
     def __initialize_configuration(self):
         """
         Load config file, both the desired section and the default section
-        :return: the parameter list
-        :rtype: dict
         """
-        clokta_cfg_file = configparser.ConfigParser()
-        clokta_cfg_file.read(self.clokta_config_file)
+        self.config_file = ConfigFile.load(self.clokta_config_file)
 
-        # Make sure we have the bare minimum in the config file.  The DEFAULT section and the app URL.
-        if not clokta_cfg_file['DEFAULT']:
-            clokta_cfg_file['DEFAULT'] = {
-            }
-        if not clokta_cfg_file.has_section(self.profile_name):
+        # Make sure we have the bare minimum in the config file, the app URL
+        if not self.config_file.has_section(self.profile_name):
             msg = 'No profile "{}" in clokta.cfg, but enter the information and clokta will create a profile.\n' + \
                   'Copy the link from the Okta App'
+            # Imported only when prompting, so the commands that don't log in never wait for click
+            import click
             app_url = click.prompt(text=msg.format(self.profile_name), type=str, err=Common.to_std_error()).strip()
             app_url = self.__check_url(app_url)
-            clokta_cfg_file.add_section(self.profile_name)
-            clokta_cfg_file.set(self.profile_name, 'okta_aws_app_url', app_url)
+            self.config_file.set(self.profile_name, 'okta_aws_app_url', app_url)
 
-        config_section = clokta_cfg_file[self.profile_name]
-        self.__load_parameters(config_section)
+        self.__load_parameters(self.config_file.section(self.profile_name))
         if self.get('save_password_in_keychain') == 'True':
             self.parameters['okta_password'].save_to = ConfigParameter.SaveTo.KEYRING
 
@@ -204,6 +290,7 @@ class CloktaConfiguration(object):
         if param.secret:
             field_value = getpass.getpass(prompt=prompt+":")
         else:
+            import click
             field_value = click.prompt(text=prompt,
                                        type=param.param_type,
                                        err=Common.to_std_error(),
@@ -213,64 +300,44 @@ class CloktaConfiguration(object):
 
     def apply_credentials(self, credentials):
         """ Save a set of temporary credentials """
-        if Common.is_debug():
-            msg = json.dumps(obj=credentials, default=Common.json_serial, indent=4)
-            Common.dump_out(message=msg)
-
-        parser = configparser.ConfigParser()
-        parser.read(self.profiles_location)
-
-        if self.profile_name not in parser.sections():
-            if Common.is_debug():
-                Common.dump_out(
-                    message='Adding profile section {}'.format(self.profile_name)
-                )
-            parser.add_section(self.profile_name)
-
-        creds = credentials['Credentials']
-        parser[self.profile_name]['AWS_ACCESS_KEY_ID'] = creds['AccessKeyId']
-        parser[self.profile_name]['AWS_SECRET_ACCESS_KEY'] = creds['SecretAccessKey']
-
-        if 'AWS_SESSION_TOKEN' in parser[self.profile_name]:
-            del parser[self.profile_name]['AWS_SESSION_TOKEN']
+        self.apply_credentials_batch(credentials_by_profile={self.profile_name: credentials})
 
-        if 'SessionToken' in creds:
-            parser[self.profile_name]['AWS_SESSION_TOKEN'] = creds['SessionToken']
+    @Timings.timed('credentials write')
+    def apply_credentials_batch(self, credentials_by_profile):
+        """
+        Save sets of temporary credentials for many profiles with one write of the credentials file
+        :param credentials_by_profile: the credentials AWS generated keyed by the profile to store them in
+        :type credentials_by_profile: dict[str, dict]
+        """
+        if not credentials_by_profile:
+            return
 
         if Common.is_debug():
-            Common.dump_out(
-                message='Re-writing credentials file {}'.format(self.profiles_location)
-            )
-
-        self.__write_config(
-            path_to_file=self.profiles_location,
-            parser=parser
-        )
-
-    def __write_config(self, path_to_file, parser):
-        """ Write config to file """
-        self.__backup_file(path_to_file=path_to_file)
-
-        if not os.path.exists(os.path.dirname(path_to_file)):
-            os.makedirs(os.path.dirname(path_to_file))
-
-        with open(path_to_file, 'w') as file:
-            parser.write(file)
-
-    def __backup_file(self, path_to_file):
-        """ Back up config """
-        backup_location = os.path.expanduser(
-            '{}.bak'.format(
-                path_to_file
-            )
-        )
-        if os.path.isfile(path=path_to_file):
-            with open(path_to_file, 'r') as file:
-                contents = file.read()
-
-            with open(backup_location, 'w') as bak_file:
-                bak_file.write(contents)
+            msg = json.dumps(obj=credentials_by_profile, default=Common.json_serial, indent=4)
+            Common.dump_out(message=msg)
+            Common.dump_out(message='Updating credentials file {}'.format(self.profiles_location))
+        CredentialsFile(self.profiles_location).update({
+            profile_name: self.__profile_options(credentials)
+            for profile_name, credentials in credentials_by_profile.items()
+        })
 
+    @classmethod
+    def __profile_options(cls, credentials):
+        """
+        :param credentials: the response from AWS holding the credentials
+        :type credentials: dict
+        :return: the options to set in the credentials file profile, None for those to remove
+        :rtype: dict[str, str]
+        """
+        creds = credentials['Credentials']
+        return {
+            'aws_access_key_id': creds['AccessKeyId'],
+            'aws_secret_access_key': creds['SecretAccessKey'],
+            'aws_session_token': creds.get('SessionToken'),
+            cls.EXPIRATION_KEY: Common.to_iso_timestamp(creds['Expiration']) if creds.get('Expiration') else None
+        }
+
+    @Timings.timed('choose mfa')
     def determine_mfa_mechanism(self, mfas, force_prompt):
         """
         Determine which of the passed in MFA mechanisms to use.  This may be specified
@@ -307,12 +374,13 @@ class CloktaConfiguration(object):
 
         return chosen_factor
 
+    @Timings.timed('choose role')
     def determine_role(self, possible_roles):
         """
         Determine which of several possible roles to assume by looking first in the config for a default role,
         and second by prompting the user.
-        :param possible_roles: list of possible roles to assume
-        :type possible_roles: List[AwsRole]
+        :param possible_roles: the possible roles to assume
+        :type possible_roles: RoleIndex
         :return: the role chosen
         :rtype: AwsRole
         """
@@ -328,6 +396,68 @@ class CloktaConfiguration(object):
         self.parameters['aws_account_number'].value = chosen_role.account
         return chosen_role
 
+    def determine_roles(self, possible_roles, patterns):
+        """
+        Determine which of several possible roles to assume when assuming many roles at once, and the profile
+        each role's credentials should be saved to
+        :param possible_roles: the possible roles to assume
+        :type possible_roles: RoleIndex
+        :param patterns: shell-style patterns matched against each role's name, account number and ARN
+        :type patterns: List[str]
+        :return: the chosen roles keyed by the profile name to use for each
+        :rtype: dict[str, AwsRole]
+        """
+        role_chooser = RoleChooser(possible_roles=possible_roles)
+        chosen_roles = role_chooser.match_roles(patterns)
+        if not chosen_roles:
+            Common.dump_err('No roles match {}.  Available roles are {}'.format(
+                ', '.join(patterns), ', '.join(role.role_arn for role in possible_roles)))
+            raise ValueError('No matching roles')
+
+        profile_format = self.get('batch_profile_format') or self.parameters['batch_profile_format'].default_value
+        return {
+            profile_format.format(profile=self.profile_name, account=role.account, role_name=role.role_name): role
+            for role in chosen_roles
+        }
+
+    def get_chained_roles(self):
+        """
+        :return: the chains of roles to assume from the profile's role, keyed by the profile to save the
+            last role's credentials in
+        :rtype: dict[str, [str]]
+        """
+        return CloktaConfiguration.parse_chained_roles(self.get('chained_roles'))
+
+    @classmethod
+    def parse_chained_roles(cls, value, report_errors=True):
+        """
+        Parse the chained_roles parameter, e.g.
+            chained_roles =
+                myservice = arn:aws:iam::123456789012:role/MyService
+                prod-deploy = arn:aws:iam::123456789012:role/Hop > arn:aws:iam::210987654321:role/Deployer
+        :param value: the value of chained_roles
+        :type value: str
+        :param report_errors: whether to tell the user about lines that can't be parsed
+        :type report_errors: bool
+        :return: the chains of role ARNs keyed by the profile to save the last role's credentials in
+        :rtype: dict[str, [str]]
+        """
+        chains = {}
+        for line in (value or '').splitlines():
+            if not line.strip():
+                continue
+            profile, sep, arns = line.partition('=')
+            chain = [arn.strip() for arn in arns.split('>') if arn.strip()]
+            if not sep or not profile.strip() or not chain or \
+                    not all(arn.startswith('arn:') and ':role/' in arn for arn in chain):
+                if report_errors:
+                    Common.dump_err('Ignoring chained role "{}".  Expected "profile = role ARN > role ARN".'.format(
+                        line.strip()))
+                continue
+            chains[profile.strip()] = chain
+        return chains
+
+    @Timings.timed('prompt')
     def prompt_for(self, param_name):
         """
         Prompt the user for the parameter and store it in the configuration
@@ -337,6 +467,7 @@ class CloktaConfiguration(object):
         param_to_prompt_for = self.parameters[param_name]
         param_to_prompt_for.value = self.__prompt_for(param_to_prompt_for)
 
+    @Timings.timed('one time password')
     def determine_okta_onetimepassword(self, factor, first_time):
         """
         Get the one time password, which may be in one password or
@@ -366,6 +497,7 @@ class CloktaConfiguration(object):
                 otp_value = otp.get_totp(self.get('okta_onetimepassword_secret'))
 
         if not otp_value:
+            import click
             otp_value = click.prompt(
                 text='Enter your {} one time password'.format(factor['clokta_id']),
                 type=str,
@@ -382,7 +514,7 @@ class CloktaConfiguration(object):
         if still not found and the attribute is required, will prompt the user.
         :param config_section: section of the clokta.cfg file that represents the profile that we will
         login to though queries on this will also look in the DEFAULT section
-        :type config_section:
+        :type config_section: dict[str, str]
         :return: a map of attributes that define the clokta login, e.g.
             {"okta_username": "doej", "multifactor_preference": "Google Authenticator", ...}
         :rtype: map[string, string]
@@ -404,7 +536,7 @@ class CloktaConfiguration(object):
                 else:
                     param.value = config_section[param.name]
             elif param.secret:
-                param.value = self.__read_from_keyring(param.name)
+                self.unread_secrets.add(param.name)
 
             if not param.value and param.required:
                 # We need it.  Prompt for it.
@@ -414,6 +546,7 @@ class CloktaConfiguration(object):
         if Common.is_debug():
             Common.dump_out(message=debug_msg)
 
+    @Timings.timed('keyring read')
     def __read_from_keyring(self, param_name):
         """
         Read a secret from the OS keychain
@@ -426,37 +559,48 @@ class CloktaConfiguration(object):
         if sys.version_info > (3, 0):
             system = CloktaConfiguration.KEYCHAIN_PATTERN.format(param_name=param_name)
             user = self.get('okta_username')
-            try:
-                obfuscated = keyring.get_password(system, user)
-                param_value = self.__deobfuscate(obfuscated, user)
-            except Exception as e:
-                fail_msg = str(e)
-                if fail_msg.find('Security Auth Failure') >= 0:
-                    Common.dump_err('WARNING: Denied access to password in keychain.  ' +
-                                    'If prompted by keychain, allow access.\n' +
-                                    'You may need to reboot your machine before keychain will prompt again.')
-                else:
-                    Common.dump_err('WARNING: Could not read password from keychain: {}'.format(e))
+            with CloktaConfiguration.__keyring_lock:
+                if (system, user) in CloktaConfiguration.__keyring_values:
+                    return CloktaConfiguration.__keyring_values[(system, user)]
+                try:
+                    import keyring
+                    obfuscated = keyring.get_password(system, user)
+                    param_value = self.__deobfuscate(obfuscated, user)
+                except Exception as e:
+                    fail_msg = str(e)
+                    if fail_msg.find('Security Auth Failure') >= 0:
+                        Common.dump_err('WARNING: Denied access to password in keychain.  ' +
+                                        'If prompted by keychain, allow access.\n' +
+                                        'You may need to reboot your machine before keychain will prompt again.')
+                    else:
+                        Common.dump_err('WARNING: Could not read password from keychain: {}'.format(e))
+                CloktaConfiguration.__keyring_values[(system, user)] = param_value
         else:
             if not self.displayed_python2_warning:
                 Common.dump_err("Cannot store password in keychain.  Upgrade to Python 3 to use keychain.")
                 self.displayed_python2_warning = True
         return param_value
 
+    @Timings.timed('keyring write')
     def __save_to_keyring(self, param_name, param_value):
         """
-        Save a secret to the keychain.  Obfuscate the secret first.
+        Save a secret to the keychain, unless it's already there.  Obfuscate the secret first.
         :param param_name: the name of the parameter
         :type param_name: str
         :param param_value: the secret to save
         :type param_value: str
         """
         if sys.version_info > (3, 0):
+            if self.__read_from_keyring(param_name) == param_value:
+                return
             try:
                 system = CloktaConfiguration.KEYCHAIN_PATTERN.format(param_name=param_name)
                 user = self.get('okta_username')
                 password = self.__obfuscate(param_value, user)
+                import keyring
                 keyring.set_password(system, user, password)
+                with CloktaConfiguration.__keyring_lock:
+                    CloktaConfiguration.__keyring_values[(system, user)] = param_value
             except Exception as e:
                 fail_msg = str(e)
                 if fail_msg.find('Security Auth Failure') >= 0:
@@ -533,13 +677,133 @@ class CloktaConfiguration(object):
             Common.dump_err('{} configured with value "{}" when only True or False is valid.'.format(name, value))
             return "False"
 
+    @classmethod
+    def group_members(cls, profile_name, clokta_config_file):
+        """
+        Find the profiles a profile name given on the command line stands for: the profiles in a comma separated
+        list (e.g. "dev,staging"), the profiles in a profile's profile_group, or else just the profile
+        :param profile_name: the name of the profile, group of profiles, or list of profiles
+        :type profile_name: str
+        :param clokta_config_file: the clokta.cfg file holding any profile_group
+        :type clokta_config_file: str
+        :return: the names of the profiles, without duplicates
+        :rtype: [str]
+        """
+        if ',' not in profile_name:
+            group = ConfigFile.load(clokta_config_file).get(profile_name, 'profile_group')
+            if not group:
+                return [profile_name]
+            profile_name = group
+        members = []
+        for member in profile_name.split(','):
+            member = member.strip()
+            if member and member not in members:
+                members.append(member)
+        return members
+
+    @classmethod
+    def refresh_threshold(cls, profile_name, clokta_config_file):
+        """
+        Read the credential_refresh_threshold without loading the whole configuration, so it never prompts
+        or reads the keychain
+        :param profile_name: the name of the profile
+        :type profile_name: str
+        :param clokta_config_file: the clokta.cfg file holding the credential_refresh_threshold
+        :type clokta_config_file: str
+        :return: keys expiring within this many seconds should be regenerated
+        :rtype: int
+        """
+        param_name = 'credential_refresh_threshold'
+        threshold = os.getenv(key=param_name)
+        if threshold is None:
+            clokta_cfg_file = ConfigFile.load(clokta_config_file)
+            section = profile_name if clokta_cfg_file.has_section(profile_name) else ConfigFile.DEFAULT_SECTION
+            threshold = clokta_cfg_file.get(section, param_name)
+        try:
+            return int(threshold)
+        except (TypeError, ValueError):
+            return cls.DEFAULT_REFRESH_THRESHOLD
+
+    @classmethod
+    def remaining_credentials_lifetime(cls, profile_name, clokta_config_file, profiles_location='~/.aws/credentials'):
+        """
+        Check whether the keys clokta last saved for a profile can be reused instead of logging in again.
+        This is meant to be fast, so it never prompts or reads the keychain.
+        :param profile_name: the name of the profile
+        :type profile_name: str
+        :param clokta_config_file: the clokta.cfg file holding the credential_refresh_threshold
+        :type clokta_config_file: str
+        :param profiles_location: the AWS credentials file
+        :type profiles_location: str
+        :return: the seconds the profile's keys are still good for, or None if they have expired or will
+            expire within credential_refresh_threshold seconds
+        :rtype: float
+        """
+        threshold = cls.refresh_threshold(profile_name=profile_name, clokta_config_file=clokta_config_file)
+        expires_at = cls.credentials_expiration(profile_name=profile_name, clokta_config_file=clokta_config_file,
+                                                profiles_location=profiles_location)
+        remaining = expires_at - time.time() if expires_at else 0
+        return remaining if remaining > threshold else None
+
+    @classmethod
+    def credentials_expiration(cls, profile_name, clokta_config_file, profiles_location='~/.aws/credentials'):
+        """
+        Find when the keys clokta last saved for a profile, or for any of its chained roles, expire
+        :param profile_name: the name of the profile
+        :type profile_name: str
+        :param clokta_config_file: the clokta.cfg file holding the profile's chained_roles
+        :type clokta_config_file: str
+        :param profiles_location: the AWS credentials file
+        :type profiles_location: str
+        :return: when the first of the keys expires, in seconds since the epoch, or None if not known
+        :rtype: float
+        """
+        clokta_cfg_file = ConfigFile.load(clokta_config_file)
+        chained_profiles = cls.parse_chained_roles(clokta_cfg_file.get(profile_name, 'chained_roles'),
+                                                   report_errors=False)
+
+        # The keys of chained roles last an hour at most, so they usually expire first
+        profile_names = [profile_name] + list(chained_profiles)
+        profiles = CredentialsFile(profiles_location).read(profile_names)
+        expirations = []
+        for name in profile_names:
+            expires_at = Common.to_epoch(profiles.get(name, {}).get(cls.EXPIRATION_KEY) or '')
+            if not expires_at:
+                return None
+            expirations.append(expires_at)
+        return min(expirations)
+
+    @classmethod
+    def configure_credential_process(cls, profile_name, config_location='~/.aws/config',
+                                     profiles_location='~/.aws/credentials'):
+        """
+        Point an AWS profile at "clokta credential-process" so AWS SDKs and the AWS CLI ask clokta for keys
+        whenever they need them.  Any keys clokta saved for the profile in the credentials file are removed,
+        since AWS would use those instead.
+        :param profile_name: the name of the profile
+        :type profile_name: str
+        :param config_location: the AWS config file
+        :type config_location: str
+        :param profiles_location: the AWS credentials file
+        :type profiles_location: str
+        """
+        config_location = os.path.expanduser(config_location)
+        profiles_location = os.path.expanduser(profiles_location)
+        section = profile_name if profile_name == 'default' else 'profile {}'.format(profile_name)
+
+        # The config file has the same format as the credentials file
+        CredentialsFile(config_location).update({
+            section: {'credential_process': 'clokta credential-process -p {}'.format(profile_name)}
+        })
+        Common.echo(message='Added credential_process for {} to {}'.format(profile_name, config_location))
+
+        if CredentialsFile(profiles_location).remove([profile_name]):
+            Common.echo(message='Removed saved keys for {} from {}'.format(profile_name, profiles_location))
+
     @classmethod
     def dump_account_numbers(cls, clokta_config_file):
-        clokta_cfg_file = configparser.ConfigParser()
-        clokta_cfg_file.read(os.path.expanduser(clokta_config_file))
-        section_names = clokta_cfg_file.sections()
-        for section_name in section_names:
-            if clokta_cfg_file.has_option(section=section_name, option='aws_account_number'):
-                acct_num = clokta_cfg_file.get(section=section_name, option='aws_account_number')
-                if acct_num:
-                    Common.echo("{name} = {number}".format(name=section_name, number=acct_num))
+        registry = AccountRegistry(data_dir=os.path.dirname(os.path.expanduser(clokta_config_file)),
+                                   clokta_config_file=clokta_config_file)
+        for profile_name, entry in registry.dump().items():
+            if entry['account']:
+                Common.echo("{name} = {number}".format(name=profile_name, number=entry['account']))
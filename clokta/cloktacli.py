@@ -1,17 +1,26 @@
 """
 This is the entry-point to the cli application.
 """
-import os
+import json
 
 import click
 
+from clokta import __version__, launcher
 from clokta.clokta_configuration import CloktaConfiguration
-from clokta.role_assumer import RoleAssumer, Common
+from clokta.common import Common
+from clokta.launcher import configure_output_format, get_profile_from_env
+from clokta.metrics import Metrics
+from clokta.refresh_agent import RefreshAgent
+from clokta.role_catalog import RoleCatalog
+from clokta.role_assumer import RoleAssumer
+from clokta.timings import Timings
 
 
-@click.command()
-@click.version_option()
-@click.option('--profile', '-p', help='Configuration profile.  Required unless specified by AWS_PROFILE')
+@click.group(invoke_without_command=True)
+@click.version_option(version=__version__, prog_name='clokta')
+@click.option('--profile', '-p', help='Configuration profile.  Required unless specified by AWS_PROFILE.  ' +
+                                     'Several profiles separated by commas, or a profile with a profile_group, ' +
+                                     'are logged into together.')
 @click.option('--inline-help', '-i', is_flag=True,
               help='Output explicit steps on how to use generated keys and override defaults')
 @click.option('--no-default-role', is_flag=True, help='Lets you choose a different role than your default')
@@ -21,11 +30,32 @@ from clokta.role_assumer import RoleAssumer, Common
 @click.option('--verbose', '-v', is_flag=True, help='Output internal state for debugging')
 @click.option('--list-accounts',  is_flag=True,
               help='List all accounts, profile and account number, configured in clokta')
-def assume_role(profile, inline_help=False, no_default_role=False, quiet=False, verbose=False, list_accounts=False):
+@click.option('--list-roles', is_flag=True,
+              help='List the roles found at previous logins without logging in.  Only those of the profile\'s ' +
+                   'Okta app if --profile is given')
+@click.option('--account', metavar='PATTERN', help='With --list-roles, only roles in accounts matching PATTERN')
+@click.option('--role-name', metavar='PATTERN', help='With --list-roles, only roles named like PATTERN')
+@click.option('--json', 'as_json', is_flag=True, help='With --list-accounts, --list-roles or --timings, output JSON')
+@click.option('--roles', multiple=True, metavar='PATTERN',
+              help='Generate keys for every role whose name, account number or ARN matches PATTERN ' +
+                   '(e.g. "*Admin*").  Each role is saved to its own profile.  May be repeated.')
+@click.option('--all-roles', is_flag=True, help='Generate keys for every role available to the profile')
+@click.option('--force', '-f', is_flag=True, help='Generate new keys even if the current ones have not expired')
+@click.option('--timings', is_flag=True, help='Print how long each step of the login took to stderr')
+@click.pass_context
+def assume_role(ctx, profile, inline_help=False, no_default_role=False, quiet=False, verbose=False,
+                list_accounts=False, list_roles=False, account=None, role_name=None, as_json=False, roles=(),
+                all_roles=False, force=False, timings=False):
     """ Click point of entry """
+    if ctx.invoked_subcommand:
+        return
 
     if list_accounts:
-        CloktaConfiguration.dump_account_numbers('~/.clokta/clokta.cfg')
+        launcher.list_accounts(as_json=as_json)
+        exit(0)
+
+    if list_roles:
+        dump_roles(profile=profile, account=account, role_name=role_name, as_json=as_json)
         exit(0)
 
     if not profile:
@@ -36,31 +66,100 @@ def assume_role(profile, inline_help=False, no_default_role=False, quiet=False,
                 exit(0)
 
     configure_output_format(verbose, inline_help, quiet)
+    if timings:
+        Timings.enable()
     assumer = RoleAssumer(profile=profile)
-    assumer.assume_role(reset_default_role=no_default_role)
+    role_patterns = ['*'] if all_roles else list(roles)
+    try:
+        errors = assumer.assume_role(reset_default_role=no_default_role, role_patterns=role_patterns or None,
+                                     force=force)
+    finally:
+        Metrics.flush()
+        Timings.report(as_json=as_json)
+    if errors:
+        exit(1)
+
+
+@assume_role.command(name='credential-process')
+@click.option('--profile', '-p', help='Configuration profile.  Required unless specified by AWS_PROFILE')
+@click.option('--force', '-f', is_flag=True, help='Generate new keys even if the cached ones have not expired')
+@click.option('--timings', is_flag=True, help='Print how long each step took to stderr')
+def credential_process(profile, force=False, timings=False):
+    """
+    Print keys as JSON for an AWS credential_process.  Logs in only when the cached keys are expiring.
+    """
+    Common.set_output_format(Common.quiet_out)
+    profile = profile or get_profile_from_env()
+    if not profile:
+        Common.dump_err(message='Specify a profile with -p')
+        exit(1)
+    if timings:
+        Timings.enable()
+    try:
+        output = RoleAssumer(profile=profile).credential_process(force=force)
+    finally:
+        Metrics.flush()
+        Timings.report()
+    click.echo(json.dumps(output))
+
+
+@assume_role.command(name='configure-credential-process')
+@click.option('--profile', '-p', help='Configuration profile.  Required unless specified by AWS_PROFILE')
+def configure_credential_process(profile):
+    """
+    Set up an AWS profile to get keys from "clokta credential-process" so they are renewed automatically
+    """
+    profile = profile or get_profile_from_env()
+    if not profile:
+        Common.dump_err(message='Specify a profile with -p')
+        exit(1)
+    CloktaConfiguration.configure_credential_process(profile_name=profile)
+
+
+@assume_role.command()
+@click.option('--profile', '-p', 'profiles', multiple=True, required=True,
+              help='Profile to keep fresh.  May be repeated.')
+@click.option('--refresh-before', type=int, default=RefreshAgent.DEFAULT_REFRESH_BEFORE, show_default=True,
+              help='Seconds before keys expire to refresh them')
+@click.option('--once', is_flag=True, help='Refresh the profiles whose keys are due and exit')
+@click.option('--verbose', '-v', is_flag=True, help='Output internal state for debugging')
+def agent(profiles, refresh_before, once=False, verbose=False):
+    """
+    Keep profiles' keys fresh, regenerating them shortly before they expire.  Runs until interrupted.
+    Works as long as the Okta session lasts; it never prompts for a password or MFA.
+    """
+    configure_output_format(verbose=verbose, inline_help=False, quiet=False)
+    try:
+        RefreshAgent(profiles=profiles, refresh_before=refresh_before).run(once=once)
+    except KeyboardInterrupt:
+        pass
 
 
-def configure_output_format(verbose, inline_help, quiet):
+@assume_role.command()
+@click.argument('term')
+@click.option('--prefix', is_flag=True, help='Match everything starting with TERM')
+@click.option('--json', 'as_json', is_flag=True, help='Output the matching profiles as JSON')
+def lookup(term, prefix=False, as_json=False):
     """
-    Reads the three output-related command line flags and determines desired output 
+    Find the profiles for an account number, account alias, profile name, Okta app URL or role ARN
     """
-    if verbose:
-        Common.set_output_format(Common.debugging_out)
-    elif quiet:
-        Common.set_output_format(Common.quiet_out)
-    elif inline_help:
-        Common.set_output_format(Common.long_out)
-    else:
-        Common.set_output_format(Common.brief_out)
+    if not launcher.lookup(term=term, prefix=prefix, as_json=as_json):
+        exit(1)
 
 
-def get_profile_from_env():
+def dump_roles(profile, account, role_name, as_json):
     """
-    Look up the AWS_PROFILE variable and return it
-    :return: value of AWS_PROFILE, or None if not defined
-    :rtype: stre
+    Output the roles in the role catalog, as a table or as JSON
     """
-    from_env = os.getenv(key='AWS_PROFILE')
-    if from_env:
-        Common.echo("Using profile '{}' from AWS_PROFILE".format(from_env))
-    return from_env
+    found = RoleCatalog(data_dir='~/.clokta/').find(profile_name=profile, account=account, role_name=role_name)
+    if as_json:
+        click.echo(json.dumps(found, indent=2))
+        return
+    if not found:
+        Common.dump_err('No matching roles.  Roles are recorded each time you run "clokta -p «profile»".')
+        return
+    row = '{account:<14}{role_name:<32}{profiles:<24}{saved_at}'
+    Common.echo(row.format(account='ACCOUNT', role_name='ROLE', profiles='PROFILES', saved_at='SAVED'))
+    for role in found:
+        Common.echo(row.format(account=role['account'], role_name=role['role_name'],
+                               profiles=','.join(role['profiles']), saved_at=role['saved_at']))
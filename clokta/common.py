@@ -1,12 +1,11 @@
 '''
 Simple utility methods for the module
 '''
-import logging
+import calendar
 import sys
+import time
 from datetime import date, datetime
 
-import click
-
 
 class Common(object):
 
@@ -50,6 +49,9 @@ class Common(object):
         :param message: the message to print
         :param new_line: whether to put a new line at the end (default is include new line)
         """
+        # click takes longer to import than the commands that don't log in take to run, so it is only imported
+        # when output is styled
+        import click
         click.secho(message, nl=new_line, bold=True, fg='red', err=True)
 
     @classmethod
@@ -62,6 +64,7 @@ class Common(object):
         if new_line:
             message += '\n'
         if Common.is_debug():
+            import click
             click.secho(message, nl=new_line, bold=False, fg='blue', err=Common.to_std_error())
 
     @classmethod
@@ -76,7 +79,13 @@ class Common(object):
         stdout.  always_stdout should be True if this output is an executable command that should go to stdout then
         """
         to_std_error = not always_stdout and Common.to_std_error()
-        click.secho(message, nl=new_line, bold=bold, err=to_std_error)
+        if bold:
+            import click
+            click.secho(message, nl=new_line, bold=bold, err=to_std_error)
+            return
+        stream = sys.stderr if to_std_error else sys.stdout
+        stream.write(message + '\n' if new_line else message)
+        stream.flush()
 
     @classmethod
     def json_serial(cls, obj):
@@ -84,3 +93,40 @@ class Common(object):
         if isinstance(obj, (datetime, date)):
             return obj.isoformat()
         raise TypeError("Type %s not serializable" % type(obj))
+
+    @classmethod
+    def to_iso_timestamp(cls, value):
+        """
+        Convert a time to an ISO 8601 UTC timestamp (e.g. 2019-01-02T03:04:05Z)
+        :param value: the time as a datetime (naive datetimes are taken to be UTC), seconds since the epoch,
+            or an ISO 8601 UTC timestamp
+        :type value: datetime or float or str
+        :return: the timestamp
+        :rtype: str
+        """
+        if isinstance(value, datetime):
+            if value.utcoffset() is not None:
+                value = value - value.utcoffset()
+            return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+        if isinstance(value, (int, float)):
+            return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(value))
+        return value
+
+    @classmethod
+    def to_epoch(cls, timestamp):
+        """
+        Convert an ISO 8601 UTC timestamp, as used by Okta and in SAML (e.g. 2019-01-02T03:04:05.678Z),
+        to seconds since the epoch
+        :param timestamp: the timestamp
+        :type timestamp: str
+        :return: seconds since the epoch or None if the timestamp could not be parsed
+        :rtype: float
+        """
+        if not timestamp:
+            return None
+        seconds, _, fraction = timestamp.rstrip('Z').partition('.')
+        try:
+            parsed = calendar.timegm(time.strptime(seconds, '%Y-%m-%dT%H:%M:%S'))
+        except ValueError:
+            return None
+        return parsed + (float('0.' + fraction) if fraction.isdigit() else 0)
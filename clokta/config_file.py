@@ -0,0 +1,233 @@
+'''
+An INI file read once and only written back when it changes
+'''
+import configparser
+import io
+import json
+import os
+
+from clokta.common import Common
+from clokta.file_utils import FileUtils
+
+
+class ConfigFile(object):
+    """
+    The sections and options of an INI file like clokta.cfg, held in memory.  Changes are remembered so
+    save() only writes the file when a value really changed, and replays them on top of the file if another
+    process changed it in the meantime.
+
+    Parsing a clokta.cfg with hundreds of profiles takes a noticeable time, so what was parsed is cached,
+    in memory for the rest of the run and on disk next to the file ("<file>.cache") for later runs.  A cache
+    is only used while the file's modification time, size and inode are the same as when it was parsed.
+    """
+
+    DEFAULT_SECTION = 'DEFAULT'
+    CACHE_SUFFIX = '.cache'
+
+    __parsed = {}  # by path: (file's stat signature, sections) of files parsed in this process
+
+    def __init__(self, path_to_file, sections=None, signature=None, use_cache=True):
+        """
+        :param path_to_file: the file
+        :type path_to_file: str
+        :param sections: the options of each section, including DEFAULT
+        :type sections: dict[str, dict[str, str]]
+        :param signature: the stat signature of the file the sections were read from
+        :type signature: list
+        :param use_cache: whether to cache the parsed file on disk
+        :type use_cache: bool
+        """
+        self.path_to_file = os.path.expanduser(path_to_file)
+        self.sections = sections if sections is not None else {ConfigFile.DEFAULT_SECTION: {}}
+        self.signature = signature
+        self.use_cache = use_cache
+        self.changes = []  # (section, option, value or None to remove) in the order they were made
+
+    @classmethod
+    def load(cls, path_to_file, use_cache=True):
+        """
+        Read a file, from the in-memory or on-disk cache if it hasn't changed since it was parsed
+        :param path_to_file: the file.  A file that doesn't exist reads as empty.
+        :type path_to_file: str
+        :param use_cache: whether to cache the parsed file on disk.  Never do this for files holding secrets.
+        :type use_cache: bool
+        :rtype: ConfigFile
+        """
+        path_to_file = os.path.expanduser(path_to_file)
+        signature = cls.signature(path_to_file)
+        sections = None
+        parsed = cls.__parsed.get(path_to_file)
+        if parsed and parsed[0] == signature:
+            sections = parsed[1]
+        elif use_cache and signature:
+            sections = cls.__read_cache(path_to_file, signature)
+        if sections is None:
+            sections = cls.__parse(path_to_file)
+            if use_cache and signature:
+                cls.__write_cache(path_to_file, signature, sections)
+        cls.__parsed[path_to_file] = (signature, sections)
+        # Hand out a copy so changes aren't seen by other loads until they're saved
+        return ConfigFile(path_to_file, sections={name: dict(options) for name, options in sections.items()},
+                          signature=signature, use_cache=use_cache)
+
+    @property
+    def dirty(self):
+        """
+        :return: whether anything has changed since the file was read
+        :rtype: bool
+        """
+        return bool(self.changes)
+
+    def has_section(self, section):
+        return section != ConfigFile.DEFAULT_SECTION and section in self.sections
+
+    def section_names(self):
+        """
+        :return: the names of the sections other than DEFAULT, in the order they appear in the file
+        :rtype: [str]
+        """
+        return [name for name in self.sections if name != ConfigFile.DEFAULT_SECTION]
+
+    def section(self, section):
+        """
+        :param section: the name of the section
+        :type section: str
+        :return: the section's options, including those it inherits from DEFAULT
+        :rtype: dict[str, str]
+        """
+        return dict(self.sections[ConfigFile.DEFAULT_SECTION], **self.sections.get(section, {}))
+
+    def get(self, section, option, fallback=None):
+        """
+        :param section: the name of the section
+        :type section: str
+        :param option: the name of the option
+        :type option: str
+        :param fallback: what to return if the section doesn't have the option
+        :return: the option's value in the section or, if not there, in DEFAULT
+        :rtype: str
+        """
+        if section not in self.sections:
+            return fallback
+        option = option.lower()
+        value = self.sections[section].get(option)
+        if value is None:
+            value = self.sections[ConfigFile.DEFAULT_SECTION].get(option, fallback)
+        return value
+
+    def set(self, section, option, value):
+        """
+        Set an option, adding the section if it isn't there.  Setting an option to the value it already has
+        is not a change.
+        :param section: the name of the section
+        :type section: str
+        :param option: the name of the option
+        :type option: str
+        :param value: the value
+        :type value: str
+        """
+        option = option.lower()
+        value = str(value)
+        if self.sections.get(section, {}).get(option) == value:
+            return
+        self.__apply(section, option, value)
+        self.changes.append((section, option, value))
+
+    def remove_option(self, section, option):
+        """
+        Remove an option from a section if it is there
+        :param section: the name of the section
+        :type section: str
+        :param option: the name of the option
+        :type option: str
+        """
+        option = option.lower()
+        if option not in self.sections.get(section, {}):
+            return
+        self.__apply(section, option, None)
+        self.changes.append((section, option, None))
+
+    def save(self):
+        """
+        Write the file if anything changed, keeping the previous version as "<file>.bak"
+        :return: whether the file was written
+        :rtype: bool
+        """
+        if not self.changes:
+            return False
+        with FileUtils.lock(self.path_to_file):
+            signature = ConfigFile.signature(self.path_to_file)
+            if signature != self.signature:
+                # Someone else changed the file since we read it.  Make our changes to their version.
+                if Common.is_debug():
+                    Common.dump_out(message='{} changed since it was read.  Merging changes.'.format(
+                        self.path_to_file))
+                self.sections = ConfigFile.__parse(self.path_to_file)
+                for section, option, value in self.changes:
+                    self.__apply(section, option, value)
+
+            parser = configparser.ConfigParser(interpolation=None)
+            parser.read_dict(self.sections)
+            contents = io.StringIO()
+            parser.write(contents)
+            FileUtils.backup(self.path_to_file)
+            FileUtils.atomic_write(self.path_to_file, contents.getvalue())
+
+            self.signature = ConfigFile.signature(self.path_to_file)
+            self.changes = []
+            saved = {name: dict(options) for name, options in self.sections.items()}
+            ConfigFile.__parsed[self.path_to_file] = (self.signature, saved)
+            if self.use_cache:
+                ConfigFile.__write_cache(self.path_to_file, self.signature, saved)
+        return True
+
+    def __apply(self, section, option, value):
+        options = self.sections.setdefault(section, {})
+        if value is None:
+            options.pop(option, None)
+        else:
+            options[option] = value
+
+    @classmethod
+    def signature(cls, path_to_file):
+        """
+        :param path_to_file: the file
+        :type path_to_file: str
+        :return: what identifies this version of the file, or None if there is no file
+        :rtype: list
+        """
+        try:
+            stat = os.stat(path_to_file)
+        except OSError:
+            return None
+        return [stat.st_mtime_ns, stat.st_size, stat.st_ino]
+
+    @classmethod
+    def __parse(cls, path_to_file):
+        # Read DEFAULT as an ordinary section, so each section holds only its own options
+        parser = configparser.ConfigParser(interpolation=None, default_section='\0')
+        parser.read(path_to_file)
+        sections = {ConfigFile.DEFAULT_SECTION: {}}
+        for name in parser.sections():
+            sections[name] = dict(parser.items(name))
+        return sections
+
+    @classmethod
+    def __read_cache(cls, path_to_file, signature):
+        try:
+            with open(path_to_file + ConfigFile.CACHE_SUFFIX, 'r') as file:
+                cache = json.load(file)
+        except (IOError, OSError, ValueError):
+            return None
+        if cache.get('signature') != signature:
+            return None
+        return cache.get('sections')
+
+    @classmethod
+    def __write_cache(cls, path_to_file, signature, sections):
+        try:
+            FileUtils.atomic_write(path_to_file + ConfigFile.CACHE_SUFFIX,
+                                   json.dumps({'signature': signature, 'sections': sections}))
+        except (IOError, OSError) as e:
+            if Common.is_debug():
+                Common.dump_out(message='Could not cache {}: {}'.format(path_to_file, e))
@@ -0,0 +1,152 @@
+'''
+Persists Okta session cookies between runs of clokta
+'''
+import json
+import os
+import time
+
+from requests.cookies import create_cookie
+
+from clokta.common import Common
+from clokta.file_utils import FileUtils
+
+
+class CookieStore(object):
+    """
+    The cookies clokta has collected from one Okta org (e.g. mycompany.okta.com).  Each org's cookies
+    are stored in their own JSON file in the cookies directory, read from disk at most once per process,
+    and written atomically under a lock so concurrent clokta runs don't corrupt each other.
+    """
+
+    COOKIE_DIR = 'cookies'
+    LEGACY_COOKIE_FILE = 'clokta.cookies'
+    SESSION_COOKIES = ['sid', 'idx']  # The cookies Okta uses to identify a session
+
+    __stores = {}  # The stores already loaded by this process, keyed by file
+
+    @classmethod
+    def for_org(cls, data_dir, org):
+        """
+        Get the cookie store for an Okta org, loading it from disk if this process has not yet
+        :param data_dir: the clokta data directory (e.g. ~/.clokta/)
+        :type data_dir: str
+        :param org: the Okta org's dns name (e.g. mycompany.okta.com)
+        :type org: str
+        :return: the org's cookie store
+        :rtype: CookieStore
+        """
+        cookie_file = os.path.join(os.path.expanduser(data_dir), cls.COOKIE_DIR, '{}.json'.format(org))
+        if cookie_file not in cls.__stores:
+            cls.__stores[cookie_file] = CookieStore(org=org, cookie_file=cookie_file)
+        return cls.__stores[cookie_file]
+
+    def __init__(self, org, cookie_file):
+        """
+        Use CookieStore.for_org() rather than creating directly
+        :param org: the Okta org's dns name (e.g. mycompany.okta.com)
+        :type org: str
+        :param cookie_file: the file the cookies are stored in
+        :type cookie_file: str
+        """
+        self.org = org
+        self.cookie_file = cookie_file
+        stored = self.__read()
+        self.cookies = stored.get('cookies', [])  # type: [dict]
+        # The latest time the Okta session was known to be valid until.  Okta extends sessions as they are
+        # used, so the session may well last longer.
+        self.session_expires_at = stored.get('session_expires_at')  # type: float
+        # The session cookie of a session Okta has told us is no longer valid
+        self.dead_session = stored.get('dead_session')  # type: str
+
+    def load_into(self, jar):
+        """
+        Add the stored cookies to a cookie jar, skipping any that have expired
+        :param jar: the cookie jar of the HTTP session talking to Okta
+        :type jar: requests.cookies.RequestsCookieJar
+        """
+        now = time.time()
+        for cookie in self.cookies:
+            if cookie.get('expires') is None or cookie['expires'] > now:
+                jar.set_cookie(create_cookie(
+                    name=cookie['name'],
+                    value=cookie['value'],
+                    domain=cookie['domain'],
+                    path=cookie.get('path', '/'),
+                    expires=cookie.get('expires'),
+                    secure=cookie.get('secure', False),
+                    rest={'HttpOnly': None} if cookie.get('http_only') else {}
+                ))
+
+    def save(self, jar):
+        """
+        Replace the stored cookies with this org's unexpired cookies in a cookie jar and write them to disk
+        :param jar: the cookie jar of the HTTP session talking to Okta
+        :type jar: requests.cookies.RequestsCookieJar
+        """
+        now = time.time()
+        self.cookies = [
+            {
+                'name': cookie.name,
+                'value': cookie.value,
+                'domain': cookie.domain,
+                'path': cookie.path,
+                'expires': cookie.expires,
+                'secure': cookie.secure,
+                'http_only': cookie.has_nonstandard_attr('HttpOnly')
+            }
+            for cookie in jar
+            if self.__belongs_to_org(cookie.domain) and (cookie.expires is None or cookie.expires > now)
+        ]
+        self.__write()
+
+    def session_cookie(self):
+        """
+        :return: the value of the unexpired Okta session cookie or None if there isn't one
+        :rtype: str
+        """
+        now = time.time()
+        for cookie in self.cookies:
+            if cookie['name'] in CookieStore.SESSION_COOKIES and (cookie.get('expires') is None or
+                                                                   cookie['expires'] > now):
+                return cookie['value']
+        return None
+
+    def record_session(self, expires_at):
+        """
+        Remember when the current Okta session expires
+        :param expires_at: seconds since the epoch when the session expires, or None if the session is not valid
+        :type expires_at: float
+        """
+        self.session_expires_at = expires_at
+        self.dead_session = None if expires_at else self.session_cookie()
+        self.__write()
+
+    def __belongs_to_org(self, domain):
+        domain = domain.lstrip('.')
+        return self.org == domain or self.org.endswith('.' + domain)
+
+    def __read(self):
+        try:
+            with open(self.cookie_file, 'r') as file:
+                return json.load(file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def __write(self):
+        contents = json.dumps({
+            'org': self.org,
+            'cookies': self.cookies,
+            'session_expires_at': self.session_expires_at,
+            'dead_session': self.dead_session
+        }, separators=(',', ':'))
+        try:
+            with FileUtils.lock(self.cookie_file):
+                FileUtils.atomic_write(self.cookie_file, contents, mode=0o600)
+        except (IOError, OSError) as e:
+            Common.dump_err('WARNING: Could not save Okta cookies: {}'.format(e))
+            return
+
+        # Cookies used to be pickled into one file shared by all orgs.  It is no longer read.
+        legacy_file = os.path.join(os.path.dirname(os.path.dirname(self.cookie_file)), self.LEGACY_COOKIE_FILE)
+        if os.path.exists(legacy_file):
+            os.remove(legacy_file)
@@ -0,0 +1,95 @@
+'''
+Keeps the keys served to AWS SDKs through credential_process
+'''
+import json
+import os
+import time
+
+from clokta.common import Common
+from clokta.file_utils import FileUtils
+
+
+class CredentialCache(object):
+    """
+    The temporary keys clokta generated for each profile in credential_process mode, so an SDK asking for
+    keys again gets them straight from disk until they are close to expiring.  Stored in
+    ~/.clokta/credential_process.json, readable only by the user.
+    """
+
+    CACHE_FILE = 'credential_process.json'
+
+    def __init__(self, data_dir):
+        """
+        :param data_dir: the clokta data directory (e.g. ~/.clokta/)
+        :type data_dir: str
+        """
+        self.cache_file = os.path.join(os.path.expanduser(data_dir), CredentialCache.CACHE_FILE)
+
+    def get(self, profile_name, threshold):
+        """
+        :param profile_name: the name of the profile
+        :type profile_name: str
+        :param threshold: keys expiring within this many seconds are treated as expired
+        :type threshold: int
+        :return: the profile's keys in credential_process format, or None if there are none good for
+            longer than threshold
+        :rtype: dict
+        """
+        entry = self.__read().get(profile_name)
+        if not entry:
+            return None
+        expires_at = Common.to_epoch(entry.get('Expiration') or '')
+        if not expires_at or expires_at - time.time() <= threshold:
+            return None
+        return entry
+
+    def put(self, profile_name, credentials):
+        """
+        Remember the keys generated for a profile
+        :param profile_name: the name of the profile
+        :type profile_name: str
+        :param credentials: the response from AWS holding the credentials
+        :type credentials: dict
+        :return: the keys in credential_process format
+        :rtype: dict
+        """
+        entry = CredentialCache.to_process_output(credentials)
+        try:
+            with FileUtils.lock(self.cache_file):
+                entries = self.__read()
+                now = time.time()
+                entries = {name: e for name, e in entries.items()
+                           if (Common.to_epoch(e.get('Expiration') or '') or 0) > now}
+                entries[profile_name] = entry
+                FileUtils.atomic_write(self.cache_file, json.dumps(entries), mode=0o600)
+        except (IOError, OSError) as e:
+            Common.dump_err('WARNING: Could not cache credentials: {}'.format(e))
+        return entry
+
+    @classmethod
+    def to_process_output(cls, credentials):
+        """
+        Convert the response from AWS to what the AWS SDKs expect from a credential_process
+        :param credentials: the response from AWS holding the credentials
+        :type credentials: dict
+        :return: the keys in credential_process format
+        :rtype: dict
+        """
+        creds = credentials['Credentials']
+        output = {
+            'Version': 1,
+            'AccessKeyId': creds['AccessKeyId'],
+            'SecretAccessKey': creds['SecretAccessKey']
+        }
+        if creds.get('SessionToken'):
+            output['SessionToken'] = creds['SessionToken']
+        if creds.get('Expiration'):
+            output['Expiration'] = Common.to_iso_timestamp(creds['Expiration'])
+        return output
+
+    def __read(self):
+        try:
+            with open(self.cache_file, 'r') as file:
+                return json.load(file)
+        except (IOError, OSError, ValueError):
+            return {}
@@ -0,0 +1,192 @@
+'''
+Reads and updates profiles in the AWS credentials file
+'''
+import os
+import re
+
+from clokta.common import Common
+from clokta.file_utils import FileUtils
+
+
+class CredentialsFile(object):
+    """
+    The AWS credentials file (~/.aws/credentials).  Updates only touch the lines of the profiles being
+    changed, so every other profile, comment and blank line is left exactly as it was, and the file isn't
+    parsed or rewritten profile by profile.  Each update holds a lock on the file and replaces it atomically,
+    so clokta processes writing at the same time never lose each other's keys or leave a half written file.
+    The previous version is kept as "<file>.bak".
+    """
+
+    SECTION_PATTERN = re.compile(r'^\s*\[([^\]]+)\]')
+    OPTION_PATTERN = re.compile(r'^([^\s=:#;][^=:]*?)\s*[=:]')
+
+    def __init__(self, path_to_file):
+        """
+        :param path_to_file: the credentials file
+        :type path_to_file: str
+        """
+        self.path_to_file = os.path.expanduser(path_to_file)
+
+    def read(self, profile_names):
+        """
+        Read some of the profiles in the file
+        :param profile_names: the profiles to read
+        :type profile_names: Iterable[str]
+        :return: the options of each of the profiles that is in the file, with names in lower case
+        :rtype: dict[str, dict[str, str]]
+        """
+        wanted = set(profile_names)
+        profiles = {}
+        for name, lines in self.__split(self.__read_lines()):
+            if name in wanted:
+                options = profiles.setdefault(name, {})
+                for option, option_lines in self.__options(lines):
+                    if option:
+                        first = option_lines[0][CredentialsFile.OPTION_PATTERN.match(option_lines[0]).end():]
+                        options[option] = '\n'.join([first.strip()] + [line.strip() for line in option_lines[1:]])
+        return profiles
+
+    def update(self, options_by_profile):
+        """
+        Change options of many profiles at once, adding any profile that isn't in the file yet
+        :param options_by_profile: the options to set in each profile.  An option set to None is removed.
+        :type options_by_profile: dict[str, dict[str, str]]
+        """
+        self.__rewrite(lambda name, lines: self.__update_section(lines, options_by_profile[name])
+                       if name in options_by_profile else lines,
+                       added=options_by_profile)
+
+    def remove(self, profile_names):
+        """
+        Remove profiles from the file
+        :param profile_names: the profiles to remove
+        :type profile_names: Iterable[str]
+        :return: the profiles that were in the file
+        :rtype: [str]
+        """
+        removed = []
+        profile_names = set(profile_names)
+
+        def remove_section(name, lines):
+            if name in profile_names:
+                removed.append(name)
+                return []
+            return lines
+        self.__rewrite(remove_section, added={})
+        return removed
+
+    def __rewrite(self, edit_section, added):
+        """
+        Replace the file with one where each section has been edited and new sections appended
+        :param edit_section: given a section's name and lines, returns its new lines
+        :type edit_section: function
+        :param added: the options of profiles to add if they aren't in the file
+        :type added: dict[str, dict[str, str]]
+        """
+        with FileUtils.lock(self.path_to_file):
+            original = self.__read_lines()
+            lines = []
+            found = set()
+            for name, section_lines in self.__split(original):
+                found.add(name)
+                lines.extend(edit_section(name, section_lines))
+            for name, options in added.items():
+                if name in found:
+                    continue
+                if Common.is_debug():
+                    Common.dump_out(message='Adding profile section {}'.format(name))
+                if lines and lines[-1].strip():
+                    lines.append('\n')
+                lines.append('[{}]\n'.format(name))
+                lines.extend('{} = {}\n'.format(option, value) for option, value in options.items()
+                             if value is not None)
+                lines.append('\n')
+            if lines == original:
+                return
+            self.__backup()
+            FileUtils.atomic_write(self.path_to_file, ''.join(lines), mode=None if original else 0o600)
+
+    def __backup(self):
+        """ Keep the current file as "<file>.bak".  It's about to be replaced, so link to it rather than copy it. """
+        backup_file = self.path_to_file + '.bak'
+        if not os.path.isfile(self.path_to_file):
+            return
+        try:
+            temp_link = backup_file + '.tmp'
+            if os.path.lexists(temp_link):
+                os.remove(temp_link)
+            os.link(self.path_to_file, temp_link)
+            os.replace(temp_link, backup_file)
+        except OSError:
+            FileUtils.backup(self.path_to_file)
+
+    def __read_lines(self):
+        try:
+            with open(self.path_to_file, 'r') as file:
+                lines = file.readlines()
+        except (IOError, OSError):
+            return []
+        if lines and not lines[-1].endswith('\n'):
+            lines[-1] += '\n'
+        return lines
+
+    @classmethod
+    def __split(cls, lines):
+        """
+        Split the lines of the file into sections
+        :return: the name (None for lines before the first section) and lines of each section, header included
+        :rtype: [(str, [str])]
+        """
+        sections = [(None, [])]
+        for line in lines:
+            match = cls.SECTION_PATTERN.match(line)
+            if match:
+                sections.append((match.group(1).strip(), [line]))
+            else:
+                sections[-1][1].append(line)
+        return sections if sections[0][1] else sections[1:]
+
+    @classmethod
+    def __options(cls, lines):
+        """
+        Split the lines of a section into options
+        :return: the name in lower case (None for headers, blank lines and comments) and lines of each option,
+            continuation lines included
+        :rtype: [(str, [str])]
+        """
+        options = []
+        for line in lines:
+            match = cls.OPTION_PATTERN.match(line)
+            if match and not cls.SECTION_PATTERN.match(line):
+                options.append((match.group(1).strip().lower(), [line]))
+            elif line.strip() and line[0].isspace() and options and options[-1][0]:
+                options[-1][1].append(line)
+            else:
+                options.append((None, [line]))
+        return options
+
+    @classmethod
+    def __update_section(cls, lines, updates):
+        """
+        Set options in a section, changing existing options where they are and adding new ones at the end
+        :return: the section's new lines
+        :rtype: [str]
+        """
+        updates = {option.lower(): value for option, value in updates.items()}
+        options = []
+        for option, option_lines in cls.__options(lines):
+            if option in updates:
+                value = updates.pop(option)
+                if value is None:
+                    continue
+                option_lines = ['{} = {}\n'.format(option, value)]
+            options.append((option, option_lines))
+
+        # New options go after the section's last option, before any blank lines separating it from the next
+        end = len(options)
+        while end > 1 and options[end - 1][0] is None and not options[end - 1][1][0].strip():
+            end -= 1
+        added = [(option, ['{} = {}\n'.format(option, value)]) for option, value in updates.items()
+                 if value is not None]
+        options[end:end] = added
+        return [line for _, option_lines in options for line in option_lines]
@@ -1,5 +1,3 @@
-import click
-
 from clokta.common import Common
 from clokta.factors import Factors
 
@@ -61,6 +59,7 @@ class FactorChooser(object):
             Common.echo(message=msg, bold=True)
             index += 1
 
+        import click
         raw_choice = None
         try:
             raw_choice = click.prompt('Choose a MFA type to use', type=int, err=Common.to_std_error())
@@ -0,0 +1,97 @@
+'''
+Helpers for safely sharing files between concurrently running clokta processes
+'''
+import os
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:  # Everything but Windows
+    msvcrt = None
+
+
+class FileUtils(object):
+
+    @classmethod
+    @contextmanager
+    def lock(cls, path_to_file):
+        """
+        Hold an exclusive advisory lock for a file while in the context.  The lock is taken on a
+        separate "<file>.lock" file so the file itself can be atomically replaced while locked.
+        :param path_to_file: the file to lock
+        :type path_to_file: str
+        """
+        lock_file = path_to_file + '.lock'
+        cls.ensure_dir(lock_file)
+        fd = os.open(lock_file, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            elif msvcrt:
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+            yield
+        finally:
+            try:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                elif msvcrt:
+                    msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            finally:
+                os.close(fd)
+
+    @classmethod
+    def atomic_write(cls, path_to_file, contents, mode=None):
+        """
+        Write a file so that readers see either the old or the new contents, never a partial write.
+        :param path_to_file: the file to write
+        :type path_to_file: str
+        :param contents: the new contents of the file
+        :type contents: str
+        :param mode: permissions for the file (e.g. 0o600).  If not specified keep the existing file's
+            permissions or use the process default for new files.
+        :type mode: int
+        """
+        cls.ensure_dir(path_to_file)
+        if mode is None and os.path.exists(path_to_file):
+            mode = os.stat(path_to_file).st_mode & 0o777
+        fd, temp_file = tempfile.mkstemp(
+            dir=os.path.dirname(path_to_file),
+            prefix='.' + os.path.basename(path_to_file) + '.',
+            suffix='.tmp'
+        )
+        try:
+            with os.fdopen(fd, 'w') as file:
+                file.write(contents)
+                file.flush()
+                os.fsync(file.fileno())
+            if mode is None:
+                umask = os.umask(0)
+                os.umask(umask)
+                mode = 0o666 & ~umask
+            os.chmod(temp_file, mode)
+            os.replace(temp_file, path_to_file)
+        except Exception:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+
+    @classmethod
+    def backup(cls, path_to_file):
+        """ Copy a file to "<file>.bak" before it is rewritten """
+        if os.path.isfile(path_to_file):
+            with open(path_to_file, 'r') as file:
+                contents = file.read()
+            with open(path_to_file + '.bak', 'w') as bak_file:
+                bak_file.write(contents)
+
+    @classmethod
+    def ensure_dir(cls, path_to_file):
+        """ Make sure the directory a file will be written to exists """
+        directory = os.path.dirname(path_to_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
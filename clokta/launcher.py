@@ -0,0 +1,197 @@
+'''
+The clokta command.  Runs the commands that don't log in without importing click, which takes longer to
+import than those commands take to run, and hands everything else to cloktacli.
+'''
+import json
+import os
+import sys
+
+from clokta import __version__
+from clokta.common import Common
+
+# Flags the main command can reuse fresh keys with, by the output format they ask for
+FRESH_KEYS_FLAGS = ['-q', '--quiet', '-i', '--inline-help']
+
+
+def main():
+    """ Entry point of the clokta command """
+    if not run_fast(sys.argv[1:]):
+        from clokta.cloktacli import assume_role
+        assume_role(prog_name='clokta')
+
+
+def run_fast(args):
+    """
+    Run the command if it is one that doesn't need click: --version, --list-accounts, lookup, or
+    credential-process and logging in when the keys are still good.  Anything less simple, or that turns out
+    to need a login, is left to cloktacli.
+    :param args: the command line arguments
+    :type args: [str]
+    :return: whether the command was run
+    :rtype: bool
+    """
+    if args == ['--version']:
+        show_version()
+        return True
+    if '--list-accounts' in args and set(args) <= {'--list-accounts', '--json'}:
+        list_accounts(as_json='--json' in args)
+        return True
+    if args[:1] == ['lookup']:
+        terms = [arg for arg in args[1:] if not arg.startswith('-')]
+        flags = [arg for arg in args[1:] if arg.startswith('-')]
+        if len(terms) != 1 or not set(flags) <= {'--prefix', '--json'}:
+            return False
+        if not lookup(term=terms[0], prefix='--prefix' in flags, as_json='--json' in flags):
+            sys.exit(1)
+        return True
+    if args[:1] == ['credential-process']:
+        return _credential_process(args[1:])
+    return _reuse_fresh_keys(args)
+
+
+def _credential_process(args):
+    """
+    Print the cached keys for credential-process, if they are still good
+    """
+    parsed = _parse_profile(args, flags=[])
+    if not parsed:
+        return False
+    profile = parsed[0] or os.getenv('AWS_PROFILE')
+    if not profile:
+        return False
+
+    from clokta.role_assumer import RoleAssumer
+    cached = RoleAssumer(profile=profile).cached_credentials()
+    if not cached:
+        return False
+    Common.set_output_format(Common.quiet_out)
+    if not parsed[0]:
+        get_profile_from_env()
+    sys.stdout.write(json.dumps(cached) + '\n')
+    return True
+
+
+def _reuse_fresh_keys(args):
+    """
+    Tell the user how to use the profile's keys, if they are still good
+    """
+    parsed = _parse_profile(args, flags=FRESH_KEYS_FLAGS)
+    if not parsed:
+        return False
+    given_profile, flags = parsed
+    profile = given_profile or os.getenv('AWS_PROFILE')
+    if not profile or ',' in profile:
+        return False
+
+    from clokta.clokta_configuration import CloktaConfiguration
+    from clokta.role_assumer import RoleAssumer
+    assumer = RoleAssumer(profile=profile)
+    clokta_config_file = assumer.data_dir + 'clokta.cfg'
+    if CloktaConfiguration.group_members(profile_name=profile, clokta_config_file=clokta_config_file) != [profile] \
+            or not CloktaConfiguration.remaining_credentials_lifetime(profile_name=profile,
+                                                                      clokta_config_file=clokta_config_file):
+        return False
+    if not given_profile:
+        get_profile_from_env()
+    configure_output_format(verbose=False, inline_help='-i' in flags or '--inline-help' in flags,
+                            quiet='-q' in flags or '--quiet' in flags)
+    return assumer.reuse_fresh_keys()
+
+
+def _parse_profile(args, flags):
+    """
+    :param args: command line arguments
+    :type args: [str]
+    :param flags: the flags allowed besides -p/--profile
+    :type flags: [str]
+    :return: the profile given with -p or --profile (None if not given) and the flags given, or None if the
+        arguments are anything else
+    :rtype: (str, [str])
+    """
+    profile = None
+    given = []
+    remaining = list(args)
+    while remaining:
+        arg = remaining.pop(0)
+        if arg in ('-p', '--profile') and remaining and profile is None:
+            profile = remaining.pop(0)
+        elif arg in flags:
+            given.append(arg)
+        else:
+            return None
+    return profile, given
+
+
+def show_version():
+    sys.stdout.write('clokta, version {}\n'.format(__version__))
+
+
+def list_accounts(as_json):
+    """
+    Output the account number of every profile, as "profile = number" lines or as JSON
+    """
+    from clokta.account_registry import AccountRegistry
+    from clokta.clokta_configuration import CloktaConfiguration
+
+    if as_json:
+        sys.stdout.write(json.dumps(AccountRegistry(data_dir='~/.clokta/').dump(), indent=2, sort_keys=True) + '\n')
+    else:
+        CloktaConfiguration.dump_account_numbers('~/.clokta/clokta.cfg')
+
+
+def lookup(term, prefix, as_json):
+    """
+    Output the profiles for an account number, account alias, profile name, Okta app URL or role ARN
+    :param term: what to look up
+    :type term: str
+    :param prefix: whether to match everything starting with term
+    :type prefix: bool
+    :param as_json: whether to output the matching profiles as JSON
+    :type as_json: bool
+    :return: whether any profile matched, or JSON was output
+    :rtype: bool
+    """
+    from clokta.account_registry import AccountRegistry
+
+    registry = AccountRegistry(data_dir='~/.clokta/')
+    profile_names = registry.find_prefix(term) if prefix else registry.lookup(term)
+    if as_json:
+        sys.stdout.write(json.dumps({name: registry.profile(name) for name in profile_names},
+                                    indent=2, sort_keys=True) + '\n')
+        return True
+    if not profile_names:
+        Common.dump_err('No profile matches {}'.format(term))
+        return False
+    for name in profile_names:
+        entry = registry.profile(name)
+        Common.echo('{name} = {account}{alias}{role}'.format(
+            name=name, account=entry['account'] or 'unknown account',
+            alias=' ({})'.format(entry['alias']) if entry['alias'] else '',
+            role=', last used {}'.format(entry['last_role']) if entry['last_role'] else ''))
+    return True
+
+
+def configure_output_format(verbose, inline_help, quiet):
+    """
+    Reads the three output-related command line flags and determines desired output
+    """
+    if verbose:
+        Common.set_output_format(Common.debugging_out)
+    elif quiet:
+        Common.set_output_format(Common.quiet_out)
+    elif inline_help:
+        Common.set_output_format(Common.long_out)
+    else:
+        Common.set_output_format(Common.brief_out)
+
+
+def get_profile_from_env():
+    """
+    Look up the AWS_PROFILE variable and return it
+    :return: value of AWS_PROFILE, or None if not defined
+    :rtype: str
+    """
+    from_env = os.getenv(key='AWS_PROFILE')
+    if from_env:
+        Common.echo("Using profile '{}' from AWS_PROFILE".format(from_env))
+    return from_env
@@ -0,0 +1,299 @@
+'''
+Counts and times logins for fleet-wide monitoring, written as a Prometheus textfile or sent to StatsD
+'''
+import functools
+import os
+import re
+import threading
+
+from clokta.common import Common
+from clokta.file_utils import FileUtils
+
+
+class Metrics(object):
+    """
+    Records counters and histograms from the login flow (Okta results, MFA push polls and waits, STS session
+    durations refused, HTTP status codes and login latency) and hands them to a sink at the end of the run:
+    a Prometheus textfile, adding to the counts already in it so a node_exporter textfile collector sees the
+    totals of every run, or StatsD over UDP to localhost.  Metrics are off unless a sink is configured, and
+    then recording only updates counts in memory.  The sink is written on a separate thread that is given
+    FLUSH_TIMEOUT seconds, so a slow disk, a locked file or an absent StatsD never holds up a login.
+    """
+
+    SINKS = ['prometheus', 'statsd']
+    DEFAULT_TEXTFILE = '~/.clokta/clokta.prom'
+    DEFAULT_STATSD_PORT = 8125
+    FLUSH_TIMEOUT = 1.0  # Most seconds to wait for the sink at the end of a run
+    MAX_DATAGRAM = 1432  # Largest StatsD packet, to fit in one ethernet frame
+
+    # Every metric recorded: its type, description and, for histograms, bucket upper bounds
+    DEFINITIONS = {
+        'clokta_okta_results_total': ('counter', 'Results of each step of logging into Okta', None),
+        'clokta_mfa_push_polls': ('histogram', 'Times Okta was polled for the answer to a push',
+                                  [1, 2, 5, 10, 20, 50, 100]),
+        'clokta_mfa_push_wait_seconds': ('histogram', 'Seconds waited for the answer to a push',
+                                         [1, 2.5, 5, 10, 20, 30, 60, 120]),
+        'clokta_sts_duration_attempts_total': ('counter', 'Session durations asked of AWS, granted or too long',
+                                               None),
+        'clokta_http_responses_total': ('counter', 'HTTP responses from Okta and STS by status code', None),
+        'clokta_login_seconds': ('histogram', 'Seconds taken to generate keys for a profile, by outcome',
+                                 [0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120]),
+    }
+
+    enabled = False
+    sink = None  # type: str
+    textfile = None  # type: str
+    statsd_port = None  # type: int
+    __lock = threading.Lock()
+    __counts = {}  # by (name, labels): the count
+    __observations = {}  # by (name, labels): the values observed
+
+    @classmethod
+    def configure(cls, sink, textfile=None, statsd_port=None):
+        """
+        Start recording metrics for a sink.  Only the first call has any effect, so the first profile logged
+        into decides where a run's metrics go.
+        :param sink: "prometheus", "statsd" or None to record nothing
+        :type sink: str
+        :param textfile: the Prometheus textfile to write.  Defaults to DEFAULT_TEXTFILE.
+        :type textfile: str
+        :param statsd_port: the localhost UDP port to send StatsD to.  Defaults to DEFAULT_STATSD_PORT.
+        :type statsd_port: int or str
+        """
+        if cls.sink is not None or not sink:
+            return
+        sink = sink.lower()
+        cls.sink = sink
+        if sink not in Metrics.SINKS:
+            Common.dump_err('WARNING: metrics_sink must be one of {}, not {}.  Not recording metrics.'.format(
+                ', '.join(Metrics.SINKS), sink))
+            return
+        cls.textfile = os.path.expanduser(textfile or Metrics.DEFAULT_TEXTFILE)
+        try:
+            cls.statsd_port = int(statsd_port or Metrics.DEFAULT_STATSD_PORT)
+        except ValueError:
+            Common.dump_err('metrics_statsd_port configured with value "{}" when only a number is valid.'.format(
+                statsd_port))
+            cls.statsd_port = Metrics.DEFAULT_STATSD_PORT
+        cls.enabled = True
+
+    @classmethod
+    def increment(cls, name, **labels):
+        """
+        Add one to a counter
+        :param name: the name of the counter, one of DEFINITIONS
+        :type name: str
+        :param labels: what to break the count down by (e.g. code=200)
+        """
+        if not cls.enabled:
+            return
+        key = (name, cls.__labels(labels))
+        with cls.__lock:
+            cls.__counts[key] = cls.__counts.get(key, 0) + 1
+
+    @classmethod
+    def observe(cls, name, value, **labels):
+        """
+        Record a value in a histogram
+        :param name: the name of the histogram, one of DEFINITIONS
+        :type name: str
+        :param value: the value observed
+        :type value: float
+        :param labels: what to break the histogram down by (e.g. outcome='success')
+        """
+        if not cls.enabled:
+            return
+        key = (name, cls.__labels(labels))
+        with cls.__lock:
+            cls.__observations.setdefault(key, []).append(value)
+
+    @classmethod
+    def __labels(cls, labels):
+        return tuple(sorted((label, str(label_value)) for label, label_value in labels.items()))
+
+    @classmethod
+    def counted(cls, name, **labels):
+        """
+        Decorator counting what a function returns, e.g. OktaInitiator.Result.SUCCESS as result="success"
+        :param name: the name of the counter, one of DEFINITIONS
+        :type name: str
+        :param labels: other labels to count the calls with
+        """
+        def decorate(func):
+            @functools.wraps(func)
+            def counted_func(*args, **kwargs):
+                result = func(*args, **kwargs)
+                if cls.enabled:
+                    cls.increment(name, result=str(getattr(result, 'name', result)).lower(), **labels)
+                return result
+            return counted_func
+        return decorate
+
+    @classmethod
+    def count_response(cls, service):
+        """
+        :param service: what is being called, e.g. okta or sts
+        :type service: str
+        :return: a requests response hook counting the status codes of the responses
+        :rtype: function
+        """
+        def hook(response, *args, **kwargs):
+            if cls.enabled:
+                cls.increment('clokta_http_responses_total', service=service, code=response.status_code)
+        return hook
+
+    @classmethod
+    def flush(cls):
+        """
+        Hand everything recorded since the last flush to the sink, waiting at most FLUSH_TIMEOUT seconds
+        """
+        if not cls.enabled:
+            return
+        with cls.__lock:
+            counts, observations = cls.__counts, cls.__observations
+            cls.__counts, cls.__observations = {}, {}
+        if not counts and not observations:
+            return
+        send = cls.__write_textfile if cls.sink == 'prometheus' else cls.__send_statsd
+        flusher = threading.Thread(target=send, args=(counts, observations), name='clokta-metrics', daemon=True)
+        flusher.start()
+        flusher.join(Metrics.FLUSH_TIMEOUT)
+        if flusher.is_alive() and Common.is_debug():
+            Common.dump_out(message='Gave up waiting to write metrics after {} seconds'.format(Metrics.FLUSH_TIMEOUT))
+
+    @classmethod
+    def __write_textfile(cls, counts, observations):
+        """
+        Add the counts to those already in the Prometheus textfile
+        """
+        try:
+            with FileUtils.lock(cls.textfile):
+                totals = cls.__read_textfile()
+                for series, value in cls.__prometheus_series(counts, observations):
+                    totals[series] = totals.get(series, 0) + value
+                FileUtils.atomic_write(cls.textfile, cls.__format_textfile(totals))
+        except (IOError, OSError) as e:
+            Common.dump_err('WARNING: Could not write metrics to {}: {}'.format(cls.textfile, e))
+
+    @classmethod
+    def __prometheus_series(cls, counts, observations):
+        """
+        :return: the name, with labels, and value of every series, with each histogram as cumulative
+            buckets, a sum and a count
+        :rtype: [(str, float)]
+        """
+        series = [(cls.__series_name(name, labels), count) for (name, labels), count in counts.items()]
+        for (name, labels), values in observations.items():
+            for bound in Metrics.DEFINITIONS[name][2] + ['+Inf']:
+                in_bucket = sum(1 for value in values if bound == '+Inf' or value <= bound)
+                series.append((cls.__series_name(name + '_bucket', labels + (('le', str(bound)),)), in_bucket))
+            series.append((cls.__series_name(name + '_sum', labels), sum(values)))
+            series.append((cls.__series_name(name + '_count', labels), len(values)))
+        return series
+
+    @classmethod
+    def __series_name(cls, name, labels):
+        if not labels:
+            return name
+        return '{}{{{}}}'.format(name, ','.join('{}="{}"'.format(label, value.replace('\\', '\\\\').replace(
+            '"', '\\"')) for label, value in labels))
+
+    @classmethod
+    def __read_textfile(cls):
+        """
+        :return: the value of every series already in the textfile
+        :rtype: dict[str, float]
+        """
+        totals = {}
+        try:
+            with open(cls.textfile, 'r') as file:
+                for line in file:
+                    if line.startswith('#') or not line.strip():
+                        continue
+                    series, _, value = line.strip().rpartition(' ')
+                    try:
+                        totals[series] = float(value)
+                    except ValueError:
+                        continue
+        except (IOError, OSError):
+            pass
+        return totals
+
+    @classmethod
+    def __format_textfile(cls, totals):
+        """
+        :param totals: the value of every series
+        :type totals: dict[str, float]
+        :return: the series in the Prometheus text format, with the HELP and TYPE of each metric
+        :rtype: str
+        """
+        by_metric = {}
+        for series in totals:
+            name = re.match(r'[^{]*', series).group(0)
+            base = re.sub(r'_(bucket|sum|count)$', '', name)
+            by_metric.setdefault(base if base in Metrics.DEFINITIONS else name, []).append(series)
+        lines = []
+        for metric in sorted(by_metric):
+            if metric in Metrics.DEFINITIONS:
+                metric_type, description, _ = Metrics.DEFINITIONS[metric]
+                lines += ['# HELP {} {}'.format(metric, description), '# TYPE {} {}'.format(metric, metric_type)]
+            lines += ['{} {}'.format(series, cls.__format_value(totals[series]))
+                      for series in sorted(by_metric[metric], key=cls.__series_order)]
+        return '\n'.join(lines) + '\n'
+
+    @classmethod
+    def __series_order(cls, series):
+        """ Sort a histogram's buckets by their upper bound rather than alphabetically """
+        bound = re.search(r'le="([^"]*)"', series)
+        return re.sub(r',?le="[^"]*"', '', series), float(bound.group(1)) if bound else 0.0
+
+    @classmethod
+    def __format_value(cls, value):
+        return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+    @classmethod
+    def __send_statsd(cls, counts, observations):
+        """
+        Send the counts and observations to StatsD on localhost, with labels as DogStatsD tags.  Seconds are
+        sent as timers in milliseconds, other histograms as histograms.
+        """
+        import socket
+
+        lines = []
+        for (name, labels), count in counts.items():
+            lines.append(cls.__statsd_line(name, count, 'c', labels))
+        for (name, labels), values in observations.items():
+            if name.endswith('_seconds'):
+                lines += [cls.__statsd_line(name, round(value * 1000, 3), 'ms', labels) for value in values]
+            else:
+                lines += [cls.__statsd_line(name, value, 'h', labels) for value in values]
+
+        packets = []
+        for line in lines:
+            if packets and len(packets[-1]) + len(line) < Metrics.MAX_DATAGRAM:
+                packets[-1] += '\n' + line
+            else:
+                packets.append(line)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setblocking(False)
+            for packet in packets:
+                sock.sendto(packet.encode('utf-8'), ('127.0.0.1', cls.statsd_port))
+        except (IOError, OSError) as e:
+            if Common.is_debug():
+                Common.dump_out(message='Could not send metrics to StatsD: {}'.format(e))
+        finally:
+            sock.close()
+
+    @classmethod
+    def __statsd_line(cls, name, value, statsd_type, labels):
+        """
+        :return: a StatsD line like "clokta.login:1520|ms|#outcome:success", dropping the "clokta_" prefix
+            and the "_total" and "_seconds" suffixes of the Prometheus name
+        :rtype: str
+        """
+        name = 'clokta.' + re.sub(r'_(total|seconds)$', '', name[len('clokta_'):])
+        line = '{}:{}|{}'.format(name, value, statsd_type)
+        if labels:
+            line += '|#' + ','.join('{}:{}'.format(label, label_value) for label, label_value in labels)
+        return line
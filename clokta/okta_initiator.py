@@ -2,14 +2,18 @@ import os
 
 from clokta.clokta_configuration import CloktaConfiguration
 import json
-import pickle
 import requests
 import time
+from requests.adapters import HTTPAdapter
 from enum import Enum
-
-from bs4 import BeautifulSoup
+from urllib.parse import urlparse
 
 from clokta.common import Common
+from clokta.cookie_store import CookieStore
+from clokta.metrics import Metrics
+from clokta.poll_schedule import PollSchedule
+from clokta.saml_extractor import SamlExtractor
+from clokta.timings import Timings
 
 
 class OktaInitiator:
@@ -19,7 +23,21 @@ class OktaInitiator:
         NEED_MFA = 2
         SUCCESS = 3
 
-    def __init__(self, data_dir):
+    class SessionState(Enum):
+        DEAD = 1
+        UNKNOWN = 2
+        ALIVE = 3
+
+    SESSION_MARGIN = 60  # Treat an Okta session expiring within this many seconds as already expired
+
+    # Headers sent with every request to Okta.  Individual requests may add to these.
+    DEFAULT_HEADERS = {
+        'Accept': 'application/json',
+        'Content-Type': 'application/json',
+        'Cache-Control': '"no-cache'
+    }
+
+    def __init__(self, data_dir, session=None):
         """
         This class initiates connections with Okta.
         Once you attempt to initiate a connection this object has three states
@@ -27,14 +45,36 @@ class OktaInitiator:
         2) Waiting on MFA - you can submit MFA credentials
         3) Succeeded - you can retrieve the SAML token
 
-        :param data_dir: the directory to store the cookies file
+        :param data_dir: the directory to store cookies in
         :type data_dir: str
+        :param session: an HTTP session to use for all calls to Okta.  If not specified one will be created.
+            Passing one in lets several initiators share pooled connections and cookies.
+        :type session: requests.Session
         """
         self.data_dir = os.path.expanduser(data_dir)
+        self.session = session if session else OktaInitiator.create_session()
         self.saml_assertion = None  # type: str
         self.session_token = None  # type: str
         self.intermediate_state_token = None  # type: str
         self.factors = []  # type: [dict]
+        self.push_poll_count = 0  # type: int
+        self.cookie_orgs = set()  # Okta orgs whose stored cookies have been loaded into the session
+
+    @classmethod
+    def create_session(cls):
+        """
+        Create an HTTP session that keeps connections to Okta alive so the cookie, authentication,
+        MFA and SAML requests of a login all reuse one TCP+TLS connection.
+        :return: a new session with the default Okta headers
+        :rtype: requests.Session
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update(OktaInitiator.DEFAULT_HEADERS)
+        session.hooks['response'].append(Metrics.count_response('okta'))
+        return session
 
     def get_saml_assertion(self):
         """
@@ -43,6 +83,7 @@ class OktaInitiator:
         """
         return self.saml_assertion
 
+    @Metrics.counted('clokta_okta_results_total', step='cookie')
     def initiate_with_cookie(self, clokta_config):
         """
         Request a SAML token from Okta without authenticating but relying on valid Okta cookie
@@ -54,9 +95,76 @@ class OktaInitiator:
         Any other problem thows an exception.
         """
         self.saml_assertion = None
+
+        # Don't bother fetching the app page if we know there is no session for the cookie to ride on
+        state = self.okta_session_state(clokta_config)
+        if state == OktaInitiator.SessionState.UNKNOWN:
+            state = OktaInitiator.SessionState.ALIVE if self.probe_session(clokta_config) \
+                else OktaInitiator.SessionState.DEAD
+        if state == OktaInitiator.SessionState.DEAD:
+            if Common.is_debug():
+                Common.dump_out('No live Okta session.  Skipping request without session token.')
+            return OktaInitiator.Result.INPUT_ERROR
+
         result = self.__request_saml_assertion(configuration=clokta_config, use_session_token=False)
+        if result == OktaInitiator.Result.INPUT_ERROR:
+            self.__cookie_store(clokta_config).record_session(expires_at=None)
         return result
 
+    def okta_session_state(self, clokta_config):
+        """
+        Determine, without contacting Okta, whether there is an Okta session from a previous interaction
+        :param clokta_config: the configuration containing okta connection information
+        :type clokta_config: CloktaConfiguration
+        :return: DEAD if there is no session cookie or Okta has said the session is no longer valid,
+            ALIVE if the session is known to be valid for a while longer, otherwise UNKNOWN
+        :rtype: OktaInitiator.SessionState
+        """
+        cookie_store = self.__cookie_store(clokta_config)
+        session_cookie = cookie_store.session_cookie()
+        if not session_cookie or session_cookie == cookie_store.dead_session:
+            return OktaInitiator.SessionState.DEAD
+        expires_at = cookie_store.session_expires_at
+        if expires_at and expires_at - OktaInitiator.SESSION_MARGIN > time.time():
+            return OktaInitiator.SessionState.ALIVE
+        return OktaInitiator.SessionState.UNKNOWN
+
+    @Timings.timed('okta session probe')
+    def probe_session(self, clokta_config):
+        """
+        Ask Okta whether the session from a previous interaction is still valid and remember when it expires.
+        This is a much smaller request than fetching the app page.
+        :param clokta_config: the configuration containing okta connection information
+        :type clokta_config: CloktaConfiguration
+        :return: False if Okta says there is no valid session, otherwise True
+        :rtype: bool
+        """
+        cookie_store = self.__cookie_store(clokta_config)
+        org_url = self.__deduce_org_url(clokta_config.get('okta_aws_app_url'))
+        url = '{}/api/v1/sessions/me'.format(org_url)
+        try:
+            response = self.session.get(url)
+        except requests.exceptions.RequestException as err:
+            if Common.is_debug():
+                Common.dump_out('Could not check Okta session: {}'.format(err))
+            return True
+
+        if Common.is_debug():
+            Common.dump_out('Checked Okta session.  Response {}: {}'.format(response.status_code, response.content))
+        if response.status_code == requests.codes.ok:  # pylint: disable=E1101
+            try:
+                expires_at = Common.to_epoch(response.json().get('expiresAt'))
+            except ValueError:
+                expires_at = None
+            if expires_at:
+                cookie_store.record_session(expires_at=expires_at)
+            return True
+        elif response.status_code in (401, 403, 404):
+            cookie_store.record_session(expires_at=None)
+            return False
+        return True
+
+    @Metrics.counted('clokta_okta_results_total', step='password')
     def initiate_with_auth(self, clokta_config, mfas_to_fill):
         """
         Start the multistep process of getting a SAML token from Okta.  After this you need to
@@ -102,6 +210,7 @@ class OktaInitiator:
         need_otp = factor['factorType'] != 'push'
         return need_otp
 
+    @Metrics.counted('clokta_okta_results_total', step='mfa')
     def finalize_mfa(self, clokta_config, factor, otp):
         """
         Final step in multistep process of getting a SAML token from Okta.
@@ -118,7 +227,8 @@ class OktaInitiator:
         if factor['factorType'] == 'push':
             result = self.__do_mfa_with_push(
                 factor=factor,
-                state_token=self.intermediate_state_token
+                state_token=self.intermediate_state_token,
+                wait_for=clokta_config.get_int('okta_push_timeout')
             )
         else:
             result = self.__submit_mfa_response(factor=factor, otp=otp)
@@ -158,10 +268,8 @@ class OktaInitiator:
                 )
             )
 
-        soup = BeautifulSoup(response.content, "html.parser")
-        for inputtag in soup.find_all('input'):
-            if inputtag.get('name') == 'SAMLResponse':
-                self.saml_assertion = inputtag.get('value')
+        with Timings.span('saml page parse'):
+            self.saml_assertion = SamlExtractor.extract(response.content, encoding=response.encoding)
 
         if not self.saml_assertion:
             if not use_session_token:
@@ -178,6 +286,7 @@ class OktaInitiator:
         else:
             return OktaInitiator.Result.SUCCESS
 
+    @Timings.timed('saml page fetch')
     def __post_saml_request(self, use_session_token, configuration):
         """
         Send request to SAML token to Okta
@@ -188,28 +297,35 @@ class OktaInitiator:
         :return: the HTTP response
         :rtype: json str
         """
-        cookie_file = self.data_dir + 'clokta.cookies'
+        cookie_store = self.__cookie_store(configuration)
         url = configuration.get('okta_aws_app_url')
         if use_session_token:
             url += '?onetimetoken=' + self.session_token
-        try:
-            with open(cookie_file, 'rb') as f:
-                cookies = pickle.load(f)
-        except Exception:
-            cookies = None
-        response = requests.get(url, cookies=cookies)
+        # The app page is HTML, so don't ask for JSON
+        response = self.session.get(url, headers={'Accept': '*/*', 'Content-Type': None})
 
         if response.status_code == requests.codes.ok:  # pylint: disable=E1101
-            if not cookies:
-                cookies = response.cookies
-            else:
-                cookies.update(response.cookies)
-            with open(cookie_file, 'wb') as f:
-                pickle.dump(cookies, f)
-                return response
+            cookie_store.save(self.session.cookies)
+            return response
         else:
             response.raise_for_status()
 
+    def __cookie_store(self, configuration):
+        """
+        Get the cookie store for the Okta org being logged into and make sure its cookies are in
+        the HTTP session
+        :param configuration: the clokta configuration with 'okta_aws_app_url'
+        :type configuration: CloktaConfiguration
+        :return: the cookie store for the org
+        :rtype: CookieStore
+        """
+        org = self.__deduce_org(configuration.get('okta_aws_app_url'))
+        cookie_store = CookieStore.for_org(data_dir=self.data_dir, org=org)
+        if org not in self.cookie_orgs:
+            cookie_store.load_into(self.session.cookies)
+            self.cookie_orgs.add(org)
+        return cookie_store
+
     def __auth_with_okta(self, configuration):
         """
         Authenticate with Okta.  If no further info is required, return SUCCESS with session_token set.
@@ -255,6 +371,7 @@ class OktaInitiator:
             Common.dump_err('Unexpected response from Okta authentication request')
             raise RuntimeError("Unexpected response from Okta")
 
+    @Timings.timed('okta authn')
     def __post_auth_request(self, configuration):
         """
         Posts a credentials-based authentication to Okta and returns an HTTP response
@@ -264,19 +381,16 @@ class OktaInitiator:
         :rtype: dict
         """
         headers = {
-            'Accept': 'application/json',
-            'Content-Type': 'application/json',
-            'Cache-Control': '"no-cache',
             'Authorization': 'API_TOKEN'
         }
         payload = {
             'username': configuration.get('okta_username'),
             'password': configuration.get('okta_password')
         }
-        org = self.__deduce_org(configuration.get('okta_aws_app_url'))
-        url = 'https://{}/api/v1/authn'.format(org)
+        org_url = self.__deduce_org_url(configuration.get('okta_aws_app_url'))
+        url = '{}/api/v1/authn'.format(org_url)
 
-        response = requests.post(url, data=json.dumps(payload), headers=headers)
+        response = self.session.post(url, data=json.dumps(payload), headers=headers)
         if Common.is_debug():
             Common.dump_out(
                 'Requested password-based authentication with Okta.\n' +
@@ -296,12 +410,20 @@ class OktaInitiator:
         :return: the org's dns name (e.g. mycompany.okta.com)
         :rtype: str
         """
-        start = len('https://')
-        end = app_url.index('/', start+1)
-        org = app_url[start:end]
-        return org
+        return urlparse(app_url).hostname
+
+    def __deduce_org_url(self, app_url):
+        """
+        Pull the base URL of the okta org (e.g. https://mycompany.okta.com) from the Okta app URL.
+        :param app_url: the URL to an okta app (e.g. https://mycompany.okta.com/home/amazon_aws/hd63h3/542)
+        :type app_url: str
+        :return: the org's base URL (e.g. https://mycompany.okta.com)
+        :rtype: str
+        """
+        parsed = urlparse(app_url)
+        return '{}://{}'.format(parsed.scheme, parsed.netloc)
 
-    def __wait_for_push_result(self, state_token, push_response):
+    def __wait_for_push_result(self, state_token, push_response, wait_for):
         """
         A request was sent to Okta querying the status of a push.  Process the response, pull the session
         token from it, and store in self.session_token
@@ -309,37 +431,54 @@ class OktaInitiator:
         :type state_token: str
         :param push_response: the HTTP response from the HTTP request
         :type push_response: json
+        :param wait_for: how many seconds to wait for the user to respond
+        :type wait_for: float
         :return: SUCCESS if response indicates SUCCESS.  INPUT_ERROR if timed out.
         """
         url = push_response['_links']['next']['href']
-        headers = {
-            'Accept': 'application/json',
-            'Content-Type': 'application/json',
-            'Cache-Control': '"no-cache'
-        }
         payload = {
             'stateToken': state_token
         }
 
-        wait_for = 60
-        timeout = time.time() + wait_for
+        schedule = PollSchedule(deadline=wait_for)
+        started_at = time.time()
         response_data = None
         while True:
             Common.echo(message='.', new_line=False)
-            response = requests.post(url, data=json.dumps(payload), headers=headers)
+            response = self.session.post(url, data=json.dumps(payload))
+            schedule.record_poll()
+            hint = PollSchedule.retry_after(response)
             if response.status_code == requests.codes.ok:  # pylint: disable=E1101
                 response_data = response.json()
+            elif response.status_code == requests.codes.too_many_requests:  # pylint: disable=E1101
+                # Okta is rate limiting us.  Back off as asked and poll again.
+                hint = hint if hint is not None else schedule.max_delay
             else:
                 response.raise_for_status()
 
-            if 'sessionToken' in response_data or time.time() > timeout:
+            if response_data and ('sessionToken' in response_data or
+                                  response_data.get('factorResult') in ('REJECTED', 'TIMEOUT')):
+                break
+            if not schedule.wait(hint=hint):
                 break
-            time.sleep(3)
+
+        self.push_poll_count = schedule.polls
+        if response_data and 'sessionToken' in response_data:
+            answer = 'success'
+        else:
+            answer = 'rejected' if response_data and response_data.get('factorResult') == 'REJECTED' else 'timeout'
+        Metrics.observe('clokta_mfa_push_polls', schedule.polls, result=answer)
+        Metrics.observe('clokta_mfa_push_wait_seconds', time.time() - started_at, result=answer)
+        if Common.is_debug():
+            Common.dump_out(message='Polled Okta {} times for push result'.format(schedule.polls))
 
         if response_data and 'sessionToken' in response_data:
             Common.echo(message='Session confirmed')
             self.session_token = response_data['sessionToken']
             return OktaInitiator.Result.SUCCESS
+        elif response_data and response_data.get('factorResult') == 'REJECTED':
+            Common.dump_err(message='Push notification was rejected')
+            return OktaInitiator.Result.INPUT_ERROR
         else:
             msg = 'Timeout expired ({} seconds)'.format(wait_for)
             Common.dump_err(message=msg)
@@ -348,11 +487,6 @@ class OktaInitiator:
     def __okta_mfa_verification(self, factor_dict, state_token, otp_value=None):
         """Sends the MFA token entered and retuns the response"""
         url = factor_dict['_links']['verify']['href']
-        headers = {
-            'Accept': 'application/json',
-            'Content-Type': 'application/json',
-            'Cache-Control': '"no-cache'
-        }
         payload = {
             'stateToken': state_token
         }
@@ -362,7 +496,7 @@ class OktaInitiator:
         data = json.dumps(payload)
         if Common.is_debug():
             Common.dump_out("Sending MFA verification to...\nurl: {}\nbody: {}".format(url, data))
-        response = requests.post(url, data=data, headers=headers)
+        response = self.session.post(url, data=data)
         if Common.is_debug():
             Common.dump_out(
                 "Received {} response from Okta: {}".format(response.status_code, json.dumps(response.json()))
@@ -372,6 +506,7 @@ class OktaInitiator:
         else:
             response.raise_for_status()
 
+    @Timings.timed('mfa verify')
     def __submit_mfa_response(self, factor, otp):
         """
         post one time password to Okta
@@ -408,7 +543,8 @@ class OktaInitiator:
             Common.dump_err(message=msg)
             raise ValueError("Unexpected error with MFA")
 
-    def __do_mfa_with_push(self, factor, state_token):
+    @Timings.timed('mfa push wait')
+    def __do_mfa_with_push(self, factor, state_token, wait_for):
         """
         Send push re: Okta Verify and wait for response.
         If succesful, session token will be stored in self.session_token
@@ -416,22 +552,19 @@ class OktaInitiator:
         :type factor: dict
         :param state_token: token used in MFA back and forth
         :type: str
+        :param wait_for: how many seconds to wait for the user to respond
+        :type wait_for: float
         :return: SUCCESS if push reported success.  INPUT_ERROR if user never responded.  Any other
         possibilities will result in an exception
         :rtype: OktaInitiator.Result
         """
         url = factor['_links']['verify']['href']
-        headers = {
-            'Accept': 'application/json',
-            'Content-Type': 'application/json',
-            'Cache-Control': '"no-cache'
-        }
         payload = {
             'stateToken': state_token
         }
 
         response_data = None
-        response = requests.post(url, data=json.dumps(payload), headers=headers)
+        response = self.session.post(url, data=json.dumps(payload))
         if response.status_code == requests.codes.ok:  # pylint: disable=E1101
             response_data = response.json()
         else:
@@ -444,5 +577,6 @@ class OktaInitiator:
             if 'factorResult' in response_data and response_data['factorResult'] == 'WAITING':
                 return self.__wait_for_push_result(
                     state_token=state_token,
-                    push_response=response_data
+                    push_response=response_data,
+                    wait_for=wait_for
                 )
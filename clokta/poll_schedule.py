@@ -0,0 +1,90 @@
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+
+class PollSchedule(object):
+    """
+    Decides how long to wait between polls of a remote resource that is waiting on a person
+    (e.g. an Okta Verify push).  Polls quickly at first, since most people respond within a couple
+    of seconds, and then backs off with some jitter until a deadline is reached.
+    """
+
+    def __init__(self, deadline, initial_delay=0.5, max_delay=3.0, backoff=1.5, jitter=0.25,
+                 clock=time.time, sleep=time.sleep):
+        """
+        :param deadline: how many seconds from now to give up polling
+        :type deadline: float
+        :param initial_delay: seconds to wait after the first poll
+        :type initial_delay: float
+        :param max_delay: the longest to ever wait between polls unless the server asks for longer
+        :type max_delay: float
+        :param backoff: how much to grow the delay after each poll
+        :type backoff: float
+        :param jitter: fraction of the delay to randomly add or subtract so many clients don't poll in lockstep
+        :type jitter: float
+        :param clock: function returning the current time in seconds
+        :param sleep: function that sleeps for a number of seconds
+        """
+        self.clock = clock
+        self.sleep = sleep
+        self.deadline = deadline
+        self.expires_at = clock() + deadline
+        self.delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.jitter = jitter
+        self.polls = 0
+
+    def expired(self):
+        """
+        :return: whether the deadline has passed
+        :rtype: bool
+        """
+        return self.clock() >= self.expires_at
+
+    def record_poll(self):
+        """ Note that a poll was just made """
+        self.polls += 1
+
+    def wait(self, hint=None):
+        """
+        Sleep until it is time for the next poll.  Never sleeps past the deadline.
+        :param hint: seconds the server asked us to wait (e.g. from a Retry-After header).  Overrides
+            the schedule when present.
+        :type hint: float
+        :return: False if the deadline has passed and there should be no more polls
+        :rtype: bool
+        """
+        if hint is not None:
+            delay = hint
+        else:
+            delay = self.delay * (1 + random.uniform(-self.jitter, self.jitter))
+            self.delay = min(self.delay * self.backoff, self.max_delay)
+
+        remaining = self.expires_at - self.clock()
+        if remaining <= 0:
+            return False
+        self.sleep(max(0, min(delay, remaining)))
+        return True
+
+    @classmethod
+    def retry_after(cls, response):
+        """
+        Read how long the server wants us to wait from an HTTP response's Retry-After header
+        :param response: the HTTP response
+        :type response: requests.Response
+        :return: seconds to wait or None if the server gave no hint
+        :rtype: float
+        """
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
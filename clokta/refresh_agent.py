@@ -0,0 +1,156 @@
+'''
+Keeps profiles' AWS keys fresh in the background
+'''
+import heapq
+import time
+
+from clokta.clokta_configuration import CloktaConfiguration
+from clokta.common import Common
+from clokta.config_file import ConfigFile
+from clokta.metrics import Metrics
+
+
+class RefreshAgent(object):
+    """
+    Regenerates the keys of a set of profiles shortly before they expire, without prompting.  Each refresh
+    uses a cached SAML assertion or the live Okta session, so the agent keeps working for as long as the
+    Okta session lasts.  Profiles due at about the same time are refreshed together, concurrently, with one
+    write of the AWS credentials file.
+    """
+
+    DEFAULT_REFRESH_BEFORE = 600  # Refresh keys this many seconds before they expire
+    BATCH_WINDOW = 120  # Profiles due within this many seconds of each other are refreshed in the same batch
+    RETRY_DELAYS = [60, 300, 900]  # Seconds to wait before retrying a failed refresh, the last repeating
+    MAX_SLEEP = 60  # Wake up at least this often, so a computer waking from sleep doesn't delay refreshes
+
+    def __init__(self, profiles, refresh_before=DEFAULT_REFRESH_BEFORE, data_dir='~/.clokta/',
+                 profiles_location='~/.aws/credentials', clock=time.time, sleep=time.sleep):
+        """
+        :param profiles: the names of the profiles to keep fresh
+        :type profiles: [str]
+        :param refresh_before: how many seconds before keys expire to refresh them
+        :type refresh_before: int
+        :param data_dir: the clokta data directory
+        :type data_dir: str
+        :param profiles_location: the AWS credentials file
+        :type profiles_location: str
+        """
+        self.profiles = list(profiles)
+        self.refresh_before = refresh_before
+        self.data_dir = data_dir
+        self.profiles_location = profiles_location
+        self.clock = clock
+        self.sleep = sleep
+        self.timers = []  # heap of (when to refresh, profile)
+        self.failures = {}  # consecutive failed refreshes by profile
+
+    def run(self, once=False):
+        """
+        Refresh profiles as they come due, forever
+        :param once: refresh only the profiles that are due now and return
+        :type once: bool
+        """
+        members = [member for profile in self.profiles
+                   for member in CloktaConfiguration.group_members(profile, self.data_dir + 'clokta.cfg')]
+        self.profiles = sorted(set(members), key=members.index)
+        self.__check_profiles()
+        for profile in self.profiles:
+            expires_at = CloktaConfiguration.credentials_expiration(profile_name=profile,
+                                                                    clokta_config_file=self.data_dir + 'clokta.cfg',
+                                                                    profiles_location=self.profiles_location)
+            self.__schedule(profile, (expires_at or 0) - self.refresh_before)
+        Common.echo(message='Keeping keys for {} fresh.  Next refresh at {}'.format(
+            ', '.join(self.profiles), self.__timestamp(max(self.timers[0][0], self.clock()))))
+
+        while self.timers:
+            now = self.clock()
+            if self.timers[0][0] > now:
+                if once:
+                    return
+                self.sleep(min(self.timers[0][0] - now, RefreshAgent.MAX_SLEEP))
+                continue
+            due = []
+            while self.timers and self.timers[0][0] <= now + RefreshAgent.BATCH_WINDOW:
+                due.append(heapq.heappop(self.timers)[1])
+            self.refresh(sorted(due))
+
+    def refresh(self, profiles):
+        """
+        Generate new keys for profiles and reschedule them
+        :param profiles: the profiles to refresh
+        :type profiles: [str]
+        :return: the errors for profiles that could not be refreshed
+        :rtype: dict[str, Exception]
+        """
+        start = self.clock()
+        try:
+            results = self.__refresh_all(profiles)
+        except Exception as e:
+            results = {profile: e for profile in profiles}
+        elapsed = self.clock() - start
+
+        refreshed = [p for p in profiles if not isinstance(results[p], BaseException)]
+        errors = {p: results[p] for p in profiles if isinstance(results[p], BaseException)}
+        for profile in refreshed:
+            self.failures.pop(profile, None)
+            expirations = [c['Credentials'].get('Expiration') for c in results[profile]]
+            expires_at = min(e.timestamp() if e else self.clock() + 3600 for e in expirations)
+            # Don't refresh again straight away when the keys don't last longer than refresh_before
+            halfway = self.clock() + (expires_at - self.clock()) / 2
+            self.__schedule(profile, max(expires_at - self.refresh_before, halfway))
+        if refreshed:
+            Common.echo(message='{} Refreshed {} in {:.1f} seconds.  Next refresh at {}'.format(
+                self.__timestamp(start), ', '.join(refreshed), elapsed, self.__timestamp(self.timers[0][0])))
+        for profile, error in sorted(errors.items()):
+            failures = self.failures.get(profile, 0)
+            self.failures[profile] = failures + 1
+            retry_at = self.clock() + RefreshAgent.RETRY_DELAYS[min(failures, len(RefreshAgent.RETRY_DELAYS) - 1)]
+            Common.dump_err('{} Could not refresh {}: {}.  Trying again at {}'.format(
+                self.__timestamp(start), profile, str(error) or type(error).__name__, self.__timestamp(retry_at)))
+            self.__schedule(profile, retry_at)
+        Metrics.flush()
+        return errors
+
+    def __refresh_all(self, profiles):
+        """
+        Generate keys for all the profiles at once, sharing one HTTP session, and save them in one write
+        :return: the credentials of the profile and its chained roles, or the error raised, by profile
+        :rtype: dict[str, [dict] or Exception]
+        """
+        # Imported here so loading the clokta command, which declares the agent's options, doesn't wait for
+        # asyncio and requests
+        import asyncio
+        from clokta.async_engine import AsyncEngine
+        from clokta.okta_initiator import OktaInitiator
+
+        engine = AsyncEngine()
+        session = OktaInitiator.create_session()
+        try:
+            return asyncio.run(self.__generate(engine, session, profiles))
+        finally:
+            engine.close()
+            session.close()
+
+    async def __generate(self, engine, session, profiles):
+        from clokta.async_role_assumer import AsyncRoleAssumer
+
+        outcomes = await AsyncRoleAssumer.assume_profiles(profiles=profiles, engine=engine, data_dir=self.data_dir,
+                                                          session=session, interactive=False)
+        return {p: o if isinstance(o, BaseException) else [o.credentials] + list(o.chained_credentials.values())
+                for p, o in outcomes.items()}
+
+    def __check_profiles(self):
+        """ The agent can't prompt, so every profile must already be set up in clokta.cfg """
+        clokta_cfg = ConfigFile.load(self.data_dir + 'clokta.cfg')
+        missing = [p for p in self.profiles if not clokta_cfg.has_section(p)]
+        if missing:
+            Common.dump_err('No profile {} in clokta.cfg.  Run "clokta -p {}" first.'.format(
+                ', '.join(missing), missing[0]))
+            raise ValueError('Unknown profile')
+
+    def __schedule(self, profile, when):
+        heapq.heappush(self.timers, (when, profile))
+
+    @classmethod
+    def __timestamp(cls, when):
+        return time.strftime('%H:%M:%S', time.localtime(when))
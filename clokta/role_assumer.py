@@ -3,82 +3,201 @@ Code-behind the scenes for the cli application.
 """
 import os
 
-from clokta.aws_cred_generator import AwsCredentialsGenerator
-from clokta.common import Common
-from clokta.okta_initiator import OktaInitiator
 from clokta.clokta_configuration import CloktaConfiguration
+from clokta.common import Common
+from clokta.credential_cache import CredentialCache
+from clokta.timings import Timings
 
 
 class RoleAssumer(object):
     """ Core implementation of clokta """
 
-    def __init__(self, profile):
+    def __init__(self, profile, session=None):
         """
         :param profile: the name of the AWS profile the user wants to clokta into (e.g. pagebuilder)
         :type profile: str
+        :param session: an HTTP session to share with other logins.  If not specified a new one is created.
+        :type session: requests.Session
         """
         self.profile = profile
+        self.session = session
         """folder to store files in"""
         self.data_dir = "~/.clokta/"
         if not os.path.exists(os.path.expanduser(self.data_dir)):
             os.mkdir(os.path.expanduser(self.data_dir))
 
-    def assume_role(self, reset_default_role):
+    def assume_role(self, reset_default_role, role_patterns=None, force=False):
         """
         entry point for the cli tool
         :param reset_default_role: whether to reset whatever the default role is for this profile
         :type reset_default_role: bool
+        :param role_patterns: if specified, assume every role matching these patterns instead of a single role
+        :type role_patterns: List[str]
+        :param force: whether to generate new keys even if the profile's keys are still good
+        :type force: bool
+        :return: the profiles that could not be logged into, with the error for each.  Only logging into a group
+            of profiles or assuming many roles carries on after an error.
+        :rtype: dict[str, Exception]
+        """
+        group = CloktaConfiguration.group_members(profile_name=self.profile,
+                                                  clokta_config_file=self.data_dir + "clokta.cfg")
+        if group != [self.profile]:
+            if role_patterns:
+                Common.dump_err('--roles and --all-roles need a single profile, not {}'.format(self.profile))
+                return {self.profile: ValueError('Cannot assume many roles for a group of profiles')}
+            return self.__assume_group(profiles=group, reset_default_role=reset_default_role, force=force)
+
+        if not (force or reset_default_role or role_patterns) and self.reuse_fresh_keys():
+            return {}
+
+        aws_svc, profiles, failures = self.__run(reset_default_role=reset_default_role, role_patterns=role_patterns)
+        if role_patterns:
+            if profiles:
+                self.output_batch_instructions(profiles=profiles)
+        else:
+            self.output_instructions(docker_file=aws_svc.docker_file, bash_file=aws_svc.bash_file)
+            if len(profiles) > 1 and Common.get_output_format() != Common.quiet_out:
+                Common.echo(message='Keys for chained roles saved to profiles: {}'.format(', '.join(profiles[1:])))
+        return failures
+
+    def reuse_fresh_keys(self):
+        """
+        If the keys clokta last saved for the profile are still good, tell the user how to use them rather
+        than logging in again.  Never prompts, reads the keychain or contacts Okta.
+        :return: whether the keys were still good
+        :rtype: bool
+        """
+        with Timings.span('fresh keys check'):
+            remaining = CloktaConfiguration.remaining_credentials_lifetime(
+                profile_name=self.profile,
+                clokta_config_file=self.data_dir + "clokta.cfg"
+            )
+        if not remaining:
+            return False
+        if Common.get_output_format() != Common.quiet_out:
+            Common.echo(message='Keys for {} are good for another {} minutes.  Use --force to regenerate.'.format(
+                self.profile, int(remaining // 60)))
+        self.output_instructions(docker_file=self.data_dir + self.profile + '.env',
+                                 bash_file=self.data_dir + self.profile + '.sh')
+        return True
+
+    def __assume_group(self, profiles, reset_default_role, force):
+        """
+        Log into several profiles at once, logging in to each Okta org only once, and save all their keys
+        in one update of the credentials file
+        :param profiles: the profiles in the group
+        :type profiles: [str]
+        :return: the profiles that could not be logged into, with the error for each
+        :rtype: dict[str, Exception]
+        """
+        if not (force or reset_default_role):
+            fresh = [profile for profile in profiles if CloktaConfiguration.remaining_credentials_lifetime(
+                profile_name=profile, clokta_config_file=self.data_dir + "clokta.cfg")]
+            if fresh and Common.get_output_format() != Common.quiet_out:
+                Common.echo(message='Keys for {} are still good.  Use --force to regenerate.'.format(', '.join(fresh)))
+            profiles = [profile for profile in profiles if profile not in fresh]
+            if not profiles:
+                return {}
+
+        outcomes = self.__run_group(profiles=profiles, reset_default_role=reset_default_role)
+        errors = {p: o for p, o in outcomes.items() if isinstance(o, BaseException)}
+        for profile, error in sorted(errors.items()):
+            Common.dump_err('Could not generate keys for {}: {}'.format(profile, str(error) or type(error).__name__))
+        written = []
+        for profile, outcome in outcomes.items():
+            if profile not in errors:
+                written += [profile] + sorted(outcome.chained_credentials)
+        if written:
+            self.output_batch_instructions(profiles=written)
+        return errors
+
+    def credential_process(self, force=False):
         """
-        clokta_config_file = self.data_dir + "clokta.cfg"
-
-        clokta_config = CloktaConfiguration(profile_name=self.profile,
-                                            clokta_config_file=clokta_config_file)
-        if reset_default_role:
-            clokta_config.reset_default_role()
-
-        # Attempt to initiate a connection using just cookies
-        okta_initiator = OktaInitiator(data_dir=self.data_dir)
-        result = okta_initiator.initiate_with_cookie(clokta_config)
-
-        # If the cookie is expired or non-existent, INPUT_ERROR will be returned
-        if result == OktaInitiator.Result.INPUT_ERROR:
-            prompt_for_password = clokta_config.get('okta_password') is None
-            mfas = []
-            # Cookie didn't work.  Authenticate with Okta
-            while result == OktaInitiator.Result.INPUT_ERROR:
-                if prompt_for_password:
-                    clokta_config.prompt_for(param_name='okta_password')
-                result = okta_initiator.initiate_with_auth(clokta_config, mfas)
-                if result == OktaInitiator.Result.INPUT_ERROR:
-                    if prompt_for_password:
-                        Common.dump_err("Failure.  Wrong password or misconfigured session.")
-                    else:
-                        Common.dump_err("Saved password may be out of date.")
-                prompt_for_password = True
-
-            if result == OktaInitiator.Result.NEED_MFA:
-                done = False
-                first_time = True
-                while not done:
-                    chosen_factor = clokta_config.determine_mfa_mechanism(mfas, force_prompt=not first_time)
-                    need_otp = okta_initiator.initiate_mfa(factor=chosen_factor)
-                    otp = clokta_config.determine_okta_onetimepassword(chosen_factor, first_time) if need_otp else None
-                    result = okta_initiator.finalize_mfa(clokta_config=clokta_config, factor=chosen_factor, otp=otp)
-                    done = result == OktaInitiator.Result.SUCCESS
-                    first_time = False
-
-        saml_assertion = okta_initiator.saml_assertion
-
-        # We now have a SAML assertion and can generate a AWS Credentials
-        aws_svc = AwsCredentialsGenerator(clokta_config=clokta_config,
-                                          saml_assertion=saml_assertion,
-                                          data_dir=self.data_dir)
-        roles = aws_svc.get_roles()
-        role = clokta_config.determine_role(roles)
-        aws_svc.generate_creds(role)
-        clokta_config.update_configuration()
-
-        self.output_instructions(docker_file=aws_svc.docker_file, bash_file=aws_svc.bash_file)
+        Get keys for the profile in the format AWS SDKs expect from a credential_process.  Keys that are still
+        good are served from a cache.  New keys are only cached, never written to the AWS credentials file,
+        which would take precedence over the credential_process.
+        :param force: whether to generate new keys even if the cached ones are still good
+        :type force: bool
+        :return: the keys (Version, AccessKeyId, SecretAccessKey, SessionToken and Expiration)
+        :rtype: dict
+        """
+        if not force:
+            cached = self.cached_credentials()
+            if cached:
+                return cached
+
+        aws_svc, _, _ = self.__run(reset_default_role=False, role_patterns=None, write_files=False, chain_roles=False)
+        return CredentialCache(data_dir=self.data_dir).put(profile_name=self.profile, credentials=aws_svc.credentials)
+
+    def cached_credentials(self):
+        """
+        :return: the keys cached for the profile in credential_process format, or None if there are none
+            good for longer than the profile's credential_refresh_threshold
+        :rtype: dict
+        """
+        threshold = CloktaConfiguration.refresh_threshold(profile_name=self.profile,
+                                                          clokta_config_file=self.data_dir + "clokta.cfg")
+        return CredentialCache(data_dir=self.data_dir).get(profile_name=self.profile, threshold=threshold)
+
+    def __run(self, reset_default_role, role_patterns, write_files=True, chain_roles=True):
+        """
+        Run the login flow
+        :return: the credentials generator that generated the credentials, the profiles written and the error
+            for each profile whose role could not be assumed
+        :rtype: (AsyncCredentialsGenerator, [str], dict[str, Exception])
+        """
+        # Imported here, not at the top, because they pull in asyncio and requests, which take longer to import
+        # than the commands that don't log in take to run
+        with Timings.span('import login modules'):
+            import asyncio
+            from clokta.async_engine import AsyncEngine
+            from clokta.async_role_assumer import AsyncRoleAssumer
+
+        engine = AsyncEngine()
+        try:
+            async_assumer = AsyncRoleAssumer(profile=self.profile,
+                                             engine=engine,
+                                             data_dir=self.data_dir,
+                                             session=self.session)
+            return asyncio.run(async_assumer.assume_role(reset_default_role=reset_default_role,
+                                                         role_patterns=role_patterns,
+                                                         write_files=write_files,
+                                                         chain_roles=chain_roles))
+        finally:
+            engine.close()
+
+    def __run_group(self, profiles, reset_default_role):
+        """
+        Run the login flow for several profiles at once, sharing one HTTP session
+        :return: by profile, the credentials generator that generated its credentials or the error raised
+        :rtype: dict[str, AsyncCredentialsGenerator or Exception]
+        """
+        with Timings.span('import login modules'):
+            import asyncio
+            from clokta.async_engine import AsyncEngine
+            from clokta.async_role_assumer import AsyncRoleAssumer
+            from clokta.okta_initiator import OktaInitiator
+
+        engine = AsyncEngine()
+        session = self.session or OktaInitiator.create_session()
+        try:
+            return asyncio.run(AsyncRoleAssumer.assume_profiles(profiles=profiles,
+                                                                engine=engine,
+                                                                data_dir=self.data_dir,
+                                                                session=session,
+                                                                reset_default_role=reset_default_role))
+        finally:
+            engine.close()
+            if session is not self.session:
+                session.close()
+
+    def output_batch_instructions(self, profiles):
+        if Common.get_output_format() == Common.quiet_out:
+            return
+        Common.echo(message='AWS keys generated for profiles:')
+        for profile in profiles:
+            Common.echo(message='    {}'.format(profile))
+        Common.echo(message='\nTo use one run\n\texport AWS_PROFILE=«profile»\n')
 
     def output_instructions(self, docker_file, bash_file):
         if Common.get_output_format() == Common.quiet_out:
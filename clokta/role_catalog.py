@@ -0,0 +1,96 @@
+'''
+Remembers which roles each Okta AWS app grants
+'''
+import fnmatch
+import json
+import os
+import time
+
+from clokta.common import Common
+from clokta.file_utils import FileUtils
+from clokta.timings import Timings
+
+
+class RoleCatalog(object):
+    """
+    The roles found in the SAML assertion at each login, keyed by Okta AWS app URL, with when they were seen
+    and the clokta profiles that use the app.  Lets the roles be listed without logging in.  Stored in
+    ~/.clokta/role_catalog.json.
+    """
+
+    CATALOG_FILE = 'role_catalog.json'
+
+    def __init__(self, data_dir):
+        """
+        :param data_dir: the clokta data directory (e.g. ~/.clokta/)
+        :type data_dir: str
+        """
+        self.catalog_file = os.path.join(os.path.expanduser(data_dir), RoleCatalog.CATALOG_FILE)
+
+    def has(self, app_url):
+        """
+        :param app_url: the URL of the Okta AWS app
+        :type app_url: str
+        :return: whether roles have been recorded for the app
+        :rtype: bool
+        """
+        return app_url in self.__read()
+
+    @Timings.timed('role catalog write')
+    def put(self, app_url, roles, profile_name):
+        """
+        Record the roles an app granted at a login
+        :param app_url: the URL of the Okta AWS app
+        :type app_url: str
+        :param roles: the roles in the SAML assertion
+        :type roles: RoleIndex
+        :param profile_name: the clokta profile that logged in
+        :type profile_name: str
+        """
+        try:
+            with FileUtils.lock(self.catalog_file):
+                catalog = self.__read()
+                profiles = set(catalog.get(app_url, {}).get('profiles', []))
+                profiles.add(profile_name)
+                catalog[app_url] = {
+                    'saved_at': time.time(),
+                    'profiles': sorted(profiles),
+                    'roles': [{'account': role.account, 'role_name': role.role_name,
+                               'role_arn': role.role_arn, 'idp_arn': role.idp_arn} for role in roles]
+                }
+                FileUtils.atomic_write(self.catalog_file, json.dumps(catalog, indent=1, sort_keys=True))
+        except (IOError, OSError) as e:
+            Common.dump_err('WARNING: Could not save role catalog: {}'.format(e))
+
+    def find(self, profile_name=None, account=None, role_name=None):
+        """
+        Look up recorded roles
+        :param profile_name: only roles from the app this clokta profile uses
+        :type profile_name: str
+        :param account: a shell-style pattern the account number must match
+        :type account: str
+        :param role_name: a shell-style pattern the role name must match, ignoring case
+        :type role_name: str
+        :return: the matching roles, each with the app_url, profiles and saved_at (an ISO 8601 timestamp) of the
+            login that found it, ordered by account and role name
+        :rtype: [dict]
+        """
+        found = []
+        for app_url, entry in sorted(self.__read().items()):
+            if profile_name and profile_name not in entry.get('profiles', []):
+                continue
+            for role in entry.get('roles', []):
+                if account and not fnmatch.fnmatchcase(role['account'], account):
+                    continue
+                if role_name and not fnmatch.fnmatchcase(role['role_name'].lower(), role_name.lower()):
+                    continue
+                found.append(dict(role, app_url=app_url, profiles=entry.get('profiles', []),
+                                  saved_at=Common.to_iso_timestamp(entry.get('saved_at', 0))))
+        return sorted(found, key=lambda r: (r['account'], r['role_name'], r['app_url']))
+
+    def __read(self):
+        try:
+            with open(self.catalog_file, 'r') as file:
+                return json.load(file)
+        except (IOError, OSError, ValueError):
+            return {}
@@ -1,7 +1,6 @@
 
 ''' RoleChooser class must be instantiated prior to use '''
-
-import click
+from fnmatch import fnmatchcase
 
 from clokta.common import Common
 
@@ -13,8 +12,8 @@ class RoleChooser(object):
 
     def __init__(self, possible_roles, role_preference=None):
         """
-        :param possible_roles: list of possible roles to choose from
-        :type possible_roles: List[AwsRole]
+        :param possible_roles: the possible roles to choose from
+        :type possible_roles: RoleIndex
         :param role_preference: preferred role
         :type role_preference: str
         """
@@ -57,19 +56,38 @@ class RoleChooser(object):
             return role, False
 
         # use the configured role if it matches one from the the SAML assertion
-        for role in self.possible_roles:
-            if role.role_arn == self.role_preference:
-                message = "Using default role '{}'".format(role.role_name)
-                extra_message = '.  Run "clokta --no-default-role" to override.'
-                if Common.get_output_format() == Common.long_out:
-                    Common.echo(message + extra_message)
-                else:
-                    Common.echo(message)
-                return role, True
+        role = self.possible_roles.get(self.role_preference)
+        if role:
+            message = "Using default role '{}'".format(role.role_name)
+            extra_message = '.  Run "clokta --no-default-role" to override.'
+            if Common.get_output_format() == Common.long_out:
+                Common.echo(message + extra_message)
+            else:
+                Common.echo(message)
+            return role, True
 
         # make the user choose
         return self.__prompt_for_role(with_set_default_option=True)
 
+    def match_roles(self, patterns):
+        """
+        Find all the roles matching any of a list of patterns
+        :param patterns: shell-style patterns (e.g. "*Admin*" or "123456789012") matched against each
+            role's name, account number and ARN
+        :type patterns: List[str]
+        :return: the matching roles
+        :rtype: List[AwsRole]
+        """
+        return [
+            role for role in self.possible_roles
+            if any(
+                fnmatchcase(role.role_name, pattern) or
+                fnmatchcase(role.account, pattern) or
+                fnmatchcase(role.role_arn, pattern)
+                for pattern in patterns
+            )
+        ]
+
     def __prompt_for_role(self, with_set_default_option):
         """
         Give the user a choice from the intersection of configured and supported factors
@@ -88,13 +106,14 @@ class RoleChooser(object):
             index += 1
         if with_set_default_option:
             Common.echo('{index} - set a default role'.format(index=index))
+        import click
         raw_choice = None
         try:
             raw_choice = click.prompt(text='Choose a Role ARN to use', type=int, err=Common.to_std_error())
             choice = raw_choice - 1
         except ValueError:
             Common.echo(message='Please select a valid option: you chose: {}'.format(raw_choice))
-            return self.__prompt_for_role()
+            return self.__prompt_for_role(with_set_default_option=with_set_default_option)
 
         if choice == len(self.possible_roles):
             # They want to set a default.  Prompt again (just without the set-default option)
@@ -0,0 +1,89 @@
+'''
+The AWS roles a SAML assertion grants
+'''
+import base64
+import xml.etree.ElementTree as ElementTree
+
+from clokta.awsrole import AwsRole
+
+
+class RoleIndex(object):
+    """
+    The distinct roles in a SAML assertion, in the order Okta listed them, indexed by ARN and by account and
+    role name so choosing the configured role doesn't mean searching every role.
+    """
+
+    SAML_NS = '{urn:oasis:names:tc:SAML:2.0:assertion}'
+    ROLE_ATTRIBUTE = 'https://aws.amazon.com/SAML/Attributes/Role'
+
+    def __init__(self, roles=()):
+        """
+        :param roles: the roles.  Repeats of a role already added are dropped.
+        :type roles: Iterable[AwsRole]
+        """
+        self.roles = []  # type: [AwsRole]
+        self.by_arn = {}  # type: dict[str, AwsRole]
+        self.by_key = {}  # type: dict[(str, str), AwsRole]
+        for role in roles:
+            self.add(role)
+
+    @classmethod
+    def from_saml(cls, saml_assertion):
+        """
+        Read the roles out of a SAML assertion.  Only the values of the Role attribute are read out of the
+        parsed assertion.
+        :param saml_assertion: the base64 encoded SAML assertion
+        :type saml_assertion: str
+        :return: the roles in the assertion
+        :rtype: RoleIndex
+        """
+        index = RoleIndex()
+        root = ElementTree.fromstring(base64.b64decode(saml_assertion))
+        for attribute in root.iter(cls.SAML_NS + 'Attribute'):
+            if attribute.get('Name') == cls.ROLE_ATTRIBUTE:
+                for value in attribute:
+                    if value.text:
+                        index.add(AwsRole(value.text))
+        return index
+
+    def add(self, role):
+        """
+        Add a role unless it is already in the index
+        :param role: the role
+        :type role: AwsRole
+        """
+        key = role.key
+        if key in self.by_key or role.role_arn in self.by_arn:
+            return
+        self.roles.append(role)
+        self.by_arn[role.role_arn] = role
+        self.by_key[key] = role
+
+    def get(self, role_arn):
+        """
+        :param role_arn: the ARN of a role
+        :type role_arn: str
+        :return: the role with that ARN or None if it isn't in the index
+        :rtype: AwsRole
+        """
+        return self.by_arn.get(role_arn) if role_arn else None
+
+    def find(self, account, role_name):
+        """
+        :param account: the AWS account number
+        :type account: str
+        :param role_name: the name of the role
+        :type role_name: str
+        :return: the role with that name in that account or None if it isn't in the index
+        :rtype: AwsRole
+        """
+        return self.by_key.get((account, role_name))
+
+    def __len__(self):
+        return len(self.roles)
+
+    def __iter__(self):
+        return iter(self.roles)
+
+    def __getitem__(self, position):
+        return self.roles[position]
@@ -0,0 +1,114 @@
+'''
+Remembers SAML assertions for the short time they are valid so clokta can switch roles without logging in again
+'''
+import base64
+import json
+import os
+import re
+import time
+
+from clokta.common import Common
+from clokta.file_utils import FileUtils
+from clokta.timings import Timings
+
+
+class SamlAssertionCache(object):
+    """
+    A cache of the SAML assertions Okta generated, keyed by the Okta app URL they were generated for.
+    Assertions are only valid for a few minutes.  The expiration is read from the assertion itself, so
+    an expired assertion is never handed back and sent to AWS.
+    """
+
+    CACHE_FILE = 'saml_assertions.json'
+    SAFETY_MARGIN = 30  # Don't use an assertion that will expire within this many seconds
+
+    # The attributes in the assertion that limit how long it may be used (e.g. NotOnOrAfter="2019-01-02T03:04:05.678Z")
+    NOT_ON_OR_AFTER = re.compile(br'NotOnOrAfter="([0-9T:.\-]+)Z?"')
+
+    def __init__(self, data_dir):
+        """
+        :param data_dir: the clokta data directory (e.g. ~/.clokta/)
+        :type data_dir: str
+        """
+        self.cache_file = os.path.join(os.path.expanduser(data_dir), SamlAssertionCache.CACHE_FILE)
+
+    @Timings.timed('saml cache read')
+    def get(self, app_url):
+        """
+        Get a cached SAML assertion that is still valid
+        :param app_url: the Okta app URL the assertion was generated for
+        :type app_url: str
+        :return: the base64 encoded assertion, or None if there is no assertion or it has expired
+        :rtype: str
+        """
+        entry = self.__read().get(app_url)
+        if entry and entry['expires'] - SamlAssertionCache.SAFETY_MARGIN > time.time():
+            if Common.is_debug():
+                Common.dump_out(message='Using cached SAML assertion valid for {:.0f} more seconds'.format(
+                    entry['expires'] - time.time()))
+            return entry['assertion']
+        return None
+
+    @Timings.timed('saml cache write')
+    def put(self, app_url, saml_assertion):
+        """
+        Remember a SAML assertion until it expires
+        :param app_url: the Okta app URL the assertion was generated for
+        :type app_url: str
+        :param saml_assertion: the base64 encoded assertion
+        :type saml_assertion: str
+        """
+        expires = SamlAssertionCache.expiration(saml_assertion)
+        if not expires:
+            return
+        self.__update(app_url, {'assertion': saml_assertion, 'expires': expires})
+
+    def invalidate(self, app_url):
+        """
+        Forget the cached assertion for an app, e.g. because AWS rejected it
+        :param app_url: the Okta app URL the assertion was generated for
+        :type app_url: str
+        """
+        self.__update(app_url, None)
+
+    @classmethod
+    def expiration(cls, saml_assertion):
+        """
+        Find when a SAML assertion expires.  That is the earliest of the NotOnOrAfter limits in the assertion's
+        Conditions and SubjectConfirmationData.
+        :param saml_assertion: the base64 encoded assertion
+        :type saml_assertion: str
+        :return: the expiration in seconds since the epoch or None if it could not be determined
+        :rtype: float
+        """
+        try:
+            decoded_assertion = base64.b64decode(saml_assertion)
+        except (TypeError, ValueError):
+            return None
+        expirations = []
+        for timestamp in cls.NOT_ON_OR_AFTER.findall(decoded_assertion):
+            parsed = Common.to_epoch(timestamp.decode())
+            if parsed:
+                expirations.append(parsed)
+        return min(expirations) if expirations else None
+
+    def __read(self):
+        try:
+            with open(self.cache_file, 'r') as file:
+                return json.load(file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def __update(self, app_url, entry):
+        try:
+            with FileUtils.lock(self.cache_file):
+                entries = self.__read()
+                now = time.time()
+                entries = {url: e for url, e in entries.items() if e['expires'] > now}
+                if entry:
+                    entries[app_url] = entry
+                else:
+                    entries.pop(app_url, None)
+                FileUtils.atomic_write(self.cache_file, json.dumps(entries), mode=0o600)
+        except (IOError, OSError) as e:
+            Common.dump_err('WARNING: Could not cache SAML assertion: {}'.format(e))
@@ -0,0 +1,99 @@
+'''
+Pulls the SAML assertion out of the HTML page Okta returns for an AWS app
+'''
+import re
+from html.parser import HTMLParser
+
+
+class _FoundSamlResponse(Exception):
+    """ Raised to stop parsing as soon as the SAMLResponse input has been seen """
+
+
+class _SamlResponseParser(HTMLParser):
+    """ Incremental parser that stops at the first <input name="SAMLResponse"> """
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.saml_response = None  # type: str
+
+    def handle_starttag(self, tag, attrs):
+        self.__check_tag(tag, attrs)
+
+    def handle_startendtag(self, tag, attrs):
+        self.__check_tag(tag, attrs)
+
+    def __check_tag(self, tag, attrs):
+        if tag != 'input':
+            return
+        attributes = dict(attrs)
+        if attributes.get('name') == 'SAMLResponse':
+            self.saml_response = attributes.get('value')
+            raise _FoundSamlResponse()
+
+
+class SamlExtractor(object):
+    """
+    Finds the value of the SAMLResponse input in an Okta app page without building a tree of the whole
+    page.  Okta pages are 100KB+ of scripts and styles with the one input we care about near the end.
+    """
+
+    # Okta pages put the form input in a well known form.  Use it to jump straight to the right tag.
+    MARKER = re.compile(r'''<input[^>]*?name\s*=\s*["']?SAMLResponse\b''', re.IGNORECASE)
+    CHUNK_SIZE = 16384
+
+    @classmethod
+    def extract(cls, content, encoding=None):
+        """
+        Find the SAML assertion in an HTML page
+        :param content: the page returned by Okta
+        :type content: bytes or str
+        :param encoding: the encoding of the content if passed in as bytes.  Defaults to utf-8.
+        :type encoding: str
+        :return: the base64 encoded SAML assertion or None if the page does not have one
+        :rtype: str
+        """
+        if isinstance(content, bytes):
+            content = content.decode(encoding or 'utf-8', 'replace')
+
+        # Fast path - find the tag with a scan and only parse that one tag
+        match = cls.MARKER.search(content)
+        if match:
+            end = content.find('>', match.end())
+            if end >= 0:
+                found = cls.__parse(content[match.start():end + 1])
+                if found is not None:
+                    return found
+
+        # Slower path - parse the whole page, but stop as soon as the input is found
+        try:
+            found = cls.__parse(content)
+        except Exception:
+            found = None
+        if found is not None:
+            return found
+
+        # Unusual markup.  Let BeautifulSoup have a go if the page mentions a SAMLResponse at all.
+        if 'SAMLResponse' in content:
+            return cls.__parse_with_soup(content)
+        return None
+
+    @classmethod
+    def __parse(cls, content):
+        parser = _SamlResponseParser()
+        try:
+            for start in range(0, len(content), cls.CHUNK_SIZE):
+                parser.feed(content[start:start + cls.CHUNK_SIZE])
+            parser.close()
+        except _FoundSamlResponse:
+            pass
+        return parser.saml_response
+
+    @classmethod
+    def __parse_with_soup(cls, content):
+        from bs4 import BeautifulSoup
+
+        soup = BeautifulSoup(content, "html.parser")
+        for inputtag in soup.find_all('input'):
+            if inputtag.get('name') == 'SAMLResponse':
+                return inputtag.get('value')
+        return None
@@ -0,0 +1,67 @@
+'''
+Remembers the longest session each AWS role allows
+'''
+import json
+import os
+import threading
+import time
+
+from clokta.common import Common
+from clokta.file_utils import FileUtils
+
+
+class SessionDurationCache(object):
+    """
+    The longest session duration that AWS granted for each role, keyed by role ARN.  AWS only tells us a
+    duration is too long by failing the request, so remembering what worked saves those failed calls next time.
+    """
+
+    CACHE_FILE = 'session_durations.json'
+    RELEARN_AFTER = 7 * 24 * 3600  # Roles' limits can be raised, so occasionally try for longer again
+
+    def __init__(self, data_dir):
+        """
+        :param data_dir: the clokta data directory (e.g. ~/.clokta/)
+        :type data_dir: str
+        """
+        self.cache_file = os.path.join(os.path.expanduser(data_dir), SessionDurationCache.CACHE_FILE)
+        self.durations = self.__read()  # type: dict
+        self.lock = threading.Lock()
+
+    def get(self, role_arn):
+        """
+        :param role_arn: the ARN of the role
+        :type role_arn: str
+        :return: the longest session duration, in seconds, known to work for the role or None if not known
+        :rtype: int
+        """
+        entry = self.durations.get(role_arn)
+        if entry and entry['learned_at'] + SessionDurationCache.RELEARN_AFTER > time.time():
+            return entry['duration']
+        return None
+
+    def put(self, role_arn, duration):
+        """
+        Remember the longest session duration that works for a role
+        :param role_arn: the ARN of the role
+        :type role_arn: str
+        :param duration: the duration in seconds
+        :type duration: int
+        """
+        entry = {'duration': duration, 'learned_at': time.time()}
+        with self.lock:
+            self.durations[role_arn] = entry
+            try:
+                with FileUtils.lock(self.cache_file):
+                    durations = self.__read()
+                    durations[role_arn] = entry
+                    FileUtils.atomic_write(self.cache_file, json.dumps(durations, indent=1, sort_keys=True))
+            except (IOError, OSError) as e:
+                Common.dump_err('WARNING: Could not save session duration: {}'.format(e))
+
+    def __read(self):
+        try:
+            with open(self.cache_file, 'r') as file:
+                return json.load(file)
+        except (IOError, OSError, ValueError):
+            return {}
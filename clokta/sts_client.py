@@ -0,0 +1,296 @@
+'''
+A small client for the AWS STS query API
+'''
+import hashlib
+import hmac
+import os
+import re
+import xml.etree.ElementTree as ElementTree
+from datetime import datetime, timezone
+from urllib.parse import urlencode, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from clokta.common import Common
+from clokta.metrics import Metrics
+
+
+class StsError(Exception):
+    """
+    An error response from STS.  Like botocore's ClientError, the code and message are in
+    response['Error'] so callers can handle either the same way.
+    """
+
+    def __init__(self, code, message, status_code=None):
+        """
+        :param code: the AWS error code (e.g. ValidationError)
+        :type code: str
+        :param message: the AWS error message
+        :type message: str
+        :param status_code: the HTTP status of the response
+        :type status_code: int
+        """
+        super(StsError, self).__init__('An error occurred ({}) when calling STS: {}'.format(code, message))
+        self.response = {'Error': {'Code': code, 'Message': message},
+                         'ResponseMetadata': {'HTTPStatusCode': status_code}}
+
+
+class StsClient(object):
+    """
+    Calls AWS STS over plain HTTPS.  AssumeRoleWithSAML needs no request signing (the SAML assertion
+    is the credential) so clokta can skip importing and configuring boto3, which is most of its startup
+    time and memory.  AssumeRole, for chaining from one role to another, is signed with Signature Version 4
+    using the credentials the client was created with.  Responses are returned in the same shape boto3
+    returns them.
+    """
+
+    API_VERSION = '2011-06-15'
+    NAMESPACE = '{https://sts.amazonaws.com/doc/2011-06-15/}'
+    GLOBAL_ENDPOINT = 'https://sts.amazonaws.com/'
+    TIMEOUT = 30
+
+    def __init__(self, endpoints=None, session=None, pool_size=8, on_failover=None, credentials=None):
+        """
+        :param endpoints: the STS URLs to call, best first.  If one can't be reached the next is tried.  If not
+            specified, AWS_ENDPOINT_URL_STS or AWS_ENDPOINT_URL is used if set, otherwise the global STS endpoint.
+        :type endpoints: [str]
+        :param session: the HTTP session to make calls with.  If not specified one will be created.
+        :type session: requests.Session
+        :param pool_size: the most connections to keep open to STS, i.e. the most calls made at once
+        :type pool_size: int
+        :param on_failover: called with the URL of any endpoint that could not be reached
+        :type on_failover: function
+        :param credentials: the AccessKeyId, SecretAccessKey and SessionToken to sign requests with.  Only
+            needed for assume_role.
+        :type credentials: dict
+        """
+        self.endpoints = endpoints or [StsClient.default_endpoint()]
+        self.endpoint = self.endpoints[0]
+        self.on_failover = on_failover
+        self.credentials = credentials
+        if not session:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=len(self.endpoints), pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.hooks['response'].append(Metrics.count_response('sts'))
+        self.session = session
+
+    @classmethod
+    def default_endpoint(cls):
+        """
+        :return: the STS endpoint to use, honoring the same environment variables as the AWS CLI
+        :rtype: str
+        """
+        return os.environ.get('AWS_ENDPOINT_URL_STS') or os.environ.get('AWS_ENDPOINT_URL') or cls.GLOBAL_ENDPOINT
+
+    def assume_role_with_saml(self, RoleArn, PrincipalArn, SAMLAssertion, DurationSeconds=3600):
+        """
+        Get credentials for a role using a SAML assertion.  Arguments match boto3's.
+        :return: the response with Credentials (AccessKeyId, SecretAccessKey, SessionToken and Expiration
+            as a datetime) and AssumedRoleUser
+        :rtype: dict
+        :raises StsError: if STS returns an error
+        """
+        result = self.__call(action='AssumeRoleWithSAML', params={
+            'RoleArn': RoleArn,
+            'PrincipalArn': PrincipalArn,
+            'SAMLAssertion': SAMLAssertion,
+            'DurationSeconds': str(DurationSeconds)
+        })
+        return self.__to_response(result)
+
+    def with_credentials(self, credentials):
+        """
+        :param credentials: the AccessKeyId, SecretAccessKey and SessionToken to sign requests with
+        :type credentials: dict
+        :return: a client calling the same endpoints over the same HTTP session, signing with the credentials
+        :rtype: StsClient
+        """
+        client = StsClient(endpoints=self.endpoints, session=self.session, on_failover=self.on_failover,
+                           credentials=credentials)
+        client.endpoint = self.endpoint
+        return client
+
+    def assume_role(self, RoleArn, RoleSessionName, DurationSeconds=3600):
+        """
+        Get credentials for a role using the credentials of this client.  Arguments match boto3's.
+        :return: the response with Credentials (AccessKeyId, SecretAccessKey, SessionToken and Expiration
+            as a datetime) and AssumedRoleUser
+        :rtype: dict
+        :raises StsError: if STS returns an error
+        """
+        if not self.credentials:
+            raise StsError(code='MissingAuthenticationToken', message='No credentials to sign AssumeRole with')
+        result = self.__call(action='AssumeRole', params={
+            'RoleArn': RoleArn,
+            'RoleSessionName': RoleSessionName,
+            'DurationSeconds': str(DurationSeconds)
+        })
+        return self.__to_response(result)
+
+    def __call(self, action, params):
+        """
+        Make an STS call
+        :param action: the STS action (e.g. AssumeRoleWithSAML)
+        :type action: str
+        :param params: the parameters of the action
+        :type params: dict[str, str]
+        :return: the <ActionResult> element of the response
+        :rtype: ElementTree.Element
+        """
+        data = dict(params, Action=action, Version=StsClient.API_VERSION)
+        response = self.__post(data, sign=action != 'AssumeRoleWithSAML')
+        try:
+            root = ElementTree.fromstring(response.content)
+        except ElementTree.ParseError:
+            raise StsError(code='InvalidResponse',
+                           message='Unexpected response from {}: HTTP {}'.format(self.endpoint, response.status_code),
+                           status_code=response.status_code)
+        if response.status_code != 200:
+            error = root.find('{ns}Error'.format(ns=StsClient.NAMESPACE))
+            if error is None:
+                error = root.find('Error')
+            if error is None:
+                raise StsError(code='Unknown', message='HTTP {}'.format(response.status_code),
+                               status_code=response.status_code)
+            raise StsError(code=StsClient.__text(error, 'Code'),
+                           message=StsClient.__text(error, 'Message'),
+                           status_code=response.status_code)
+        result = root.find('{ns}{action}Result'.format(ns=StsClient.NAMESPACE, action=action))
+        if result is None:
+            raise StsError(code='InvalidResponse', message='No {}Result in response'.format(action),
+                           status_code=response.status_code)
+        return result
+
+    def __post(self, data, sign=False):
+        """
+        Post to the current endpoint, moving on to the next endpoint if it can't be reached
+        :param data: the form to post
+        :type data: dict[str, str]
+        :param sign: whether to sign the request with the client's credentials
+        :type sign: bool
+        :return: the response
+        :rtype: requests.Response
+        """
+        body = urlencode(sorted(data.items()))
+        remaining = self.endpoints[self.endpoints.index(self.endpoint):]
+        for endpoint in remaining:
+            headers = {'Content-Type': 'application/x-www-form-urlencoded; charset=utf-8'}
+            if sign:
+                headers.update(self.__sign(endpoint, body))
+            try:
+                response = self.session.post(endpoint, data=body, headers=headers, timeout=StsClient.TIMEOUT)
+                self.endpoint = endpoint
+                return response
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if endpoint == remaining[-1]:
+                    raise
+                Common.dump_err('Could not reach {}.  Trying another STS endpoint.'.format(endpoint))
+                if Common.is_debug():
+                    Common.dump_out(message=str(e))
+                if self.on_failover:
+                    self.on_failover(endpoint)
+
+    def __sign(self, endpoint, body):
+        """
+        Sign a POST of a form to STS with AWS Signature Version 4
+        :param endpoint: the URL being posted to
+        :type endpoint: str
+        :param body: the url-encoded form
+        :type body: str
+        :return: the headers to add to the request
+        :rtype: dict[str, str]
+        """
+        url = urlparse(endpoint)
+        region = StsClient.signing_region(endpoint)
+        now = datetime.now(timezone.utc)
+        amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+        scope = '{date}/{region}/sts/aws4_request'.format(date=now.strftime('%Y%m%d'), region=region)
+
+        headers = {
+            'content-type': 'application/x-www-form-urlencoded; charset=utf-8',
+            'host': url.netloc,
+            'x-amz-date': amz_date
+        }
+        if self.credentials.get('SessionToken'):
+            headers['x-amz-security-token'] = self.credentials['SessionToken']
+        signed_headers = ';'.join(sorted(headers))
+        canonical_request = '\n'.join([
+            'POST',
+            url.path or '/',
+            '',
+            ''.join('{}:{}\n'.format(name, headers[name]) for name in sorted(headers)),
+            signed_headers,
+            hashlib.sha256(body.encode('utf-8')).hexdigest()
+        ])
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256',
+            amz_date,
+            scope,
+            hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()
+        ])
+
+        key = ('AWS4' + self.credentials['SecretAccessKey']).encode('utf-8')
+        for part in [now.strftime('%Y%m%d'), region, 'sts', 'aws4_request']:
+            key = hmac.new(key, part.encode('utf-8'), hashlib.sha256).digest()
+        signature = hmac.new(key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+
+        signed = {
+            'X-Amz-Date': amz_date,
+            'Authorization': 'AWS4-HMAC-SHA256 Credential={key}/{scope}, SignedHeaders={headers}, '
+                             'Signature={signature}'.format(key=self.credentials['AccessKeyId'], scope=scope,
+                                                            headers=signed_headers, signature=signature)
+        }
+        if self.credentials.get('SessionToken'):
+            signed['X-Amz-Security-Token'] = self.credentials['SessionToken']
+        return signed
+
+    @classmethod
+    def signing_region(cls, endpoint):
+        """
+        :param endpoint: an STS URL
+        :type endpoint: str
+        :return: the region to sign requests to the endpoint for.  The global endpoint is us-east-1.
+        :rtype: str
+        """
+        match = re.match(r'sts\.([a-z0-9-]+)\.amazonaws\.com', urlparse(endpoint).hostname or '')
+        if match:
+            return match.group(1)
+        if urlparse(endpoint).hostname == 'sts.amazonaws.com':
+            return 'us-east-1'
+        return os.environ.get('AWS_REGION') or os.environ.get('AWS_DEFAULT_REGION') or 'us-east-1'
+
+    @classmethod
+    def __to_response(cls, result):
+        credentials = result.find(cls.NAMESPACE + 'Credentials')
+        if credentials is None:
+            raise StsError(code='InvalidResponse', message='No Credentials in response')
+        response = {
+            'Credentials': {
+                'AccessKeyId': cls.__text(credentials, 'AccessKeyId'),
+                'SecretAccessKey': cls.__text(credentials, 'SecretAccessKey'),
+                'SessionToken': cls.__text(credentials, 'SessionToken'),
+                'Expiration': cls.__to_datetime(cls.__text(credentials, 'Expiration'))
+            }
+        }
+        user = result.find(cls.NAMESPACE + 'AssumedRoleUser')
+        if user is not None:
+            response['AssumedRoleUser'] = {
+                'AssumedRoleId': cls.__text(user, 'AssumedRoleId'),
+                'Arn': cls.__text(user, 'Arn')
+            }
+        return response
+
+    @classmethod
+    def __text(cls, element, tag):
+        child = element.find(cls.NAMESPACE + tag)
+        if child is None:
+            child = element.find(tag)
+        return child.text if child is not None else None
+
+    @classmethod
+    def __to_datetime(cls, timestamp):
+        epoch = Common.to_epoch(timestamp) if timestamp else None
+        return datetime.fromtimestamp(epoch, timezone.utc) if epoch is not None else None
@@ -0,0 +1,152 @@
+'''
+Chooses which AWS STS endpoint clokta calls
+'''
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from clokta.common import Common
+from clokta.file_utils import FileUtils
+
+
+class StsEndpointSelector(object):
+    """
+    Decides which STS endpoints to call, in order of preference.  Clokta can call the global endpoint, one
+    configured region, or (with sts_region set to "auto") whichever candidate region answers fastest.
+    Measured rankings are cached so the regions are only probed once a day.
+    """
+
+    AUTO = 'auto'
+    GLOBAL_ENDPOINT = 'https://sts.amazonaws.com/'
+    DEFAULT_CANDIDATES = 'us-east-1,us-east-2,us-west-2,eu-west-1,eu-central-1,ap-southeast-1,ap-northeast-1'
+    CACHE_FILE = 'sts_regions.json'
+    CACHE_TTL = 24 * 3600  # How long a ranking of regions is trusted before probing again
+    PROBE_TIMEOUT = 2  # Seconds to wait for a region to answer a probe
+
+    def __init__(self, data_dir):
+        """
+        :param data_dir: the clokta data directory (e.g. ~/.clokta/)
+        :type data_dir: str
+        """
+        self.cache_file = os.path.join(os.path.expanduser(data_dir), StsEndpointSelector.CACHE_FILE)
+
+    def endpoints(self, clokta_config):
+        """
+        The STS endpoints to try, best first.  AWS_ENDPOINT_URL_STS or AWS_ENDPOINT_URL, if set, override
+        any configured region.
+        :param clokta_config: the configuration of the profile being logged into
+        :type clokta_config: CloktaConfiguration
+        :return: the endpoint URLs
+        :rtype: [str]
+        """
+        override = os.environ.get('AWS_ENDPOINT_URL_STS') or os.environ.get('AWS_ENDPOINT_URL')
+        if override:
+            return [override]
+        region = (clokta_config.get('sts_region') or '').strip().lower()
+        if not region:
+            return [StsEndpointSelector.GLOBAL_ENDPOINT]
+        if region != StsEndpointSelector.AUTO:
+            return [StsEndpointSelector.endpoint_for(region), StsEndpointSelector.GLOBAL_ENDPOINT]
+
+        candidates = [c.strip() for c in (clokta_config.get('sts_candidate_regions') or
+                                          StsEndpointSelector.DEFAULT_CANDIDATES).split(',') if c.strip()]
+        ranked = self.__cached_ranking(candidates)
+        if not ranked:
+            ranked = self.__probe(candidates)
+            if ranked:
+                self.__save_ranking(candidates, ranked)
+            else:
+                # Couldn't reach any of them, e.g. we're offline.  Don't remember that.
+                ranked = candidates
+        return [StsEndpointSelector.endpoint_for(r) for r in ranked] + [StsEndpointSelector.GLOBAL_ENDPOINT]
+
+    def demote(self, endpoint):
+        """
+        Move a region that could not be reached to the end of the cached ranking so later runs try others first
+        :param endpoint: the endpoint URL that failed
+        :type endpoint: str
+        """
+        try:
+            with FileUtils.lock(self.cache_file):
+                cache = self.__read()
+                if not cache.get('ranked'):
+                    return
+                ranked = cache['ranked']
+                failed = [r for r in ranked if StsEndpointSelector.endpoint_for(r) == endpoint]
+                cache['ranked'] = [r for r in ranked if r not in failed] + failed
+                FileUtils.atomic_write(self.cache_file, json.dumps(cache))
+        except (IOError, OSError) as e:
+            Common.dump_err('WARNING: Could not save STS region ranking: {}'.format(e))
+
+    @classmethod
+    def endpoint_for(cls, region):
+        """
+        :param region: the AWS region (e.g. eu-west-1)
+        :type region: str
+        :return: the URL of the region's STS endpoint
+        :rtype: str
+        """
+        domain = 'amazonaws.com.cn' if region.startswith('cn-') else 'amazonaws.com'
+        return 'https://sts.{region}.{domain}/'.format(region=region, domain=domain)
+
+    def __read(self):
+        try:
+            with open(self.cache_file, 'r') as file:
+                return json.load(file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def __cached_ranking(self, candidates):
+        cache = self.__read()
+        if cache.get('candidates') == candidates and cache.get('measured_at', 0) + StsEndpointSelector.CACHE_TTL > \
+                time.time():
+            return cache.get('ranked')
+        return None
+
+    def __save_ranking(self, candidates, ranked):
+        try:
+            with FileUtils.lock(self.cache_file):
+                FileUtils.atomic_write(self.cache_file, json.dumps(
+                    {'candidates': candidates, 'ranked': ranked, 'measured_at': time.time()}))
+        except (IOError, OSError) as e:
+            Common.dump_err('WARNING: Could not save STS region ranking: {}'.format(e))
+
+    def __probe(self, candidates):
+        """
+        Measure the round trip to each candidate region at once
+        :param candidates: the regions
+        :type candidates: [str]
+        :return: the regions that answered, fastest first, followed by those that didn't, or an empty list
+            if none answered
+        :rtype: [str]
+        """
+        with ThreadPoolExecutor(max_workers=len(candidates) or 1) as executor:
+            latencies = dict(zip(candidates, executor.map(StsEndpointSelector.__round_trip, candidates)))
+        answered = sorted((r for r in candidates if latencies[r] is not None), key=lambda r: latencies[r])
+        if Common.is_debug():
+            Common.dump_out(message='STS round trips: {}'.format(', '.join(
+                '{}={:.0f}ms'.format(r, latencies[r] * 1000) if latencies[r] is not None else '{}=failed'.format(r)
+                for r in candidates)))
+        if not answered:
+            return []
+        return answered + [r for r in candidates if latencies[r] is None]
+
+    @staticmethod
+    def __round_trip(region):
+        """
+        :return: seconds for a request to the region's STS endpoint on an open connection, or None if unreachable
+        :rtype: float
+        """
+        url = StsEndpointSelector.endpoint_for(region)
+        with requests.Session() as session:
+            try:
+                # The first request pays for the TCP and TLS handshakes.  Time the second.
+                session.get(url, timeout=StsEndpointSelector.PROBE_TIMEOUT)
+                start = time.time()
+                session.get(url, timeout=StsEndpointSelector.PROBE_TIMEOUT)
+                return time.time() - start
+            except requests.RequestException:
+                return None
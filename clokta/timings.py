@@ -0,0 +1,147 @@
+'''
+Times the phases of a login for "clokta --timings"
+'''
+import functools
+import json
+import sys
+import threading
+import time
+
+
+class Timings(object):
+    """
+    Records how long each phase of a login (reading clokta.cfg, the keychain, each call to Okta and AWS,
+    waiting for MFA, writing files) takes, and reports them at the end of the run.  Phases running on
+    different threads at the same time are each recorded, so phase times can add up to more than the run.
+    Timings are off unless enabled.  Then span() hands back a span that does nothing and timed() functions
+    only check a flag before running, so instrumented code costs next to nothing.
+    """
+
+    enabled = False
+    __started_at = None  # type: float
+    __spans = []  # type: [(str, float, float, str)] name, start, end and thread of each phase
+
+    @classmethod
+    def enable(cls):
+        """ Start recording, forgetting anything recorded before """
+        cls.__started_at = time.perf_counter()
+        cls.__spans = []
+        cls.enabled = True
+
+    @classmethod
+    def span(cls, name):
+        """
+        Time a phase with "with Timings.span('name'):"
+        :param name: the name of the phase
+        :type name: str
+        :return: a context manager that records the phase if timings are on
+        :rtype: TimingSpan
+        """
+        return TimingSpan(name) if cls.enabled else NO_SPAN
+
+    @classmethod
+    def timed(cls, name):
+        """
+        Decorator timing every call to a function as a phase
+        :param name: the name of the phase
+        :type name: str
+        """
+        def decorate(func):
+            @functools.wraps(func)
+            def timed_func(*args, **kwargs):
+                if not cls.enabled:
+                    return func(*args, **kwargs)
+                with TimingSpan(name):
+                    return func(*args, **kwargs)
+            return timed_func
+        return decorate
+
+    @classmethod
+    def record(cls, name, start, end):
+        """
+        :param name: the name of the phase
+        :type name: str
+        :param start: when the phase started, from time.perf_counter()
+        :type start: float
+        :param end: when the phase ended, from time.perf_counter()
+        :type end: float
+        """
+        cls.__spans.append((name, start, end, threading.current_thread().name))
+
+    @classmethod
+    def results(cls):
+        """
+        :return: the total milliseconds since timings were enabled, every phase in the order they started with
+            its start (relative to enabling timings) and duration in milliseconds, and the count and total
+            milliseconds of each kind of phase
+        :rtype: dict
+        """
+        now = time.perf_counter()
+        spans = sorted(cls.__spans, key=lambda span: span[1])
+        phases = {}
+        for name, start, end, _ in spans:
+            phase = phases.setdefault(name, {'count': 0, 'total_ms': 0.0})
+            phase['count'] += 1
+            phase['total_ms'] += (end - start) * 1000
+        return {
+            'total_ms': round((now - cls.__started_at) * 1000, 1),
+            'spans': [{'name': name, 'start_ms': round((start - cls.__started_at) * 1000, 1),
+                       'duration_ms': round((end - start) * 1000, 1), 'thread': thread}
+                      for name, start, end, thread in spans],
+            'phases': {name: {'count': phase['count'], 'total_ms': round(phase['total_ms'], 1)}
+                       for name, phase in phases.items()}
+        }
+
+    @classmethod
+    def report(cls, as_json=False):
+        """
+        Print the timings to stderr, leaving stdout to the output of the run
+        :param as_json: whether to print JSON rather than a table
+        :type as_json: bool
+        """
+        if not cls.enabled:
+            return
+        results = cls.results()
+        if as_json:
+            sys.stderr.write(json.dumps(results, indent=2) + '\n')
+            return
+        lines = ['', 'Timings (ms)', '{:>9} {:>9}  {}'.format('start', 'took', 'phase')]
+        lines += ['{start_ms:>9.1f} {duration_ms:>9.1f}  {name}'.format(**span) for span in results['spans']]
+        lines += ['', '{:<28} {:>6} {:>9}'.format('phase', 'count', 'total')]
+        lines += ['{:<28} {:>6} {:>9.1f}'.format(name, phase['count'], phase['total_ms'])
+                  for name, phase in sorted(results['phases'].items(), key=lambda item: -item[1]['total_ms'])]
+        lines += ['{:<28} {:>6} {:>9.1f}'.format('whole run', '', results['total_ms']), '']
+        sys.stderr.write('\n'.join(lines) + '\n')
+
+
+class TimingSpan(object):
+    """ A phase being timed.  Use Timings.span() rather than creating directly. """
+
+    __slots__ = ['name', 'start']
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        Timings.record(self.name, self.start, time.perf_counter())
+        return False
+
+
+class NoSpan(object):
+    """ Stands in for a TimingSpan when timings are off """
+
+    __slots__ = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NO_SPAN = NoSpan()
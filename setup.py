@@ -1,33 +1,49 @@
 ''' Define executable setup '''
 import os
+import re
 from setuptools import setup, find_packages
 import warnings
 
+# Read the version without importing clokta, which needs the packages being installed
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'clokta', '__init__.py')) as init_file:
+    version = re.search(r"^__version__ = '([^']+)'", init_file.read(), re.MULTILINE).group(1)
+
 setup(
     name='clokta',
-    version='4.1.3',
+    version=version,
     packages=find_packages(),
     include_package_data=True,
     py_modules=['clokta'],
+    python_requires='>=3.7',
     install_requires=[
         'beautifulsoup4',
-        'boto3',
         'click>=7.0',
         'configparser',
         'enum-compat',
         'keyring',
         'requests'
     ],
+    extras_require={
+        'boto3': ['boto3']
+    },
     entry_points={
         'console_scripts': [
-            'clokta=clokta.cloktacli:assume_role'
+            'clokta=clokta.launcher:main'
         ]
     },
-    namespace_packages=['clokta'],
     author="Robert Antonucci and the WaPo platform tools team",
     author_email="opensource@washingtonpost.com",
     url="https://github.com/washingtonpost/clokta",
-    download_url="https://github.com/washingtonpost/clokta/tarball/4.1.3",
+    download_url="https://github.com/washingtonpost/clokta/tarball/{}".format(version),
     keywords=['okta', 'clokta', 'aws', 'cli'],
-    classifiers=[]
+    classifiers=[
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12'
+    ]
 )